@@ -9,77 +9,813 @@ site columns, navigation, and more.
 Usage:
     python generate_template.py "Create a communication site with a document library..."
     python generate_template.py  # Interactive mode
+    python generate_template.py --serve-validate [--socket /tmp/pnp-validate.sock]
+    python generate_template.py --offline "..."  # Basic parsing only, never imports the OpenAI SDK
 """
 
 import sys
+import io
+import argparse
+import csv
+import importlib
+import importlib.util
 import re
 import uuid
 import json
 import os
+import random
+import time
+import hashlib
+import math
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Dict, List, Any
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
-
-try:
-    from lxml import etree
-    LXML_AVAILABLE = True
-except ImportError:
-    LXML_AVAILABLE = False
-    print("Warning: lxml package not found. XSD validation disabled. Install with: pip install lxml")
-
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
+
+class _LazyModule:
+    """Stand-in for a module that is imported on first attribute access"""
+    
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        setattr(self, attr, value)  # Later lookups skip __getattr__
+        return value
+
+def _module_available(name: str) -> bool:
+    """Whether a module can be imported, without importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+# Heavy optional dependencies are only found here and imported on first use, so fallback-only,
+# validate-only and --offline runs don't pay for them at start-up (see script/benchmarks.py startup).
+etree = _LazyModule("lxml.etree")
+openai = _LazyModule("openai")
+minidom = _LazyModule("xml.dom.minidom")
+asyncio = _LazyModule("asyncio")
+LXML_AVAILABLE = _module_available("lxml")
+OPENAI_AVAILABLE = _module_available("openai")
+DOTENV_AVAILABLE = _module_available("dotenv")
+
+def load_dotenv() -> bool:
+    """python-dotenv's load_dotenv, imported on first use"""
+    from dotenv import load_dotenv as dotenv_load_dotenv
+    return dotenv_load_dotenv()
+
+def warn_missing_dependencies(offline: bool = False) -> None:
+    """Print install hints for missing optional packages (the OpenAI ones are skipped when offline)"""
+    if not LXML_AVAILABLE:
+        print("Warning: lxml package not found. XSD validation disabled. Install with: pip install lxml")
+    if offline:
+        return
+    if not OPENAI_AVAILABLE:
+        print("Warning: openai package not found. Install with: pip install openai")
+    if not DOTENV_AVAILABLE:
+        print("Warning: python-dotenv package not found. Install with: pip install python-dotenv")
+
+def configure_offline() -> None:
+    """Disable the OpenAI SDK for this process: structures come from basic parsing or a replayed cassette"""
+    global OPENAI_AVAILABLE
     OPENAI_AVAILABLE = False
-    print("Warning: openai package not found. Install with: pip install openai")
 
-try:
-    from dotenv import load_dotenv
-    DOTENV_AVAILABLE = True
-except ImportError:
-    DOTENV_AVAILABLE = False
-    print("Warning: python-dotenv package not found. Install with: pip install python-dotenv")
+# PnP Provisioning Schema versions: namespace emitted in templates and XSD used to validate them.
+# XSD files are looked up relative to the working directory; only 2022-09 ships with the tool,
+# other versions can be downloaded from the PnP Provisioning Schema repository next to it.
+SCHEMA_REGISTRY = {
+    "2022-09": {
+        "namespace": "http://schemas.dev.office.com/PnP/2022/09/ProvisioningSchema",
+        "xsd": "ProvisioningSchema-2022-09.xsd"
+    },
+    "2021-03": {
+        "namespace": "http://schemas.dev.office.com/PnP/2021/03/ProvisioningSchema",
+        "xsd": "ProvisioningSchema-2021-03.xsd"
+    },
+    "2020-02": {
+        "namespace": "http://schemas.dev.office.com/PnP/2020/02/ProvisioningSchema",
+        "xsd": "ProvisioningSchema-2020-02.xsd"
+    },
+}
+DEFAULT_SCHEMA_VERSION = "2022-09"
 
-def validate_xml_against_xsd(xml_content: str, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> tuple[bool, list]:
+# PnP Provisioning Schema namespace from official templates (2022-09)
+PNP_NAMESPACE = SCHEMA_REGISTRY[DEFAULT_SCHEMA_VERSION]["namespace"]
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+
+# Compiled XSD validators shared by every validation in this process, keyed by
+# (absolute path, mtime, size, root type) so an edited schema file is recompiled.
+_XSD_SCHEMA_CACHE: Dict[tuple, Any] = {}
+_XSD_CACHE_STATS = {"hits": 0, "misses": 0}
+_XSD_CACHE_LOCK = threading.Lock()
+
+def _get_cached_schema(xsd_path: str, fragment_type: str, compile_schema):
+    """Look up or compile a schema for xsd_path, evicting entries for older versions of the file"""
+    abs_path = os.path.abspath(xsd_path)
+    stat = os.stat(abs_path)
+    key = (abs_path, stat.st_mtime_ns, stat.st_size, fragment_type)
+    
+    with _XSD_CACHE_LOCK:
+        schema = _XSD_SCHEMA_CACHE.get(key)
+        if schema is not None:
+            _XSD_CACHE_STATS["hits"] += 1
+            return schema
+        
+        _XSD_CACHE_STATS["misses"] += 1
+        # Drop stale entries for the same file before compiling the new version
+        for stale_key in [k for k in _XSD_SCHEMA_CACHE if k[0] == abs_path and k[1:3] != key[1:3]]:
+            del _XSD_SCHEMA_CACHE[stale_key]
+        
+        schema = compile_schema(abs_path)
+        _XSD_SCHEMA_CACHE[key] = schema
+        return schema
+
+def get_xsd_schema(xsd_path: str = "ProvisioningSchema-2022-09.xsd"):
     """
-    Validate XML against PnP Provisioning Schema XSD
-    Returns (is_valid, errors_list)
+    Return a compiled lxml XMLSchema for xsd_path, compiling it only once per process.
+    Raises OSError if the file is missing and etree.XMLSchemaParseError if it is invalid.
+    """
+    return _get_cached_schema(xsd_path, None, lambda abs_path: etree.XMLSchema(etree.parse(abs_path)))
+
+def get_schema_entry(version: str = DEFAULT_SCHEMA_VERSION) -> Dict[str, str]:
+    """Return the SCHEMA_REGISTRY entry (namespace and xsd path) for a schema version"""
+    if version not in SCHEMA_REGISTRY:
+        raise ValueError(f"Unknown PnP schema version '{version}', expected one of {', '.join(SCHEMA_REGISTRY)}")
+    return SCHEMA_REGISTRY[version]
+
+def get_xsd_fragment_schema(type_name: str, xsd_path: str = "ProvisioningSchema-2022-09.xsd"):
     """
+    Return a compiled schema that accepts a pnp:<type_name> element as its root, so a single
+    fragment such as a ListInstance can be validated against its complex type on its own.
+    """
+    def compile_fragment(abs_path):
+        target_ns = etree.parse(abs_path).getroot().get("targetNamespace")
+        wrapper = (
+            f'<xsd:schema xmlns:xsd="{XSD_NS}" xmlns:pnp="{target_ns}" targetNamespace="{target_ns}" '
+            f'elementFormDefault="qualified">'
+            f'<xsd:include schemaLocation="{os.path.basename(abs_path)}"/>'
+            f'<xsd:element name="{type_name}" type="pnp:{type_name}"/>'
+            f'</xsd:schema>'
+        )
+        wrapper_doc = etree.fromstring(wrapper, base_url=os.path.join(os.path.dirname(abs_path), "fragment.xsd"))
+        return etree.XMLSchema(wrapper_doc)
+    
+    return _get_cached_schema(xsd_path, type_name, compile_fragment)
+
+def get_xsd_cache_stats() -> Dict[str, int]:
+    """Return hit/miss counters and the number of compiled schemas held in the cache"""
+    with _XSD_CACHE_LOCK:
+        return {
+            "hits": _XSD_CACHE_STATS["hits"],
+            "misses": _XSD_CACHE_STATS["misses"],
+            "compiled": len(_XSD_SCHEMA_CACHE)
+        }
+
+def clear_xsd_cache() -> None:
+    """Forget all compiled schemas and reset the hit/miss counters"""
+    with _XSD_CACHE_LOCK:
+        _XSD_SCHEMA_CACHE.clear()
+        _XSD_CACHE_STATS["hits"] = 0
+        _XSD_CACHE_STATS["misses"] = 0
+
+VALIDATION_TIERS = ("wellformed", "structural", "xsd")
+
+# Python checks for the built-in XSD types used by PnP attributes; other types accept any text
+_XSD_BUILTIN_CHECKS = {
+    "boolean": lambda value: value.strip() in ("true", "false", "1", "0"),
+    "int": lambda value: re.fullmatch(r"[+-]?\d+", value.strip()) is not None
+                         and -2**31 <= int(value) < 2**31,
+    "decimal": lambda value: re.fullmatch(r"[+-]?(\d+(\.\d*)?|\.\d+)", value.strip()) is not None,
+    "double": lambda value: re.fullmatch(r"[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?|[+-]?INF|NaN",
+                                         value.strip()) is not None,
+}
+
+def build_schema_index(xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> Dict[str, Any]:
+    """
+    Derive attribute and child tables from the PnP XSD for the structural pre-check.
+    Returns {"namespace", "elements": {global element: type key}, "types": {type key: table}}
+    where each table lists allowed attributes (with value type, enumeration, patterns and
+    whether they are required), child element types, required children and whether any
+    other children or attributes are allowed (xsd:any / xsd:anyAttribute).
+    Anonymous complex types are keyed "<parent type key>/<element name>".
+    "element_types" maps element names declared with a single type (e.g. ListInstance) to it.
+    """
+    parser = etree.XMLParser(remove_comments=True)
+    root = etree.parse(xsd_path, parser).getroot()
+    target_ns = root.get("targetNamespace")
+    
+    named = {}
+    for child in root:
+        if isinstance(child.tag, str) and child.get("name"):
+            space = "type" if _xsd_local_name(child) in ("complexType", "simpleType") else _xsd_local_name(child)
+            named[(space, child.get("name"))] = child
+    
+    def resolve(node, value):
+        prefix, _, local = value.rpartition(":")
+        namespace = node.nsmap.get(prefix or None)
+        if namespace == XSD_NS:
+            return "xsd", local
+        return ("pnp" if namespace == target_ns else None), local
+    
+    def simple_type_spec(node, type_name=None, simple_elem=None):
+        spec = {"base": "string", "enumeration": None, "patterns": []}
+        if type_name:
+            ns_kind, local = resolve(node, type_name)
+            if ns_kind == "xsd":
+                spec["base"] = local
+                return spec
+            simple_elem = named.get(("type", local)) if ns_kind == "pnp" else None
+        if simple_elem is None:
+            return spec
+        restriction = simple_elem.find(f"{{{XSD_NS}}}restriction")
+        if restriction is None:
+            # Unions and lists are left to the full XSD pass
+            return spec
+        if restriction.get("base"):
+            spec = simple_type_spec(restriction, restriction.get("base"))
+        enumeration = [e.get("value") for e in restriction.findall(f"{{{XSD_NS}}}enumeration")]
+        if enumeration:
+            spec["enumeration"] = enumeration
+        spec["patterns"] = spec["patterns"] + [p.get("value") for p in restriction.findall(f"{{{XSD_NS}}}pattern")]
+        return spec
+    
+    types: Dict[str, Dict[str, Any]] = {}
+    
+    def add_attributes(table, container):
+        for node in container:
+            if not isinstance(node.tag, str):
+                continue
+            kind = _xsd_local_name(node)
+            if kind == "attribute" and node.get("name"):
+                inline = node.find(f"{{{XSD_NS}}}simpleType")
+                table["attributes"][node.get("name")] = {
+                    "type": simple_type_spec(node, node.get("type"), inline),
+                    "required": node.get("use") == "required",
+                }
+            elif kind == "attributeGroup" and node.get("ref"):
+                _, local = resolve(node, node.get("ref"))
+                group = named.get(("attributeGroup", local))
+                if group is not None:
+                    add_attributes(table, group)
+            elif kind == "anyAttribute":
+                table["open_attributes"] = True
+    
+    def add_particles(table, container, key, required):
+        for node in container:
+            if not isinstance(node.tag, str):
+                continue
+            kind = _xsd_local_name(node)
+            optional = node.get("minOccurs") == "0"
+            if kind == "element" and node.get("name"):
+                name = node.get("name")
+                if node.get("type"):
+                    ns_kind, local = resolve(node, node.get("type"))
+                    child_key = build_type(local) if ns_kind == "pnp" else None
+                else:
+                    inline = node.find(f"{{{XSD_NS}}}complexType")
+                    child_key = build_type(f"{key}/{name}", inline) if inline is not None else None
+                table["children"][name] = child_key
+                if required and not optional:
+                    table["required_children"].append(name)
+            elif kind in ("sequence", "all"):
+                add_particles(table, node, key, required and not optional)
+            elif kind == "choice":
+                add_particles(table, node, key, False)
+            elif kind == "any":
+                table["open_children"] = True
+    
+    def build_type(key, complex_elem=None):
+        if key in types:
+            return key
+        if complex_elem is None:
+            complex_elem = named.get(("type", key))
+            if complex_elem is None or _xsd_local_name(complex_elem) != "complexType":
+                # Simple-typed elements only carry text, which the full XSD pass checks
+                return None
+        table = {"attributes": {}, "children": {}, "required_children": [],
+                 "open_children": False, "open_attributes": False}
+        # Register before recursing so recursive types terminate
+        types[key] = table
+        
+        content = complex_elem
+        for wrapper in ("complexContent", "simpleContent"):
+            wrapped = complex_elem.find(f"{{{XSD_NS}}}{wrapper}")
+            if wrapped is not None:
+                derivation = wrapped.find(f"{{{XSD_NS}}}extension")
+                if derivation is None:
+                    derivation = wrapped.find(f"{{{XSD_NS}}}restriction")
+                content = derivation
+                ns_kind, local = resolve(derivation, derivation.get("base", ""))
+                base_key = build_type(local) if ns_kind == "pnp" else None
+                if base_key and _xsd_local_name(derivation) == "extension":
+                    base = types[base_key]
+                    table["attributes"].update(base["attributes"])
+                    table["children"].update(base["children"])
+                    table["required_children"].extend(base["required_children"])
+                    table["open_children"] = table["open_children"] or base["open_children"]
+                    table["open_attributes"] = table["open_attributes"] or base["open_attributes"]
+        
+        add_particles(table, content, key, True)
+        add_attributes(table, content)
+        return key
+    
+    elements = {}
+    for (space, name), node in named.items():
+        if space == "element":
+            _, local = resolve(node, node.get("type", ""))
+            elements[name] = build_type(local)
+        elif space == "type":
+            build_type(name)
+    
+    # Element name -> type key for names declared with a single type anywhere in the schema
+    element_types = dict(elements)
+    ambiguous = set()
+    for table in types.values():
+        for name, child_key in table["children"].items():
+            if child_key is None:
+                continue
+            if element_types.setdefault(name, child_key) != child_key:
+                ambiguous.add(name)
+    for name in ambiguous:
+        del element_types[name]
+    
+    return {"namespace": target_ns, "elements": elements, "element_types": element_types, "types": types}
+
+SCHEMA_INDEX_CACHE_DIR = "schema-index-cache"
+SCHEMA_INDEX_VERSION = 1
+
+def load_or_build_schema_index(xsd_path: str, cache_dir: str = SCHEMA_INDEX_CACHE_DIR) -> Dict[str, Any]:
+    """
+    Load the build_schema_index tables for xsd_path from cache_dir, building and saving them
+    on first use. Files are named after the schema's SHA-256, so an edited schema gets a new index.
+    """
+    schema_hash = schema_file_hash(xsd_path)
+    cache_file = Path(cache_dir) / f"{Path(xsd_path).stem}.{schema_hash[:16]}.json"
+    
+    try:
+        cached = json.loads(cache_file.read_text(encoding='utf-8'))
+        if cached.get("index_version") == SCHEMA_INDEX_VERSION and cached.get("schema_sha256") == schema_hash:
+            return cached["index"]
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    index = build_schema_index(xsd_path)
+    try:
+        cache_file.parent.mkdir(exist_ok=True)
+        cache_file.write_text(json.dumps({
+            "index_version": SCHEMA_INDEX_VERSION,
+            "schema_sha256": schema_hash,
+            "index": index
+        }), encoding='utf-8')
+    except OSError as e:
+        print(f"⚠️  Could not save schema index: {e}")
+    return index
+
+def get_schema_index(xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> Dict[str, Any]:
+    """Return the build_schema_index tables for xsd_path, loaded from disk or built once per process"""
+    return _get_cached_schema(xsd_path, "#index", load_or_build_schema_index)
+
+class TemplateAttributeError(ValueError):
+    """Raised by build_pnp_tree when an attribute is not allowed on, or not valid for, a PnP element"""
+    
+    def __init__(self, element_name: str, attribute: str, value: str, reason: str):
+        self.element_name = element_name
+        self.attribute = attribute
+        self.value = value
+        super().__init__(f"pnp:{element_name} attribute '{attribute}' = '{value}': {reason}")
+
+def attribute_checker(index: Dict[str, Any]):
+    """
+    Return check(element, name, value) for build_pnp_tree that raises TemplateAttributeError
+    when a PnP element does not allow the attribute or the value does not match its XSD type.
+    Lookups are by element tag, or by xsi:type when the element carries one.
+    """
+    namespace = index["namespace"]
+    types = index["types"]
+    tables = {f"{{{namespace}}}{name}": types[key] for name, key in index["element_types"].items() if key in types}
+    xsi_type_attr = f"{{{XSI_NAMESPACE}}}type"
+    
+    def check(element, name: str, value: str) -> None:
+        if name.startswith("{"):
+            return
+        xsi_type = element.get(xsi_type_attr)
+        table = types.get(xsi_type.rpartition(":")[2]) if xsi_type else tables.get(element.tag)
+        if table is None:
+            return
+        attribute = table["attributes"].get(name)
+        if attribute is None:
+            if not table["open_attributes"]:
+                raise TemplateAttributeError(element.tag.rpartition("}")[2], name, value,
+                                             "attribute not allowed by the schema")
+        elif not check_attribute_value(value, attribute["type"]):
+            raise TemplateAttributeError(element.tag.rpartition("}")[2], name, value,
+                                         f"expected {describe_attribute_type(attribute['type'])}")
+    
+    return check
+
+def check_attribute_value(value: str, type_spec: Dict[str, Any]) -> bool:
+    """Check an attribute value against a type spec from build_schema_index"""
+    check = _XSD_BUILTIN_CHECKS.get(type_spec["base"])
+    if check and not check(value):
+        return False
+    if type_spec["enumeration"] is not None and value not in type_spec["enumeration"]:
+        return False
+    return all(re.fullmatch(pattern, value) for pattern in type_spec["patterns"])
+
+def describe_attribute_type(type_spec: Dict[str, Any]) -> str:
+    """Human-readable form of a type spec from build_schema_index, for error messages"""
+    if type_spec["enumeration"] is not None:
+        return f"one of {type_spec['enumeration']}"
+    if type_spec["patterns"]:
+        return f"xsd:{type_spec['base']} matching {' and '.join(type_spec['patterns'])}"
+    return f"xsd:{type_spec['base']}"
+
+def _element_location(element) -> str:
+    """Prefix for structural errors: source line when parsed from text, element path otherwise"""
+    if element.sourceline:
+        return f"Line {element.sourceline}"
+    return f"Element {element.getroottree().getpath(element)}"
+
+def structural_check(root, index: Dict[str, Any], max_errors: int = None) -> list:
+    """
+    Walk an lxml tree using the build_schema_index tables and report unknown or missing
+    attributes, bad attribute values, unexpected children and missing required children.
+    Content under xsd:any is not descended into. Stops once max_errors errors are found.
+    """
+    namespace = index["namespace"]
+    types = index["types"]
+    errors = []
+    
+    def report(element, message):
+        errors.append(f"{_element_location(element)}: Element '{etree.QName(element).localname}': {message}")
+        return max_errors is not None and len(errors) >= max_errors
+    
+    root_name = etree.QName(root)
+    if root_name.namespace != namespace or root_name.localname not in index["elements"]:
+        report(root, "No matching global declaration available for the validation root.")
+        return errors
+    
+    pending = [(root, index["elements"][root_name.localname])]
+    while pending:
+        element, type_key = pending.pop()
+        
+        # xsi:type selects a derived type such as pnp:TeamSite
+        xsi_type = element.get(f"{{{XSI_NAMESPACE}}}type")
+        if xsi_type:
+            derived = xsi_type.rpartition(":")[2]
+            if derived not in types:
+                if report(element, f"The xsi:type '{xsi_type}' does not resolve to a known type."):
+                    return errors
+                continue
+            type_key = derived
+        
+        table = types.get(type_key) if type_key else None
+        if table is None:
+            continue
+        
+        for name, value in element.attrib.items():
+            if name.startswith("{"):
+                continue
+            attribute = table["attributes"].get(name)
+            if attribute is None:
+                if not table["open_attributes"] and report(element, f"The attribute '{name}' is not allowed."):
+                    return errors
+            elif not check_attribute_value(value, attribute["type"]):
+                expected = describe_attribute_type(attribute["type"])
+                if report(element, f"Attribute '{name}': '{value}' is not a valid value. Expected {expected}."):
+                    return errors
+        
+        for name, attribute in table["attributes"].items():
+            if attribute["required"] and name not in element.attrib:
+                if report(element, f"The attribute '{name}' is required but missing."):
+                    return errors
+        
+        present = set()
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue
+            child_name = etree.QName(child)
+            if child_name.namespace == namespace and child_name.localname in table["children"]:
+                present.add(child_name.localname)
+                pending.append((child, table["children"][child_name.localname]))
+            elif not table["open_children"]:
+                if report(child, "This element is not expected."):
+                    return errors
+        
+        for name in table["required_children"]:
+            if name not in present:
+                if report(element, f"Missing child element 'pnp:{name}'."):
+                    return errors
+    
+    return errors
+
+def _format_xsd_error(error) -> str:
+    """Format an lxml schema error with its line when parsed from text, or its element path for in-memory trees"""
+    if error.line:
+        return f"Line {error.line}, Column {error.column}: {error.message}"
+    return f"Element {error.path}: {error.message}"
+
+def validate_template(xml, tier: str = "xsd", xsd_path: str = "ProvisioningSchema-2022-09.xsd",
+                      max_errors: int = None) -> tuple[bool, list]:
+    """
+    Validate a PnP template at the requested tier. Each tier includes the ones before it:
+      - "wellformed": the XML parses
+      - "structural": attributes, enumerations and required children against tables
+        derived from the XSD (build_schema_index); catches most mistakes in microseconds
+      - "xsd": full validation against the compiled XSD
+    xml may be a string, bytes or an lxml element (validated without reparsing).
+    max_errors caps how many errors are returned. The structural tier stops checking at the cap;
+    the xsd tier only trims its output, as libxml2 always validates the whole document.
+    Returns (is_valid, errors_list).
+    """
+    if tier not in VALIDATION_TIERS:
+        raise ValueError(f"Unknown validation tier '{tier}', expected one of {', '.join(VALIDATION_TIERS)}")
+    
     if not LXML_AVAILABLE:
-        return False, ["lxml package not available for XSD validation"]
+        if tier != "wellformed":
+            return False, ["lxml package not available for XSD validation"]
+        try:
+            ET.fromstring(xml)
+            return True, []
+        except ET.ParseError as e:
+            return False, [f"Not well-formed: {e}"]
+    
+    # Tier 1: well-formedness
+    if isinstance(xml, (str, bytes)):
+        try:
+            xml_doc = etree.fromstring(xml.encode('utf-8') if isinstance(xml, str) else xml)
+        except etree.XMLSyntaxError as e:
+            return False, [f"Line {e.lineno}, Column {e.offset}: Not well-formed: {e.msg}"]
+    else:
+        xml_doc = xml
+    if tier == "wellformed":
+        return True, []
     
     try:
         # Check if XSD file exists
         if not os.path.exists(xsd_path):
             return False, [f"XSD schema file not found: {xsd_path}"]
         
-        # Read XSD schema
-        with open(xsd_path, 'r', encoding='utf-8') as f:
-            xsd_content = f.read()
-        
-        # Parse XSD
-        xsd_doc = etree.fromstring(xsd_content.encode('utf-8'))
-        xsd_schema = etree.XMLSchema(xsd_doc)
-        
-        # Parse XML to validate
-        xml_doc = etree.fromstring(xml_content.encode('utf-8'))
+        # Tier 2: structural pre-check from the XSD-derived tables
+        if tier == "structural":
+            errors = structural_check(xml_doc, get_schema_index(xsd_path), max_errors)
+            return not errors, errors
         
-        # Validate
+        # Tier 3: full XSD, compiled once per process and reused for every template
+        xsd_schema = get_xsd_schema(xsd_path)
         is_valid = xsd_schema.validate(xml_doc)
         errors = []
         
         if not is_valid:
             for error in xsd_schema.error_log:
-                errors.append(f"Line {error.line}, Column {error.column}: {error.message}")
+                if max_errors is not None and len(errors) >= max_errors:
+                    break
+                errors.append(_format_xsd_error(error))
         
         return is_valid, errors
         
     except Exception as e:
         return False, [f"Validation error: {str(e)}"]
 
+def validate_xml_against_xsd(xml_content: str, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> tuple[bool, list]:
+    """
+    Validate XML against PnP Provisioning Schema XSD
+    Returns (is_valid, errors_list)
+    """
+    return validate_template(xml_content, "xsd", xsd_path)
+
+def validate_xml_tree(xml_tree, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> tuple[bool, list]:
+    """
+    Validate an lxml tree from build_pnp_tree directly, without serializing and reparsing it.
+    Returns (is_valid, errors_list); errors carry the element path since an in-memory tree has no line numbers.
+    """
+    return validate_template(xml_tree, "xsd", xsd_path)
+
+class ListValidationError(ValueError):
+    """Raised in fail-fast mode when a generated pnp:ListInstance does not match the schema"""
+    
+    def __init__(self, list_title: str, errors: list):
+        self.list_title = list_title
+        self.errors = errors
+        super().__init__(f"List '{list_title}' is invalid: {errors[0] if errors else 'unknown error'}")
+
+def validate_list_instance(list_instance, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> list:
+    """
+    Validate one pnp:ListInstance element against the ListInstance complex type.
+    Returns a list of errors prefixed with the list title. View content sits under xsd:any in
+    the schema, so errors never point inside a view.
+    """
+    schema = get_xsd_fragment_schema("ListInstance", xsd_path)
+    if schema.validate(list_instance):
+        return []
+    
+    list_title = list_instance.get("Title", "Unknown")
+    return [f"List '{list_title}': {error.message}" for error in schema.error_log]
+
+# Child elements the generator emits for each container type of the PnP schema.
+# Optional children not listed here are dropped from the pruned schema; every
+# type that is still reachable afterwards is kept whole (e.g. ListInstance).
+PRUNED_XSD_KEEP_CHILDREN = {
+    "Provisioning": {"Tenant", "Templates", "Sequence"},
+    "Tenant": {"Themes"},
+    "Templates": {"ProvisioningTemplate"},
+    "ProvisioningTemplate": {"WebSettings", "Features", "Lists", "Navigation"},
+    "Sequence": {"SiteCollections"},
+    "SiteCollection": {"Templates"},
+}
+
+# Types only reachable through xsi:type on pnp:SiteCollection
+PRUNED_XSD_EXTRA_TYPES = ("TeamSite", "CommunicationSite")
+
+def _xsd_local_name(element) -> str:
+    return etree.QName(element).localname
+
+def _resolve_xsd_reference(element, value: str, target_ns: str):
+    """Resolve a QName attribute value to a local name in target_ns, or None for foreign names"""
+    prefix, _, local = value.rpartition(":")
+    namespace = element.nsmap.get(prefix or None)
+    return local if namespace == target_ns else None
+
+def build_pruned_xsd(xsd_path: str, output_path: str) -> Dict[str, int]:
+    """
+    Write a reduced copy of the PnP schema that only describes what structure_to_pnp_xml emits.
+    Walks the XSD from the Provisioning element, drops optional children the generator never
+    produces (PRUNED_XSD_KEEP_CHILDREN) and removes every type left unreachable.
+    Returns size and type counts for the full and pruned schemas.
+    """
+    parser = etree.XMLParser(remove_blank_text=True, remove_comments=True)
+    tree = etree.parse(xsd_path, parser)
+    root = tree.getroot()
+    target_ns = root.get("targetNamespace")
+    
+    # Documentation does not affect validation
+    for annotation in list(root.iter(f"{{{XSD_NS}}}annotation")):
+        annotation.getparent().remove(annotation)
+    
+    # Global definitions by symbol space; complex and simple types share one
+    definitions = {}
+    for child in root:
+        kind = _xsd_local_name(child)
+        if child.get("name"):
+            space = "type" if kind in ("complexType", "simpleType") else kind
+            definitions[(space, child.get("name"))] = child
+    total_types = sum(1 for space, _ in definitions if space == "type")
+    
+    # Drop optional children the generator never emits from the container types
+    for type_name, keep in PRUNED_XSD_KEEP_CHILDREN.items():
+        type_elem = definitions[("type", type_name)]
+        for child in list(type_elem.iter(f"{{{XSD_NS}}}element")):
+            owner = next(a for a in child.iterancestors(f"{{{XSD_NS}}}complexType"))
+            if owner is type_elem and child.get("name") not in keep and child.get("minOccurs") == "0":
+                child.getparent().remove(child)
+    
+    # Mark everything reachable from the Provisioning element
+    reachable = set()
+    pending = [("element", "Provisioning")] + [("type", name) for name in PRUNED_XSD_EXTRA_TYPES]
+    while pending:
+        key = pending.pop()
+        if key in reachable or key not in definitions:
+            continue
+        reachable.add(key)
+        for node in definitions[key].iter(f"{{{XSD_NS}}}*"):
+            kind = _xsd_local_name(node)
+            references = []
+            for attr in ("type", "base", "itemType"):
+                if node.get(attr):
+                    references.append(("type", node.get(attr)))
+            for member in (node.get("memberTypes") or "").split():
+                references.append(("type", member))
+            if node.get("ref") and kind in ("element", "attributeGroup", "group", "attribute"):
+                references.append((kind, node.get("ref")))
+            for space, value in references:
+                local = _resolve_xsd_reference(node, value, target_ns)
+                if local:
+                    pending.append((space, local))
+    
+    for key, definition in definitions.items():
+        if key not in reachable:
+            root.remove(definition)
+    
+    tree.write(output_path, xml_declaration=True, encoding="utf-8", pretty_print=True)
+    
+    return {
+        "full_bytes": os.path.getsize(xsd_path),
+        "pruned_bytes": os.path.getsize(output_path),
+        "full_types": total_types,
+        "pruned_types": sum(1 for space, _ in reachable if space == "type"),
+    }
+
+VALIDATION_CACHE_PATH = "validation-cache.sqlite3"
+VALIDATION_CACHE_MAX_ENTRIES = 2000
+
+# SHA-256 of schema files, keyed by (absolute path, mtime, size) like the compiled schema cache
+_SCHEMA_HASH_CACHE: Dict[tuple, str] = {}
+
+def schema_file_hash(xsd_path: str) -> str:
+    """Return the SHA-256 hex digest of an XSD file, hashing each file version only once"""
+    abs_path = os.path.abspath(xsd_path)
+    stat = os.stat(abs_path)
+    key = (abs_path, stat.st_mtime_ns, stat.st_size)
+    if key not in _SCHEMA_HASH_CACHE:
+        with open(abs_path, 'rb') as f:
+            _SCHEMA_HASH_CACHE[key] = hashlib.sha256(f.read()).hexdigest()
+    return _SCHEMA_HASH_CACHE[key]
+
+def validation_cache_key(xml_content: str, xsd_path: str) -> str:
+    """Cache key for a validation verdict: SHA-256 of the XML bytes plus the schema file hash"""
+    xml_hash = hashlib.sha256(xml_content.encode('utf-8')).hexdigest()
+    return f"{xml_hash}:{schema_file_hash(xsd_path)}"
+
+def _open_validation_cache(cache_path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the SQLite validation result cache"""
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS validation_results ("
+        " cache_key TEXT PRIMARY KEY,"
+        " is_valid INTEGER NOT NULL,"
+        " errors TEXT NOT NULL,"
+        " last_used REAL NOT NULL)"
+    )
+    return conn
+
+def load_cached_validation(cache_key: str, cache_path: str = VALIDATION_CACHE_PATH):
+    """
+    Look up a stored validation verdict.
+    Returns (is_valid, errors_list) on a hit or None on a miss.
+    """
+    try:
+        with closing(_open_validation_cache(cache_path)) as conn, conn:
+            row = conn.execute(
+                "SELECT is_valid, errors FROM validation_results WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            # Touch the entry so eviction stays least-recently-used
+            conn.execute(
+                "UPDATE validation_results SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key)
+            )
+            return bool(row[0]), json.loads(row[1])
+    except (sqlite3.Error, ValueError):
+        return None
+
+def store_cached_validation(cache_key: str, is_valid: bool, errors: list,
+                            cache_path: str = VALIDATION_CACHE_PATH,
+                            max_entries: int = VALIDATION_CACHE_MAX_ENTRIES) -> None:
+    """Store a validation verdict and evict the least recently used entries beyond max_entries"""
+    try:
+        with closing(_open_validation_cache(cache_path)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO validation_results (cache_key, is_valid, errors, last_used) VALUES (?, ?, ?, ?)",
+                (cache_key, int(is_valid), json.dumps(errors, ensure_ascii=False), time.time())
+            )
+            conn.execute(
+                "DELETE FROM validation_results WHERE cache_key NOT IN ("
+                " SELECT cache_key FROM validation_results ORDER BY last_used DESC LIMIT ?)",
+                (max_entries,)
+            )
+    except sqlite3.Error as e:
+        print(f"⚠️  Could not update validation cache: {e}")
+
+def validate_xml_with_cache(xml_content: str, xsd_path: str = "ProvisioningSchema-2022-09.xsd",
+                            cache_path: str = VALIDATION_CACHE_PATH, xml_tree=None) -> tuple[bool, list, bool]:
+    """
+    Validate XML using the on-disk result cache, falling back to XSD validation on a miss.
+    When xml_tree (the lxml tree xml_content was serialized from) is given, a miss validates
+    it directly instead of reparsing xml_content.
+    Returns (is_valid, errors_list, from_cache). Verdicts that could not be computed are not cached.
+    """
+    def validate():
+        if xml_tree is not None:
+            return validate_xml_tree(xml_tree, xsd_path)
+        return validate_xml_against_xsd(xml_content, xsd_path)
+    
+    try:
+        cache_key = validation_cache_key(xml_content, xsd_path)
+    except OSError:
+        # Missing schema: let the validator report it
+        is_valid, errors = validate()
+        return is_valid, errors, False
+    
+    cached = load_cached_validation(cache_key, cache_path)
+    if cached is not None:
+        return cached[0], cached[1], True
+    
+    is_valid, errors = validate()
+    if LXML_AVAILABLE and not any(e.startswith("Validation error:") for e in errors):
+        store_cached_validation(cache_key, is_valid, errors, cache_path)
+    return is_valid, errors, False
+
 def save_llm_output(json_content: str, timestamp: str) -> str:
     """Save LLM JSON output to file"""
     os.makedirs("llm-outputs", exist_ok=True)
@@ -100,52 +836,98 @@ def save_llm_output(json_content: str, timestamp: str) -> str:
             f.write(json_content)
         return filename
 
-def save_comprehensive_report(json_content: str, xml_filename: str, is_valid: bool, validation_errors: list, timestamp: str) -> str:
-    """Save comprehensive report with JSON structure and XSD validation results"""
+def prepare_comprehensive_report(json_content: str, xml_filename: str, timestamp: str,
+                                 xsd_path: str = "ProvisioningSchema-2022-09.xsd",
+                                 llm_attempts: list = None,
+                                 prompt_version: str = None) -> Dict[str, str]:
+    """
+    Render the parts of the comprehensive report that do not depend on the validation verdict,
+    so they can be prepared while validation is still running.
+    """
+    header = (
+        "SharePoint PnP Provisioning Template - Comprehensive Report\n"
+        + "=" * 60 + "\n\n"
+        + f"Timestamp: {timestamp}\n"
+        + f"XSD Schema: {os.path.basename(xsd_path)}\n"
+        + f"Prompt version: {prompt_version or STRUCTURE_PROMPT_VERSION}\n"
+        + f"Generated XML: {xml_filename}\n\n"
+    )
+    if llm_attempts is not None:
+        header += render_llm_usage(llm_attempts)
+    
+    try:
+        # Pretty format JSON for readability
+        parsed_json = json.loads(json_content)
+        formatted_json = json.dumps(parsed_json, indent=2, ensure_ascii=False)
+    except:
+        # Fallback to raw content if JSON parsing fails
+        formatted_json = json_content
+    
+    structure_section = (
+        "\n" + "=" * 60 + "\n"
+        + "LLM GENERATED JSON STRUCTURE\n"
+        + "=" * 60 + "\n"
+        + formatted_json
+        + "\n\n" + "=" * 60 + "\n"
+        + "REPORT END\n"
+        + "=" * 60 + "\n"
+    )
+    
+    return {"timestamp": timestamp, "header": header, "structure": structure_section}
+
+# What a pass means per validation tier; only a full XSD pass says the template will deploy
+VALIDATION_TIER_PASS_MESSAGES = {
+    "wellformed": "The XML is well-formed. Schema conformance was not checked (tier: wellformed).",
+    "structural": "The XML passed the structural pre-check of attributes and required children. "
+                  "Element order and occurrence limits were not checked (tier: structural).",
+    "xsd": "The XML template is valid according to the PnP Provisioning Schema."
+}
+
+def render_validation_results(is_valid: bool, validation_errors: list, validation_cached: bool = False,
+                              validation_tier: str = "xsd") -> str:
+    """Render the XSD VALIDATION RESULTS section of the comprehensive report"""
+    lines = [
+        "XSD VALIDATION RESULTS",
+        "-" * 25,
+        f"Validation tier: {validation_tier}",
+        f"Validation: {'cached' if validation_cached else 'computed'}",
+    ]
+    if is_valid:
+        lines.append("✅ VALIDATION STATUS: PASSED")
+        lines.append(VALIDATION_TIER_PASS_MESSAGES[validation_tier])
+        if validation_tier == "xsd":
+            lines.append("✓ Ready for SharePoint deployment")
+        else:
+            lines.append("Run with --validation-tier xsd before deploying to SharePoint.")
+    else:
+        lines.append("❌ VALIDATION STATUS: FAILED")
+        lines.append(f"Found {len(validation_errors)} validation error(s):\n")
+        for i, error in enumerate(validation_errors, 1):
+            lines.append(f"  {i}. {error}")
+        lines.append(f"\n⚠️  Template may not deploy properly to SharePoint.")
+    return "\n".join(lines) + "\n"
+
+def write_comprehensive_report(prepared: Dict[str, str], validation_section: str) -> str:
+    """Write a report from prepare_comprehensive_report parts and the rendered validation results"""
     os.makedirs("validation-reports", exist_ok=True)
-    filename = f"validation-reports/comprehensive_report_{timestamp}.txt"
+    filename = f"validation-reports/comprehensive_report_{prepared['timestamp']}.txt"
     
     with open(filename, 'w', encoding='utf-8') as f:
-        f.write("SharePoint PnP Provisioning Template - Comprehensive Report\n")
-        f.write("=" * 60 + "\n\n")
-        f.write(f"Timestamp: {timestamp}\n")
-        f.write(f"XSD Schema: ProvisioningSchema-2022-09.xsd\n")
-        f.write(f"Generated XML: {xml_filename}\n\n")
-        
-        # XSD Validation Results
-        f.write("XSD VALIDATION RESULTS\n")
-        f.write("-" * 25 + "\n")
-        if is_valid:
-            f.write("✅ VALIDATION STATUS: PASSED\n")
-            f.write("The XML template is valid according to the PnP Provisioning Schema.\n")
-            f.write("✓ Ready for SharePoint deployment\n")
-        else:
-            f.write("❌ VALIDATION STATUS: FAILED\n")
-            f.write(f"Found {len(validation_errors)} validation error(s):\n\n")
-            for i, error in enumerate(validation_errors, 1):
-                f.write(f"  {i}. {error}\n")
-            f.write(f"\n⚠️  Template may not deploy properly to SharePoint.\n")
-        
-        # JSON Structure
-        f.write(f"\n" + "=" * 60 + "\n")
-        f.write("LLM GENERATED JSON STRUCTURE\n")
-        f.write("=" * 60 + "\n")
-        
-        try:
-            # Pretty format JSON for readability
-            parsed_json = json.loads(json_content)
-            formatted_json = json.dumps(parsed_json, indent=2, ensure_ascii=False)
-            f.write(formatted_json)
-        except:
-            # Fallback to raw content if JSON parsing fails
-            f.write(json_content)
-        
-        f.write(f"\n\n" + "=" * 60 + "\n")
-        f.write("REPORT END\n")
-        f.write("=" * 60 + "\n")
+        f.write(prepared["header"])
+        f.write(validation_section)
+        f.write(prepared["structure"])
     
     return filename
 
+def save_comprehensive_report(json_content: str, xml_filename: str, is_valid: bool, validation_errors: list, timestamp: str,
+                              validation_cached: bool = False, validation_tier: str = "xsd",
+                              xsd_path: str = "ProvisioningSchema-2022-09.xsd",
+                              llm_attempts: list = None) -> str:
+    """Save comprehensive report with JSON structure and XSD validation results"""
+    prepared = prepare_comprehensive_report(json_content, xml_filename, timestamp, xsd_path, llm_attempts)
+    validation_section = render_validation_results(is_valid, validation_errors, validation_cached, validation_tier)
+    return write_comprehensive_report(prepared, validation_section)
+
 def clean_json_comments(json_str: str) -> str:
     """
     Remove JavaScript-style comments from JSON string to make it valid JSON.
@@ -180,218 +962,1657 @@ def clean_json_comments(json_str: str) -> str:
     
     return cleaned_json
 
-def llm_generate_structure(description: str) -> Dict[str, Any]:
+LLM_CACHE_PATH = "llm-cache.sqlite3"
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 3600
+LLM_CACHE_MAX_ENTRIES = 500
+
+
+STRUCTURE_REQUEST_PARAMS = {"temperature": 0.1, "max_tokens": 3000}
+
+# JSON Schema for the structure contract, sent as a structured-output response format with
+# --structured-output. Strict mode needs every property listed as required.
+def _strict_object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+_FIELD_JSON_SCHEMA = _strict_object({
+    "name": {"type": "string"},
+    "displayName": {"type": "string"},
+    "type": {"type": "string", "enum": ["Text", "Note", "Choice", "DateTime", "User", "Number", "Currency", "Boolean", "Lookup"]},
+    "group": {"type": "string"},
+    "choices": {"type": "array", "items": {"type": "string"}},
+    "required": {"type": "boolean"}
+})
+
+STRUCTURE_JSON_SCHEMA = _strict_object({
+    "site_type": {"type": "string", "enum": ["TeamSite", "CommunicationSite"]},
+    "base_template": {"type": "string", "enum": ["GROUP#0", "SITEPAGEPUBLISHING#0"]},
+    "site_title": {"type": "string"},
+    "description": {"type": "string"},
+    "theme": _strict_object({
+        "name": {"type": "string"},
+        "primary_color": {"type": "string"},
+        "is_inverted": {"type": "boolean"},
+        "generate_palette": {"type": "boolean"}
+    }),
+    "site_fields": {"type": "array", "items": _FIELD_JSON_SCHEMA},
+    "lists": {"type": "array", "items": _strict_object({
+        "title": {"type": "string"},
+        "template_type": {"type": "integer", "enum": [100, 101, 104, 105, 106, 107]},
+        "url": {"type": "string"},
+        "description": {"type": "string"},
+        "enable_versioning": {"type": "boolean"},
+        "on_quick_launch": {"type": "boolean"},
+        "fields": {"type": "array", "items": _FIELD_JSON_SCHEMA},
+        "views": {"type": "array", "items": _strict_object({
+            "name": {"type": "string"},
+            "display_name": {"type": "string"},
+            "type": {"type": "string", "enum": ["HTML", "CALENDAR", "GANTT"]},
+            "default": {"type": "boolean"},
+            "fields": {"type": "array", "items": {"type": "string"}},
+            "query": {"type": "string"},
+            "row_limit": {"type": "integer"},
+            "paged": {"type": "boolean"}
+        })}
+    })},
+    "navigation": {"type": "array", "items": _strict_object({
+        "title": {"type": "string"},
+        "url": {"type": "string"},
+        "description": {"type": "string"}
+    })},
+    # build_pnp_tree writes each entry as a Feature ID
+    "features": {"type": "array", "items": {"type": "string"}}
+})
+
+# Models that accept a json_schema response format, and older ones that only have JSON mode
+JSON_SCHEMA_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+JSON_MODE_MODEL_PREFIXES = ("gpt-4-turbo", "gpt-4-1106", "gpt-4-0125", "gpt-3.5-turbo")
+
+def structure_response_format(model: str):
+    """Strictest response format the model supports for the structure, or None"""
+    if model.startswith(JSON_SCHEMA_MODEL_PREFIXES):
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "sharepoint_site_structure", "strict": True, "schema": STRUCTURE_JSON_SCHEMA}
+        }
+    if model.startswith(JSON_MODE_MODEL_PREFIXES):
+        return {"type": "json_object"}
+    return None
+
+def structure_request_params(model: str, structured_output: bool = False) -> Dict[str, Any]:
+    """Request parameters for a structure call, with a response format in structured output mode"""
+    params = dict(STRUCTURE_REQUEST_PARAMS)
+    response_format = structure_response_format(model) if structured_output else None
+    if response_format:
+        params["response_format"] = response_format
+    return params
+
+def structure_response_text(content: str, params: Dict[str, Any]) -> str:
+    """Response text ready for json.loads; fence and comment cleanup only when no format was enforced"""
+    if "response_format" in params:
+        return content.strip()
+    return clean_llm_response(content)
+
+# Static instructions go in a precomputed system prompt and the description comes last, so
+# every request shares the same prefix (provider prompt caching). Bump STRUCTURE_PROMPT_VERSION
+# whenever the text changes; it is part of the LLM cache key and recorded in each report.
+STRUCTURE_PROMPT_VERSION = "3"
+
+STRUCTURE_SYSTEM_PROMPT = """You are a SharePoint expert with deep knowledge of PnP Provisioning Templates. For the site description in the user message, return ONLY a valid JSON object (no explanation text) describing a SharePoint PnP provisioning template.
+
+Extract from the description: site type and purpose, exact names from quotes or "called" phrases, document libraries, lists and their types, relevant site columns, navigation, and theme/branding (colors, corporate identity).
+
+JSON structure:
+{
+  "site_type": "TeamSite" | "CommunicationSite",
+  "base_template": "GROUP#0" (TeamSite) | "SITEPAGEPUBLISHING#0" (CommunicationSite),
+  "site_title": "specific title from the description",
+  "description": "brief site purpose",
+  "theme": {"name": "CorporateBlue", "primary_color": "#0078d4", "is_inverted": false, "generate_palette": true},
+  "site_fields": [
+    {"name": "FieldName", "displayName": "Display Name", "type": "Text|Note|Choice|DateTime|User|Number|Currency|Boolean|Lookup", "group": "Custom Columns", "choices": ["Option1", "Option2"], "required": false}
+  ],
+  "lists": [
+    {"title": "Exact List/Library Title", "template_type": 100, "url": "Lists/ListName or LibraryName", "description": "purpose", "enable_versioning": true, "on_quick_launch": true, "fields": [],
+     "views": [{"name": "View Name", "display_name": "Display Name", "type": "HTML", "default": false, "fields": ["Field1", "Field2"], "query": "<OrderBy><FieldRef Name='Title' /></OrderBy>", "row_limit": 30, "paged": true}]}
+  ],
+  "navigation": [{"title": "Navigation Item", "url": "{site}/path or external URL", "description": "purpose"}],
+  "features": []
+}
+
+Rules:
+1. site_fields are added to every list automatically; leave each list's "fields" empty and don't define content types.
+2. Field types: Text, Note, Choice, DateTime, Boolean, Number, Currency, User, Lookup. "choices" only for Choice fields.
+3. Use EXACT names from quotes or "called" phrases; avoid generic site titles like "Team Site".
+4. template_type: 100=Custom List, 101=Document Library (always for libraries), 104=Announcements, 105=Contacts, 106=Events, 107=Tasks. enable_versioning only matters for 101.
+5. Use SharePoint naming conventions; URLs without spaces.
+6. Add meaningful navigation items.
+7. Views for each list: a default "All Items" view with key fields, filtered views for subsets (e.g. "Active Projects"), CALENDAR views for date-based lists, sorted views for priority/status. Other views use type HTML.
+8. View fields: Title and key identifiers, relevant dates, status/priority; 6-8 fields. Use the exact internal names from site_fields (site field "DueDate" -> "DueDate").
+9. CAML queries: exact internal names from site_fields, matching value types (Choice, DateTime, Text), valid CAML for Where/OrderBy/GroupBy.
+10. Theme: primary_color by context - corporate blue #0078d4, healthcare teal #008a8a, finance green #498205, emergency/safety red #d13438, education purple #5c2d91. generate_palette true; is_inverted false unless a dark theme is asked for; descriptive name (e.g. "HealthcareGreen").
+11. features: omit or leave empty unless the site needs a specific SharePoint feature; then use its real feature GUID, never a placeholder.
+
+Examples:
+- "document library called 'Project Files'" -> title: "Project Files", url: "ProjectFiles"
+- "HR policies site" -> site_title: "HR Policies Portal"
+- "team site for marketing" -> site_title: "Marketing Team Site"
+"""
+
+STRUCTURE_USER_TEMPLATE = 'Description: "{description}"'
+
+def normalize_description(description: str) -> str:
+    """Normalize a site description for cache keys: lowercase with collapsed whitespace"""
+    return " ".join(description.lower().split())
+
+def clean_llm_response(response_text: str) -> str:
+    """Strip markdown code fences and JavaScript-style comments from a model response"""
+    response_text = response_text.strip()
+    
+    # Remove any markdown code blocks if present
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+    
+    # Clean JSON: Remove JavaScript-style comments that break JSON parsing
+    return clean_json_comments(response_text)
+
+def structure_prompt_hash() -> str:
+    """Hash of the prompt version and text and the request parameters, for LLM cache keys"""
+    material = json.dumps({
+        "version": STRUCTURE_PROMPT_VERSION,
+        "system": STRUCTURE_SYSTEM_PROMPT,
+        "user": STRUCTURE_USER_TEMPLATE,
+        "params": STRUCTURE_REQUEST_PARAMS
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def llm_cache_key(model: str, description: str, structured_output: bool = False) -> str:
+    """LLM response cache key: model, normalized description, prompt hash and response format"""
+    response_format = structure_request_params(model, structured_output).get("response_format")
+    material = (f"{model}\n{normalize_description(description)}\n{structure_prompt_hash()}\n"
+                f"{json.dumps(response_format, sort_keys=True)}")
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _open_llm_cache(cache_path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the SQLite LLM response cache"""
+    conn = sqlite3.connect(cache_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS llm_responses ("
+        " cache_key TEXT PRIMARY KEY,"
+        " model TEXT NOT NULL,"
+        " response_text TEXT NOT NULL,"
+        " created REAL NOT NULL,"
+        " last_used REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS description_index ("
+        " cache_key TEXT PRIMARY KEY,"
+        " prompt_hash TEXT NOT NULL,"
+        " description TEXT NOT NULL,"
+        " terms TEXT NOT NULL)"
+    )
+    return conn
+
+def load_cached_llm_response(cache_key: str, cache_path: str = LLM_CACHE_PATH,
+                             ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+    """
+    Look up a cached, already cleaned model response.
+    Returns (model, response_text) on a hit or None on a miss or expired entry.
+    """
+    try:
+        with closing(_open_llm_cache(cache_path)) as conn, conn:
+            row = conn.execute(
+                "SELECT model, response_text, created FROM llm_responses WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[2] > ttl_seconds:
+                conn.execute("DELETE FROM llm_responses WHERE cache_key = ?", (cache_key,))
+                return None
+            # Touch the entry so eviction stays least-recently-used
+            conn.execute("UPDATE llm_responses SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key))
+            return row[0], row[1]
+    except sqlite3.Error:
+        return None
+
+def store_cached_llm_response(cache_key: str, model: str, response_text: str,
+                              cache_path: str = LLM_CACHE_PATH,
+                              max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                              description: str = None) -> None:
+    """
+    Store a cleaned model response and evict the least recently used entries beyond max_entries.
+    With a description the entry is also added to the near-duplicate index.
+    """
+    try:
+        with closing(_open_llm_cache(cache_path)) as conn, conn:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (cache_key, model, response_text, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (cache_key, model, response_text, now, now)
+            )
+            if description is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO description_index (cache_key, prompt_hash, description, terms)"
+                    " VALUES (?, ?, ?, ?)",
+                    (cache_key, structure_prompt_hash(), description, json.dumps(description_terms(description)))
+                )
+            conn.execute(
+                "DELETE FROM llm_responses WHERE cache_key NOT IN ("
+                " SELECT cache_key FROM llm_responses ORDER BY last_used DESC LIMIT ?)",
+                (max_entries,)
+            )
+            conn.execute("DELETE FROM description_index WHERE cache_key NOT IN (SELECT cache_key FROM llm_responses)")
+    except sqlite3.Error as e:
+        print(f"⚠️  Could not update LLM response cache: {e}")
+
+# Near-duplicate reuse: a description whose TF-IDF cosine similarity to an earlier cached one
+# reaches --similarity-threshold reuses that structure. Reuse is opt-in (SIMILARITY_THRESHOLD 0);
+# pick a high threshold, since one swapped word in a long description barely moves the cosine.
+# Descriptions naming different sites or lists ('called "Finance Hub"') are never reused for
+# each other. Other matches above SIMILARITY_SUGGEST_THRESHOLD are only pointed out.
+SIMILARITY_THRESHOLD = 0.0
+SIMILARITY_SUGGEST_THRESHOLD = 0.7
+SIMILARITY_STOP_WORDS = {
+    "a", "an", "the", "and", "or", "with", "for", "of", "to", "in", "on", "our", "my", "we",
+    "create", "please", "make", "build", "new", "that", "this", "which", "including", "include", "having"
+}
+
+def description_terms(description: str) -> List[str]:
+    """Content words of a description, lowercased and crudely singularized"""
+    terms = []
+    for word in re.findall(r"[a-z0-9#]+", description.lower()):
+        if word in SIMILARITY_STOP_WORDS:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def description_names(description: str) -> set:
+    """Quoted names and 'called X' names in a description, lowercased"""
+    names = re.findall(r'["\u201c\u201d]([^"\u201c\u201d]+)["\u201c\u201d]|\'([^\']+)\'', description)
+    found = {(double or single).strip().lower() for double, single in names}
+    found.update(name.lower() for name in re.findall(r"\b(?:called|named)\s+([A-Z][\w&-]*(?:\s+[A-Z][\w&-]*)*)", description))
+    return found
+
+def reuse_blockers(description: str, earlier: str) -> List[str]:
+    """Names in only one of the two descriptions, which rule out reusing earlier's structure"""
+    return [f"'{name}'" for name in sorted(description_names(description) ^ description_names(earlier))]
+
+def tfidf_similarities(query: List[str], documents: List[List[str]]) -> List[float]:
+    """Cosine similarity of the query's TF-IDF vector to each document's (smoothed IDF over all of them)"""
+    df = Counter()
+    for terms in documents + [query]:
+        df.update(set(terms))
+    total = len(documents) + 1
+    
+    def vector(terms):
+        return {term: count * (math.log((total + 1) / (df[term] + 1)) + 1) for term, count in Counter(terms).items()}
+    
+    query_vector = vector(query)
+    query_norm = math.sqrt(sum(w * w for w in query_vector.values()))
+    similarities = []
+    for terms in documents:
+        doc_vector = vector(terms)
+        doc_norm = math.sqrt(sum(w * w for w in doc_vector.values()))
+        dot = sum(weight * doc_vector.get(term, 0) for term, weight in query_vector.items())
+        similarities.append(dot / (query_norm * doc_norm) if query_norm and doc_norm else 0.0)
+    return similarities
+
+def find_similar_description(description: str, cache_path: str = LLM_CACHE_PATH,
+                             ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+    """
+    Most similar earlier description with a live cached response for the current prompt.
+    Returns (similarity, description, model, response_text) or None.
+    """
+    try:
+        with closing(_open_llm_cache(cache_path)) as conn, conn:
+            rows = conn.execute(
+                "SELECT i.cache_key, i.description, i.terms, r.model, r.response_text"
+                " FROM description_index i JOIN llm_responses r ON r.cache_key = i.cache_key"
+                " WHERE i.prompt_hash = ? AND r.created >= ?",
+                (structure_prompt_hash(), time.time() - ttl_seconds)
+            ).fetchall()
+            if not rows:
+                return None
+            similarities = tfidf_similarities(description_terms(description), [json.loads(row[2]) for row in rows])
+            best = max(range(len(rows)), key=similarities.__getitem__)
+            conn.execute("UPDATE llm_responses SET last_used = ? WHERE cache_key = ?", (time.time(), rows[best][0]))
+            return similarities[best], rows[best][1], rows[best][3], rows[best][4]
+    except (sqlite3.Error, ValueError):
+        return None
+
+def load_similar_structure(description: str, threshold: float = SIMILARITY_THRESHOLD):
+    """
+    Reuse the structure of a near-duplicate earlier description. Returns (structure, response_text,
+    model, similarity) when the best match reaches threshold (0 disables reuse) and names the same
+    sites and lists (see reuse_blockers); other close matches are only printed as a starting point.
+    """
+    match = find_similar_description(description)
+    if match is None or match[0] < SIMILARITY_SUGGEST_THRESHOLD and (not threshold or match[0] < threshold):
+        return None
+    similarity, earlier, model, response_text = match
+    blockers = reuse_blockers(description, earlier)
+    if not threshold or similarity < threshold or blockers:
+        if blockers:
+            reason = f"differs in {', '.join(blockers[:5])}"
+        else:
+            reason = f"{similarity:.2f}" + ("" if threshold else "; --similarity-threshold enables reuse")
+        print(f"💡 Similar earlier description ({reason}), not reused: '{earlier}'")
+        return None
+    try:
+        structure = json.loads(response_text)
+    except json.JSONDecodeError:
+        return None
+    add_field_ids(structure)
+    return structure, response_text, model, similarity
+
+# Circuit breaker for the model fallback chain: models the API reports as missing or not
+# entitled are skipped until the cooldown expires, so runs don't pay a failed round trip first
+MODEL_BREAKER_PATH = "model-breaker.json"
+MODEL_BREAKER_COOLDOWN_SECONDS = 24 * 60 * 60
+_MODEL_BREAKER_LOCK = threading.Lock()
+
+def classify_model_error(error: Exception) -> str:
+    """
+    Classify an API error for the circuit breaker:
+    'unavailable' (404 / model_not_found / 403, trips the breaker),
+    'transient' (5xx, 429, timeouts, connection errors) or 'other'.
+    """
+    status = getattr(error, "status_code", None)
+    code = getattr(error, "code", None)
+    if code == "insufficient_quota":  # A 429 that waiting won't fix
+        return "other"
+    if status is not None and (status >= 500 or status in (408, 409, 429)):
+        return "transient"
+    if status in (403, 404) or code == "model_not_found":
+        return "unavailable"
+    if OPENAI_AVAILABLE and isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return "transient"
+    return "other"
+
+def _load_model_breaker(state_path: str) -> Dict[str, Any]:
+    """Read the breaker state file; a missing or corrupt file means every circuit is closed"""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        return state if isinstance(state.get("models"), dict) else {"models": {}}
+    except (OSError, ValueError, AttributeError):
+        return {"models": {}}
+
+def _save_model_breaker(state: Dict[str, Any], state_path: str) -> None:
+    """Write the breaker state file atomically"""
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, state_path)
+    except OSError as e:
+        print(f"⚠️  Could not update model circuit breaker state: {e}")
+
+def available_models(models: List[str], state_path: str = MODEL_BREAKER_PATH) -> List[str]:
+    """
+    Filter out models whose circuit is open. If every model is open the full list is
+    returned, so a run never skips the API entirely because of stale state.
+    """
+    with _MODEL_BREAKER_LOCK:
+        entries = _load_model_breaker(state_path)["models"]
+    now = time.time()
+    open_models = [m for m in models if entries.get(m, {}).get("open_until", 0) > now]
+    if not open_models or len(open_models) == len(models):
+        return list(models)
+    for model in open_models:
+        entry = entries[model]
+        print(f"⏭️  Skipping {model}: {entry.get('reason', 'unavailable')} "
+              f"(retry after {datetime.fromtimestamp(entry['open_until']).strftime('%Y-%m-%d %H:%M')})")
+    return [m for m in models if m not in open_models]
+
+def record_model_result(model: str, error: Exception = None, state_path: str = MODEL_BREAKER_PATH,
+                        cooldown_seconds: float = MODEL_BREAKER_COOLDOWN_SECONDS) -> str:
+    """
+    Update the breaker after a request to model. Success closes the circuit, an 'unavailable'
+    error opens it for cooldown_seconds, anything else leaves it alone.
+    Returns the error classification ('ok' on success).
+    """
+    kind = "ok" if error is None else classify_model_error(error)
+    if kind not in ("ok", "unavailable"):
+        return kind
+    
+    with _MODEL_BREAKER_LOCK:
+        state = _load_model_breaker(state_path)
+        if kind == "ok":
+            if model not in state["models"]:
+                return kind
+            del state["models"][model]
+        else:
+            previous = state["models"].get(model, {})
+            state["models"][model] = {
+                "open_until": time.time() + cooldown_seconds,
+                "failures": previous.get("failures", 0) + 1,
+                "reason": f"HTTP {getattr(error, 'status_code', '?')} {getattr(error, 'code', None) or type(error).__name__}"
+            }
+        _save_model_breaker(state, state_path)
+    return kind
+
+# Client-side rate limiting: token buckets for requests and tokens per minute (0 = no limit,
+# see --rpm/--tpm), and retries with jittered exponential backoff that honor Retry-After.
+# The SDK's own retries are disabled so this is the only retry policy.
+RATE_LIMIT_MAX_RETRIES = 6       # for 429 responses
+TRANSIENT_MAX_RETRIES = 2        # for 5xx, timeouts and connection errors
+RATE_LIMIT_BACKOFF_BASE = 1.0
+RATE_LIMIT_BACKOFF_CAP = 60.0
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute, shared by all requests
+    in the process. reserve() takes capacity up front and returns how long to wait.
+    """
+    
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+    
+    def reserve(self, tokens: int) -> float:
+        """Reserve one request and tokens; returns the seconds to wait before sending it"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.paused_until - now)
+            # Buckets may go negative: the deficit is the queue of already reserved capacity
+            if self.rpm:
+                self.requests -= 1
+                if self.requests < 0:
+                    wait = max(wait, -self.requests * 60 / self.rpm)
+            if self.tpm:
+                self.tokens -= min(tokens, self.tpm)
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens * 60 / self.tpm)
+            return wait
+    
+    def pause(self, seconds: float) -> None:
+        """Hold back every request for seconds, e.g. after a 429"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+RATE_LIMITER = RateLimiter()
+
+def configure_rate_limiter(rpm: int = 0, tpm: int = 0) -> None:
+    """Replace the shared rate limiter (0 disables a bucket)"""
+    global RATE_LIMITER
+    RATE_LIMITER = RateLimiter(rpm, tpm)
+
+def env_rate_limit(name: str) -> int:
+    """Rate limit from environment variable name; 0 (no limit) when unset or not a non-negative integer"""
+    value = os.getenv(name, "").strip()
+    if not value:
+        return 0
+    try:
+        limit = int(value)
+        if limit < 0:
+            raise ValueError(value)
+        return limit
+    except ValueError:
+        print(f"⚠️  Ignoring {name}={value!r}: expected a non-negative integer")
+        return 0
+
+def estimate_request_tokens(messages: List[Dict[str, str]], params: Dict[str, Any]) -> int:
+    """Tokens a request counts against TPM: the prompt plus max_tokens, as the API reserves them"""
+    return sum(estimate_tokens(m["content"]) for m in messages) + params.get("max_tokens", 0)
+
+def retry_delay(error: Exception, retry: int) -> float:
+    """Seconds to wait before retry number retry: Retry-After if sent, else jittered exponential backoff"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000 + random.uniform(0, 0.25)
+        if headers.get("retry-after"):
+            return float(headers["retry-after"]) + random.uniform(0, 0.25)
+    except ValueError:
+        pass  # HTTP-date form; fall back to backoff
+    backoff = min(RATE_LIMIT_BACKOFF_CAP, RATE_LIMIT_BACKOFF_BASE * 2 ** retry)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+def _retry_plan(error: Exception, retry: int):
+    """Delay before retrying a failed request, or None when it should not be retried"""
+    if classify_model_error(error) != "transient":
+        return None
+    rate_limited = getattr(error, "status_code", None) == 429
+    if retry >= (RATE_LIMIT_MAX_RETRIES if rate_limited else TRANSIENT_MAX_RETRIES):
+        return None
+    delay = retry_delay(error, retry)
+    if rate_limited:
+        RATE_LIMITER.pause(delay)
+    return delay
+
+def call_with_backoff(request, estimated_tokens: int, model: str):
+    """Run request() under the rate limiter, retrying 429s and transient errors with backoff"""
+    retry = 0
+    while True:
+        wait = RATE_LIMITER.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            return request()
+        except Exception as error:
+            delay = _retry_plan(error, retry)
+            if delay is None:
+                raise
+            retry += 1
+            print(f"⏳ {model}: {type(error).__name__}, retrying in {delay:.1f}s ({retry})")
+            time.sleep(delay)
+
+async def async_call_with_backoff(request, estimated_tokens: int, model: str):
+    """Async call_with_backoff: request() returns an awaitable"""
+    retry = 0
+    while True:
+        wait = RATE_LIMITER.reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            return await request()
+        except Exception as error:
+            delay = _retry_plan(error, retry)
+            if delay is None:
+                raise
+            retry += 1
+            print(f"⏳ {model}: {type(error).__name__}, retrying in {delay:.1f}s ({retry})")
+            await asyncio.sleep(delay)
+
+# Usage accounting: every LLM attempt (model, tokens, latency, outcome) is kept per template,
+# shown in the comprehensive report and appended to an NDJSON ledger summarized by --stats
+LLM_LEDGER_PATH = "llm-ledger.ndjson"
+
+# Estimated USD per 1K prompt / completion tokens
+MODEL_PRICING = {
+    "gpt-4-turbo-preview": (0.01, 0.03),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    """Estimated USD cost of a call, or None for models without pricing"""
+    pricing = MODEL_PRICING.get(model)
+    if pricing is None:
+        return None
+    return round(prompt_tokens / 1000 * pricing[0] + completion_tokens / 1000 * pricing[1], 6)
+
+def llm_attempt(model: str, started: float, outcome: str, usage=None, error: Exception = None) -> Dict[str, Any]:
+    """
+    Record of one LLM attempt. outcome is 'ok', 'cache', 'similar', 'shared' or an error class from
+    classify_model_error; started is the time.perf_counter() value before the call.
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    attempt = {
+        "model": model,
+        "outcome": outcome,
+        "latency_s": round(time.perf_counter() - started, 3),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens) if usage else None
+    }
+    if error is not None:
+        attempt["error"] = str(error)[:200]
+    return attempt
+
+def summarize_llm_attempts(attempts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals over the attempts for one template; source is 'api', 'cache', 'similar', 'shared' or 'fallback'"""
+    outcomes = {a["outcome"] for a in attempts}
+    source = "fallback"
+    for outcome, name in (("cache", "cache"), ("similar", "similar"), ("shared", "shared"), ("ok", "api")):
+        if outcome in outcomes:
+            source = name
+            break
+    return {
+        "source": source,
+        "attempts": len(attempts),
+        "latency_s": round(sum(a["latency_s"] for a in attempts), 3),
+        "prompt_tokens": sum(a["prompt_tokens"] for a in attempts),
+        "completion_tokens": sum(a["completion_tokens"] for a in attempts),
+        "total_tokens": sum(a["prompt_tokens"] + a["completion_tokens"] for a in attempts),
+        "cost_usd": round(sum(a["cost_usd"] or 0 for a in attempts), 6)
+    }
+
+def append_llm_ledger(attempts: List[Dict[str, Any]], description: str,
+                      ledger_path: str = LLM_LEDGER_PATH,
+                      prompt_version: str = None) -> None:
+    """Append one template's attempts and totals to the NDJSON ledger"""
+    entry = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "prompt_version": prompt_version or STRUCTURE_PROMPT_VERSION,
+        "description_hash": hashlib.sha256(normalize_description(description).encode('utf-8')).hexdigest()[:16],
+        **summarize_llm_attempts(attempts),
+        "calls": attempts
+    }
+    try:
+        with open(ledger_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    except OSError as e:
+        print(f"⚠️  Could not append to LLM ledger: {e}")
+
+def render_llm_usage(attempts: List[Dict[str, Any]]) -> str:
+    """Render the LLM USAGE section of the comprehensive report"""
+    lines = ["LLM USAGE", "-" * 25]
+    if not attempts:
+        lines.append("No LLM calls (basic parsing)")
+    for attempt in attempts:
+        line = f"{attempt['model']}: {attempt['outcome']}, {attempt['latency_s']:.2f}s"
+        if attempt["prompt_tokens"] or attempt["completion_tokens"]:
+            line += f", {attempt['prompt_tokens']} prompt + {attempt['completion_tokens']} completion tokens"
+        if attempt["cost_usd"] is not None:
+            line += f", ~${attempt['cost_usd']:.4f}"
+        lines.append(line)
+    totals = summarize_llm_attempts(attempts)
+    lines.append(f"Total: {totals['total_tokens']} tokens, {totals['latency_s']:.2f}s, ~${totals['cost_usd']:.4f} "
+                 f"({totals['source']})")
+    return "\n".join(lines) + "\n\n"
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of values (pct in 0-100)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def run_stats(ledger_path: str = LLM_LEDGER_PATH) -> int:
+    """Summarize the LLM ledger: p50/p95 latency and tokens per template and per model (--stats)"""
+    entries = []
+    try:
+        with open(ledger_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        print(f"No LLM ledger at {ledger_path} yet")
+        return 1
+    
+    sources = {}
+    for entry in entries:
+        sources[entry.get("source", "api")] = sources.get(entry.get("source", "api"), 0) + 1
+    print(f"📊 LLM usage from {ledger_path}: {len(entries)} template(s) "
+          f"({', '.join(f'{count} {source}' for source, count in sorted(sources.items()))})")
+    if entries:
+        print(f"   Reuse hit rate: {sources.get('cache', 0) / len(entries):.0%} exact cache, "
+              f"{sources.get('similar', 0) / len(entries):.0%} near-duplicate, "
+              f"{sources.get('shared', 0) / len(entries):.0%} shared in-flight")
+    
+    api_entries = [e for e in entries if e.get("source") == "api"]
+    if api_entries:
+        latencies = [e["latency_s"] for e in api_entries]
+        tokens = [e["total_tokens"] for e in api_entries]
+        cost = sum(e.get("cost_usd") or 0 for e in api_entries)
+        print(f"   Latency per template: p50 {percentile(latencies, 50):.2f}s, p95 {percentile(latencies, 95):.2f}s")
+        print(f"   Tokens per template: p50 {percentile(tokens, 50):.0f}, p95 {percentile(tokens, 95):.0f} "
+              f"(prompt p50 {percentile([e['prompt_tokens'] for e in api_entries], 50):.0f}, "
+              f"completion p50 {percentile([e['completion_tokens'] for e in api_entries], 50):.0f})")
+        print(f"   Estimated cost: ${cost:.4f} total, ${cost / len(api_entries):.4f} per template")
+    
+    by_model = {}
+    for entry in entries:
+        for call in entry.get("calls", []):
+            if call.get("outcome") not in ("cache", "similar", "shared"):
+                by_model.setdefault(call["model"], []).append(call)
+    for model, calls in sorted(by_model.items()):
+        failed = sum(1 for c in calls if c["outcome"] != "ok")
+        latencies = [c["latency_s"] for c in calls]
+        print(f"   {model}: {len(calls)} attempt(s), {failed} failed, "
+              f"latency p50 {percentile(latencies, 50):.2f}s p95 {percentile(latencies, 95):.2f}s")
+    return 0
+
+# Call GPT-4 (or fallback to GPT-3.5-turbo if GPT-4 is not available)
+STRUCTURE_MODELS = ["gpt-4-turbo-preview", "gpt-4", "gpt-3.5-turbo"]
+
+def load_cached_structure(description: str, models: List[str], structured_output: bool = False):
+    """
+    Return (structure, response_text, model) from the first model with a cached response
+    for this description in this response mode, or None when nothing usable is cached.
+    """
+    for model in models:
+        cached = load_cached_llm_response(llm_cache_key(model, description, structured_output))
+        if cached is None:
+            continue
+        try:
+            structure = json.loads(cached[1])
+        except json.JSONDecodeError:
+            continue
+        add_field_ids(structure)
+        return structure, cached[1], cached[0]
+    return None
+
+def structure_messages(description: str) -> List[Dict[str, str]]:
+    """Chat messages requesting the site structure for a description"""
+    return [
+        {"role": "system", "content": STRUCTURE_SYSTEM_PROMPT},
+        {"role": "user", "content": STRUCTURE_USER_TEMPLATE.format(description=description)}
+    ]
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one: the first caller runs the call and
+    callers arriving while it is in flight wait for its result (or exception) instead.
+    Works across threads (do) and within an event loop (ado).
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> concurrent.futures.Future of the in-flight call
+    
+    def _join(self, key: str) -> tuple:
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                return future, False
+            future = self.calls[key] = Future()
+            return future, True
+    
+    def _finish(self, key: str, future: Future, result=None, error: BaseException = None) -> None:
+        with self.lock:
+            del self.calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def do(self, key: str, call) -> tuple:
+        """Run call() unless an identical call is in flight; returns (result, shared)"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = call()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+    
+    async def ado(self, key: str, call) -> tuple:
+        """Async do: awaits call() unless an identical call is in flight; returns (result, shared)"""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await call()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result, False
+
+# Identical structure requests in flight at the same time (batch duplicates, concurrent service
+# callers) share one completion
+LLM_SINGLE_FLIGHT = SingleFlight()
+
+def single_flight_key(description: str, structured_output: bool = False) -> str:
+    """Key for identical structure requests: normalized description, prompt hash and response format"""
+    material = f"{normalize_description(description)}\n{structure_prompt_hash()}\n{structured_output}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def estimate_tokens(text: str) -> int:
+    """Token count for text: tiktoken's cl100k_base when installed, otherwise ~4 characters per token"""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except Exception:
+        return (len(text) + 3) // 4
+
+def measure_structure_prompt(description: str = "") -> Dict[str, Any]:
+    """Size of the structure prompt: the static (cacheable) system prefix and the per-request part"""
+    messages = structure_messages(description)
+    return {
+        "version": STRUCTURE_PROMPT_VERSION,
+        "system_chars": len(messages[0]["content"]),
+        "system_tokens": estimate_tokens(messages[0]["content"]),
+        "user_chars": len(messages[1]["content"]),
+        "user_tokens": estimate_tokens(messages[1]["content"])
+    }
+
+def run_prompt_stats(description: str) -> int:
+    """Print the structure prompt size for a description (--prompt-stats)"""
+    stats = measure_structure_prompt(description)
+    print(f"📏 Structure prompt version {stats['version']}")
+    print(f"   System prompt (static, cacheable prefix): {stats['system_chars']} chars, ~{stats['system_tokens']} tokens")
+    print(f"   User message (description): {stats['user_chars']} chars, ~{stats['user_tokens']} tokens")
+    print(f"   Total input: ~{stats['system_tokens'] + stats['user_tokens']} tokens")
+    return 0
+
+# Record/replay of LLM calls: cassette files keyed by a hash of the request, so the whole
+# pipeline can run in benchmarks and CI without network access (--record-llm / --replay-llm)
+class CassetteMiss(LookupError):
+    """No recorded response for a request in replay mode"""
+
+class RecordedAPIError(Exception):
+    """An API error replayed from a cassette, with status_code and code like the SDK errors"""
+    
+    def __init__(self, message: str, status_code: int = None, code: str = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+def _to_namespace(value):
+    """Recorded JSON as attribute-access objects, the shape the SDK responses are read with"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_to_namespace(item) for item in value]
+    return value
+
+class LLMCassette:
+    """
+    Directory of recorded chat completion calls, one JSON file per request hash.
+    mode is 'record' (call the API and save), 'replay' (never touch the network) or 'auto'
+    (replay when recorded, record otherwise). With replay_latency the recorded latency is
+    slept again, per chunk for streamed responses.
+    """
+    
+    def __init__(self, directory: str, mode: str = "replay", replay_latency: bool = False):
+        self.directory = directory
+        self.mode = mode
+        self.replay_latency = replay_latency
+    
+    @staticmethod
+    def request_key(request: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+    
+    def load(self, key: str):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def save(self, key: str, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._path(key))
+    
+    def _lookup(self, request: Dict[str, Any], create) -> tuple:
+        key = self.request_key(request)
+        entry = self.load(key) if self.mode != "record" else None
+        if entry is None and (self.mode == "replay" or create is None):
+            raise CassetteMiss(f"No recorded response for {request.get('model')} in {self.directory} ({key[:12]})")
+        return key, entry
+    
+    def _record_error(self, key: str, request: Dict[str, Any], started: float, error: Exception) -> None:
+        # Transient failures (429, 5xx) would make every replay fail, so only keep definite ones
+        if classify_model_error(error) != "transient":
+            self.save(key, {"request": request, "latency_s": round(time.perf_counter() - started, 4),
+                            "error": {"message": str(error), "status_code": getattr(error, "status_code", None),
+                                      "code": getattr(error, "code", None)}})
+    
+    def _replay(self, entry: Dict[str, Any], sleep: bool):
+        if sleep:
+            time.sleep(entry.get("latency_s", 0))
+        if "error" in entry:
+            error = entry["error"]
+            raise RecordedAPIError(error["message"], error.get("status_code"), error.get("code"))
+        return _to_namespace(entry["response"])
+    
+    def _replay_stream(self, chunks: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        for item in chunks:
+            if self.replay_latency:
+                delay = item["offset_s"] - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield _to_namespace(item["chunk"])
+    
+    def _record_stream(self, key: str, request: Dict[str, Any], stream, started: float):
+        chunks = []
+        for chunk in stream:
+            chunks.append({"offset_s": round(time.perf_counter() - started, 4), "chunk": chunk.model_dump()})
+            yield chunk
+        self.save(key, {"request": request, "latency_s": round(time.perf_counter() - started, 4), "chunks": chunks})
+    
+    def call(self, create, request: Dict[str, Any]):
+        """Replay the request from the cassette, or run create(**request) and record the result"""
+        key, entry = self._lookup(request, create)
+        if entry is not None:
+            if "chunks" in entry:
+                return self._replay_stream(entry["chunks"])
+            return self._replay(entry, self.replay_latency)
+        
+        started = time.perf_counter()
+        try:
+            response = create(**request)
+        except Exception as error:
+            self._record_error(key, request, started, error)
+            raise
+        if request.get("stream"):
+            return self._record_stream(key, request, response, started)
+        self.save(key, {"request": request, "latency_s": round(time.perf_counter() - started, 4),
+                        "response": response.model_dump()})
+        return response
+    
+    async def acall(self, create, request: Dict[str, Any]):
+        """Async call() for non-streamed requests; create(**request) returns an awaitable"""
+        key, entry = self._lookup(request, create)
+        if entry is not None:
+            if self.replay_latency:
+                await asyncio.sleep(entry.get("latency_s", 0))
+            return self._replay(entry, False)
+        
+        started = time.perf_counter()
+        try:
+            response = await create(**request)
+        except Exception as error:
+            self._record_error(key, request, started, error)
+            raise
+        self.save(key, {"request": request, "latency_s": round(time.perf_counter() - started, 4),
+                        "response": response.model_dump()})
+        return response
+
+class CassetteClient:
+    """Stand-in for openai.OpenAI / AsyncOpenAI that sends chat.completions.create through a cassette"""
+    
+    def __init__(self, cassette: LLMCassette, client=None, is_async: bool = False):
+        self.cassette = cassette
+        self.client = client
+        self.is_async = is_async
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **request):
+        create = self.client.chat.completions.create if self.client is not None else None
+        if self.is_async:
+            return self.cassette.acall(create, request)
+        return self.cassette.call(create, request)
+    
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.close()
+
+LLM_CASSETTE = None
+
+def configure_llm_cassette(directory: str = None, mode: str = "replay", replay_latency: bool = False) -> None:
+    """Route LLM calls through a cassette directory, or stop doing so when directory is None"""
+    global LLM_CASSETTE
+    LLM_CASSETTE = LLMCassette(directory, mode, replay_latency) if directory else None
+
+def llm_replay_only() -> bool:
+    """True when LLM responses come only from a cassette, so no API key or network is needed"""
+    return LLM_CASSETTE is not None and LLM_CASSETTE.mode == "replay"
+
+# One OpenAI client per process (per API key and endpoint) so every request reuses pooled
+# keep-alive connections instead of paying TCP/TLS set-up again. Async clients are bound to
+# their event loop, so each batch run gets its own, with the same pool settings. The pool is
+# sized to the caller's concurrency (--concurrency for batch and fan-out runs).
+LLM_CLIENT_MAX_CONNECTIONS = 32
+LLM_CLIENT_MAX_KEEPALIVE = 16
+LLM_CLIENT_KEEPALIVE_EXPIRY = 120.0
+LLM_CLIENT_TIMEOUT = {"connect": 10.0, "read": 180.0, "write": 30.0, "pool": 60.0}
+_LLM_CLIENTS = {}
+_LLM_CLIENTS_LOCK = threading.Lock()
+
+def _llm_http_options(max_connections: int) -> Dict[str, Any]:
+    """
+    Connection pool limits and timeouts for the SDK's default httpx client, built from the
+    SDK's own exports (openai.Timeout, and the Limits class of openai.DEFAULT_CONNECTION_LIMITS).
+    """
+    max_connections = max(1, max_connections)
+    limits_class = type(openai.DEFAULT_CONNECTION_LIMITS)
+    return {
+        "limits": limits_class(max_connections=max_connections,
+                               max_keepalive_connections=min(max_connections, LLM_CLIENT_MAX_KEEPALIVE),
+                               keepalive_expiry=LLM_CLIENT_KEEPALIVE_EXPIRY),
+        "timeout": openai.Timeout(**LLM_CLIENT_TIMEOUT)
+    }
+
+def _new_openai_client(api_key: str, is_async: bool, max_connections: int):
+    """OpenAI client with a tuned connection pool; the SDK's own retries are off (see call_with_backoff)"""
+    options = _llm_http_options(max_connections)
+    if is_async:
+        http_client = openai.DefaultAsyncHttpxClient(**options)
+        return openai.AsyncOpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+    http_client = openai.DefaultHttpxClient(**options)
+    return openai.OpenAI(api_key=api_key, max_retries=0, http_client=http_client)
+
+def shared_llm_client(api_key: str = None, max_connections: int = LLM_CLIENT_MAX_CONNECTIONS):
+    """The process-wide sync OpenAI client for api_key and the configured endpoint, created on first use"""
+    key = (api_key, os.getenv("OPENAI_BASE_URL"), max_connections)
+    with _LLM_CLIENTS_LOCK:
+        client = _LLM_CLIENTS.get(key)
+        if client is None:
+            client = _LLM_CLIENTS[key] = _new_openai_client(api_key, False, max_connections)
+        return client
+
+def close_llm_clients() -> None:
+    """Close the shared clients and their pooled connections"""
+    with _LLM_CLIENTS_LOCK:
+        clients = list(_LLM_CLIENTS.values())
+        _LLM_CLIENTS.clear()
+    for client in clients:
+        client.close()
+
+def create_llm_client(api_key: str = None, is_async: bool = False,
+                      max_connections: int = LLM_CLIENT_MAX_CONNECTIONS):
+    """
+    OpenAI client for structure requests, wrapped in the configured cassette if any.
+    Sync clients are shared (shared_llm_client); an async client is new and pooled for
+    its caller's event loop, which should close it. max_connections should cover the
+    caller's concurrency.
+    """
+    client = None
+    if not llm_replay_only():
+        if is_async:
+            client = _new_openai_client(api_key, True, max_connections)
+        else:
+            client = shared_llm_client(api_key, max_connections)
+    if LLM_CASSETTE is None:
+        return client
+    return CassetteClient(LLM_CASSETTE, client, is_async)
+
+def stream_structure_response(client, model: str, messages: List[Dict[str, str]], list_builder,
+                              params: Dict[str, Any]) -> tuple:
+    """
+    Request the structure with stream=True, feeding each chunk to list_builder.
+    Returns (full text, usage) where usage comes from the final chunk.
+    """
+    list_builder.reset()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **params
+    )
+    parts = []
+    usage = None
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            list_builder.feed(parts[-1])
+    return "".join(parts), usage
+
+def request_with_fallback(client, messages: List[Dict[str, str]], params_for, attempts: list,
+                          list_builder: "StreamingListBuilder" = None, purpose: str = "structure generation") -> tuple:
+    """
+    Send messages down the model fallback chain, with the circuit breaker, rate limiter and
+    retries, until a model answers. params_for(model) returns the request parameters.
+    Returns (content, model, params); raises the last model's error when every model fails.
+    """
+    models_to_try = available_models(STRUCTURE_MODELS)
+    for model in models_to_try:
+        started = time.perf_counter()
+        try:
+            params = params_for(model)
+            estimated_tokens = estimate_request_tokens(messages, params)
+            if list_builder is not None:
+                content, usage = call_with_backoff(
+                    lambda: stream_structure_response(client, model, messages, list_builder, params),
+                    estimated_tokens, model)
+            else:
+                response = call_with_backoff(
+                    lambda: client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **params
+                    ),
+                    estimated_tokens, model)
+                content, usage = response.choices[0].message.content, response.usage
+            record_model_result(model)
+            attempts.append(llm_attempt(model, started, "ok", usage))
+            
+            print(f"✅ Using {model} for {purpose}")
+            return content, model, params
+            
+        except Exception as model_error:
+            kind = record_model_result(model, model_error)
+            attempts.append(llm_attempt(model, started, kind, error=model_error))
+            print(f"⚠️  {model} not available ({kind}): {model_error}")
+            if model == models_to_try[-1]:  # Last model in list
+                raise model_error
+
+def llm_generate_structure(description: str, use_cache: bool = True, refresh_cache: bool = False,
+                           list_builder: "StreamingListBuilder" = None,
+                           structured_output: bool = False, attempts: list = None,
+                           similarity_threshold: float = SIMILARITY_THRESHOLD) -> Dict[str, Any]:
+    """
+    Use OpenAI ChatGPT to generate a proper JSON structure for SharePoint site requirements.
+    Falls back to basic parsing if OpenAI is not available.
+    Responses are cached on disk (see LLM_CACHE_PATH); use_cache=False bypasses the cache
+    and refresh_cache=True skips the lookup but stores the fresh response.
+    With a list_builder the response is streamed and lists are built as they arrive.
+    structured_output requests a JSON response format (see structure_response_format)
+    so the response is parsed without cleanup.
+    Each attempt is appended to attempts (see llm_attempt) when a list is given.
+    A cached near-duplicate description at or above similarity_threshold is reused (0 disables).
+    Concurrent calls for the same description share one request (see LLM_SINGLE_FLIGHT).
+    """
+    if attempts is None:
+        attempts = []
+    
+    if not OPENAI_AVAILABLE and not llm_replay_only():
+        print("⚠️  OpenAI not available, using basic parsing...")
+        return fallback_generate_structure(description)
+    
+    # Load environment variables from .env file
+    if DOTENV_AVAILABLE:
+        load_dotenv()
+    
+    # Get API key from .env file or environment variable
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key and not llm_replay_only():
+        print("⚠️  OPENAI_API_KEY not found in .env file or environment variables, using basic parsing...")
+        print("💡 Create a .env file with: OPENAI_API_KEY=your-api-key-here")
+        return fallback_generate_structure(description)
+    
+    models_to_try = STRUCTURE_MODELS
+    
+    # Reuse a cached response for the same description, prompt and parameters
+    if use_cache and not refresh_cache:
+        started = time.perf_counter()
+        cached = load_cached_structure(description, models_to_try, structured_output)
+        if cached is not None:
+            attempts.append(llm_attempt(cached[2], started, "cache"))
+            print(f"⚡ Using cached {cached[2]} response (no API call)")
+            return cached[0], cached[1]
+        similar = load_similar_structure(description, similarity_threshold)
+        if similar is not None:
+            attempts.append(llm_attempt(similar[2], started, "similar"))
+            print(f"♻️  Reusing the {similar[2]} structure of a near-duplicate description "
+                  f"(similarity {similar[3]:.2f}, no API call)")
+            return similar[0], similar[1]
+    
+    def generate():
+        try:
+            # Initialize OpenAI client
+            client = create_llm_client(api_key)
+            content, model, params = request_with_fallback(
+                client, structure_messages(description),
+                lambda model: structure_request_params(model, structured_output), attempts, list_builder)
+            
+            # Extract the JSON response without markdown fences or comments
+            response_text = structure_response_text(content, params)
+            
+            # Display the cleaned JSON response from LLM
+            print("📋 LLM JSON Response:")
+            print("=" * 50)
+            print(response_text)
+            print("=" * 50)
+            
+            # Note: LLM output will be saved in comprehensive report
+            
+            # Parse JSON
+            structure = json.loads(response_text)
+            
+            # Only responses that parse are worth caching
+            if use_cache:
+                store_cached_llm_response(llm_cache_key(model, description, structured_output), model,
+                                          response_text, description=description)
+            
+            # Add UUIDs for fields that don't have them
+            add_field_ids(structure)
+            
+            print(f"🤖 Generated structure using ChatGPT")
+            # Structure as JSON so concurrent callers sharing this request each get a copy
+            return json.dumps(structure), response_text, model
+            
+        except json.JSONDecodeError as e:
+            print(f"⚠️  Failed to parse ChatGPT response as JSON: {e}")
+            print("💡 Large sites may exceed one completion; --fan-out splits the request per list")
+            print("Falling back to basic parsing...")
+        except Exception as e:
+            print(f"⚠️  ChatGPT API error: {e}")
+            print("Falling back to basic parsing...")
+        structure, json_content = fallback_generate_structure(description)
+        return json.dumps(structure), json_content, "fallback"
+    
+    # Identical requests already in flight share that call
+    started = time.perf_counter()
+    (snapshot, response_text, source), shared = LLM_SINGLE_FLIGHT.do(
+        single_flight_key(description, structured_output), generate)
+    if shared:
+        attempts.append(llm_attempt(source, started, "shared"))
+        print(f"🔗 Shared the result of an identical in-flight request ({source}, no API call)")
+    return json.loads(snapshot), response_text
+
+async def async_llm_generate_structure(client, description: str, semaphore: "asyncio.Semaphore",
+                                       use_cache: bool = True, refresh_cache: bool = False,
+                                       structured_output: bool = False, attempts: list = None,
+                                       similarity_threshold: float = SIMILARITY_THRESHOLD) -> tuple:
+    """
+    Async counterpart of llm_generate_structure for batch runs, using an openai.AsyncOpenAI client.
+    semaphore bounds the number of requests in flight. Falls back to basic parsing on errors.
+    Returns (structure, json_content, source) where source is the model name, "cache", "similar",
+    "shared" (an identical request was already in flight) or "fallback".
+    """
+    if attempts is None:
+        attempts = []
+    
+    if use_cache and not refresh_cache:
+        started = time.perf_counter()
+        cached = load_cached_structure(description, STRUCTURE_MODELS, structured_output)
+        if cached is not None:
+            attempts.append(llm_attempt(cached[2], started, "cache"))
+            return cached[0], cached[1], "cache"
+        similar = load_similar_structure(description, similarity_threshold)
+        if similar is not None:
+            attempts.append(llm_attempt(similar[2], started, "similar"))
+            return similar[0], similar[1], "similar"
+    
+    if client is None:
+        structure, json_content = fallback_generate_structure(description)
+        return structure, json_content, "fallback"
+    
+    # Duplicate descriptions in flight share one request (outside the semaphore, so waiting
+    # callers don't hold a slot); each caller gets its own copy of the structure
+    started = time.perf_counter()
+    (snapshot, response_text, source), shared = await LLM_SINGLE_FLIGHT.ado(
+        single_flight_key(description, structured_output),
+        lambda: _async_request_structure(client, description, semaphore, use_cache, structured_output, attempts))
+    if shared:
+        attempts.append(llm_attempt(source, started, "shared"))
+        source = "shared"
+    return json.loads(snapshot), response_text, source
+
+async def _async_request_structure(client, description: str, semaphore: "asyncio.Semaphore", use_cache: bool,
+                                   structured_output: bool, attempts: list) -> tuple:
+    """
+    The API part of async_llm_generate_structure. Returns (structure JSON, response text, source);
+    the structure is serialized so callers sharing the request each get a copy.
+    """
+    try:
+        async with semaphore:
+            models_to_try = available_models(STRUCTURE_MODELS)
+            for model in models_to_try:
+                started = time.perf_counter()
+                try:
+                    params = structure_request_params(model, structured_output)
+                    response = await async_call_with_backoff(
+                        lambda: client.chat.completions.create(
+                            model=model,
+                            messages=structure_messages(description),
+                            **params
+                        ),
+                        estimate_request_tokens(structure_messages(description), params), model)
+                    record_model_result(model)
+                    attempts.append(llm_attempt(model, started, "ok", response.usage))
+                    break
+                except Exception as model_error:
+                    kind = record_model_result(model, model_error)
+                    attempts.append(llm_attempt(model, started, kind, error=model_error))
+                    if model == models_to_try[-1]:  # Last model in list
+                        raise
+        
+        response_text = structure_response_text(response.choices[0].message.content, params)
+        structure = json.loads(response_text)
+        if use_cache:
+            store_cached_llm_response(llm_cache_key(model, description, structured_output), model,
+                                      response_text, description=description)
+        add_field_ids(structure)
+        return json.dumps(structure), response_text, model
+    
+    except Exception as e:
+        print(f"⚠️  ChatGPT error for '{description[:40]}': {e}; using basic parsing")
+        structure, json_content = fallback_generate_structure(description)
+        return json.dumps(structure), json_content, "fallback"
+
+# Delta regeneration (--base-structure/--delta): the model sees a compact summary of an existing
+# structure plus the change request and returns only the changed parts, which are merged back
+# with the existing field IDs kept. Bump DELTA_PROMPT_VERSION whenever the prompt text changes.
+DELTA_PROMPT_VERSION = "1"
+DELTA_REQUEST_PARAMS = {"temperature": 0.1, "max_tokens": 1500}
+
+DELTA_SYSTEM_PROMPT = """You are a SharePoint expert updating an existing PnP provisioning template structure. The user message holds a compact summary of the current structure followed by a change request. Return ONLY a valid JSON object (no explanation text) containing just the changes:
+
+{
+  "site_title": "only if it changes", "description": "only if it changes",
+  "theme": {"name": "CorporateBlue", "primary_color": "#0078d4", "is_inverted": false, "generate_palette": true},
+  "site_fields": [
+    {"name": "FieldName", "displayName": "Display Name", "type": "Text|Note|Choice|DateTime|User|Number|Currency|Boolean|Lookup", "group": "Custom Columns", "choices": ["Option1", "Option2"], "required": false}
+  ],
+  "lists": [
+    {"title": "Exact List/Library Title", "template_type": 100, "url": "Lists/ListName or LibraryName", "description": "purpose", "enable_versioning": true, "on_quick_launch": true, "fields": [],
+     "views": [{"name": "View Name", "display_name": "Display Name", "type": "HTML", "default": false, "fields": ["Field1", "Field2"], "query": "<OrderBy><FieldRef Name='Title' /></OrderBy>", "row_limit": 30, "paged": true}]}
+  ],
+  "navigation": [{"title": "Navigation Item", "url": "{site}/path or external URL", "description": "purpose"}],
+  "remove_lists": ["List Title"], "remove_site_fields": ["FieldName"], "remove_navigation": ["Navigation Item"]
+}
+
+Rules:
+1. Omit every key and item that does not change. Never repeat unchanged lists, fields or navigation items.
+2. A new or changed list is returned complete, with all of its views; lists are matched by title.
+3. New columns go in site_fields (they are added to every list); leave each list's "fields" empty. A changed site field is returned complete under its existing name.
+4. Views and CAML queries use the exact field names from the summary or from new site_fields.
+5. template_type: 100=Custom List, 101=Document Library, 104=Announcements, 105=Contacts, 106=Events, 107=Tasks. URLs without spaces.
+6. Use EXACT names from quotes or "called" phrases in the change request.
+"""
+
+DELTA_USER_TEMPLATE = 'Current structure:\n{summary}\n\nChange request: "{delta}"'
+
+def summarize_structure(structure: Dict[str, Any]) -> str:
+    """
+    Compact JSON summary of a structure for delta requests: names, types and titles only
+    (no IDs, queries or descriptions).
+    """
+    summary = {
+        "site_type": structure.get("site_type"),
+        "site_title": structure.get("site_title"),
+        "theme": (structure.get("theme") or {}).get("name"),
+        "site_fields": [
+            {"name": f["name"], "type": f.get("type"), **({"choices": f["choices"]} if f.get("choices") else {})}
+            for f in structure.get("site_fields", [])
+        ],
+        "lists": [
+            {"title": l["title"], "template_type": l.get("template_type"), "url": l.get("url"),
+             "views": [v.get("name") for v in l.get("views", [])]}
+            for l in structure.get("lists", [])
+        ],
+        "navigation": [n.get("title") for n in structure.get("navigation", [])]
+    }
+    return json.dumps(summary, separators=(",", ":"), ensure_ascii=False)
+
+def delta_messages(base: Dict[str, Any], delta: str) -> List[Dict[str, str]]:
+    """Chat messages for a delta request: the static delta prompt, then the summary and change request"""
+    return [
+        {"role": "system", "content": DELTA_SYSTEM_PROMPT},
+        {"role": "user", "content": DELTA_USER_TEMPLATE.format(summary=summarize_structure(base), delta=delta)}
+    ]
+
+def fragment_request_params(model: str, base_params: Dict[str, Any], structured_output: bool = False) -> Dict[str, Any]:
+    """Request parameters for a partial structure; fragments have no fixed schema, so at most JSON mode is used"""
+    params = dict(base_params)
+    if structured_output and model.startswith(JSON_SCHEMA_MODEL_PREFIXES + JSON_MODE_MODEL_PREFIXES):
+        params["response_format"] = {"type": "json_object"}
+    return params
+
+def _same_field_name(existing: str, name: str) -> bool:
+    """Match a fragment field name to an existing one, including names add_field_ids prefixed with Custom"""
+    existing, name = existing.lower(), name.lower()
+    return existing == name or existing == f"custom{name}"
+
+def merge_structure_delta(base: Dict[str, Any], fragment: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Merge a delta fragment into a copy of base. Scalars and theme are overridden, removals are
+    applied, and site fields, lists and navigation items are replaced (matched by name/title)
+    or appended. Replaced site fields keep their existing name and ID; add_field_ids then
+    assigns IDs to the new ones.
+    """
+    merged = json.loads(json.dumps(base))
+    
+    for key in ("site_type", "base_template", "site_title", "description"):
+        if fragment.get(key):
+            merged[key] = fragment[key]
+    if fragment.get("theme"):
+        merged["theme"] = {**merged.get("theme", {}), **fragment["theme"]}
+    
+    removed_fields = fragment.get("remove_site_fields", [])
+    merged["site_fields"] = [f for f in merged.get("site_fields", [])
+                             if not any(_same_field_name(f["name"], name) for name in removed_fields)]
+    removed_lists = {title.lower() for title in fragment.get("remove_lists", [])}
+    merged["lists"] = [l for l in merged.get("lists", []) if l["title"].lower() not in removed_lists]
+    removed_navigation = {title.lower() for title in fragment.get("remove_navigation", [])}
+    merged["navigation"] = [n for n in merged.get("navigation", []) if n["title"].lower() not in removed_navigation]
+    
+    site_fields = merged["site_fields"]
+    for field in fragment.get("site_fields", []):
+        index = next((i for i, f in enumerate(site_fields) if _same_field_name(f["name"], field["name"])), None)
+        if index is None:
+            site_fields.append(field)
+            continue
+        existing = site_fields[index]
+        site_fields[index] = {**existing, **field, "name": existing["name"]}
+        if "id" in existing:
+            site_fields[index]["id"] = existing["id"]
+    
+    for key, match in (("lists", "title"), ("navigation", "title")):
+        items = merged[key]
+        for item in fragment.get(key, []):
+            index = next((i for i, existing in enumerate(items)
+                          if existing[match].lower() == item[match].lower()), None)
+            if index is None:
+                items.append(item)
+            else:
+                items[index] = item
+    
+    add_field_ids(merged)
+    return merged
+
+def load_base_structure(path: str) -> Dict[str, Any]:
+    """Read a structure saved in llm-outputs/ (or any structure JSON) as the base for a delta"""
+    with open(path, 'r', encoding='utf-8') as f:
+        structure = json.loads(clean_llm_response(f.read()))
+    if not isinstance(structure, dict) or "site_fields" not in structure and "lists" not in structure:
+        raise ValueError(f"{path} does not contain a site structure")
+    return structure
+
+def llm_generate_delta(base: Dict[str, Any], delta: str, structured_output: bool = False,
+                       attempts: list = None) -> tuple:
+    """
+    Apply a change request to an existing structure with a small delta completion.
+    Returns (merged structure, its JSON); raises when no model can produce a usable fragment,
+    since the basic parser cannot edit an existing structure.
+    """
+    if attempts is None:
+        attempts = []
+    
+    if not OPENAI_AVAILABLE and not llm_replay_only():
+        raise RuntimeError("OpenAI is required for delta regeneration (pip install openai)")
+    if DOTENV_AVAILABLE:
+        load_dotenv()
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key and not llm_replay_only():
+        raise RuntimeError("OPENAI_API_KEY is required for delta regeneration")
+    
+    client = create_llm_client(api_key)
+    content, model, params = request_with_fallback(
+        client, delta_messages(base, delta),
+        lambda model: fragment_request_params(model, DELTA_REQUEST_PARAMS, structured_output), attempts,
+        purpose="delta regeneration")
+    
+    response_text = structure_response_text(content, params)
+    print("📋 LLM Delta Response:")
+    print("=" * 50)
+    print(response_text)
+    print("=" * 50)
+    
+    fragment = json.loads(response_text)
+    if not isinstance(fragment, dict):
+        raise ValueError("delta response is not a JSON object")
+    structure = merge_structure_delta(base, fragment)
+    print(f"🤖 Merged delta into '{structure.get('site_title', '')}' using ChatGPT")
+    return structure, json.dumps(structure, indent=2, ensure_ascii=False)
+
+# Fan-out generation (--fan-out): one call plans the site skeleton and list inventory, then one
+# call per list designs its views (and any columns it needs) in parallel, so large sites are not
+# capped by a single completion's max_tokens. Bump FAN_OUT_PROMPT_VERSION when the prompts change.
+FAN_OUT_PROMPT_VERSION = "1"
+PLAN_REQUEST_PARAMS = {"temperature": 0.1, "max_tokens": 1500}
+LIST_REQUEST_PARAMS = {"temperature": 0.1, "max_tokens": 1500}
+
+PLAN_SYSTEM_PROMPT = """You are a SharePoint expert with deep knowledge of PnP Provisioning Templates. For the site description in the user message, return ONLY a valid JSON object (no explanation text) with the site skeleton and list inventory. List views are designed separately, so do not include them.
+
+{
+  "site_type": "TeamSite" | "CommunicationSite",
+  "base_template": "GROUP#0" (TeamSite) | "SITEPAGEPUBLISHING#0" (CommunicationSite),
+  "site_title": "specific title from the description",
+  "description": "brief site purpose",
+  "theme": {"name": "CorporateBlue", "primary_color": "#0078d4", "is_inverted": false, "generate_palette": true},
+  "site_fields": [
+    {"name": "FieldName", "displayName": "Display Name", "type": "Text|Note|Choice|DateTime|User|Number|Currency|Boolean|Lookup", "group": "Custom Columns", "choices": ["Option1", "Option2"], "required": false}
+  ],
+  "lists": [{"title": "Exact List/Library Title", "template_type": 100, "url": "Lists/ListName or LibraryName", "description": "purpose", "enable_versioning": true, "on_quick_launch": true}],
+  "navigation": [{"title": "Navigation Item", "url": "{site}/path or external URL", "description": "purpose"}]
+}
+
+Rules:
+1. Include every list and library the description asks for; use EXACT names from quotes or "called" phrases and avoid generic site titles like "Team Site".
+2. site_fields are added to every list automatically. Field types: Text, Note, Choice, DateTime, Boolean, Number, Currency, User, Lookup; "choices" only for Choice fields.
+3. template_type: 100=Custom List, 101=Document Library (always for libraries), 104=Announcements, 105=Contacts, 106=Events, 107=Tasks. enable_versioning only matters for 101. URLs without spaces.
+4. Add meaningful navigation items.
+5. Theme: primary_color by context - corporate blue #0078d4, healthcare teal #008a8a, finance green #498205, emergency/safety red #d13438, education purple #5c2d91. generate_palette true; is_inverted false unless a dark theme is asked for.
+"""
+
+LIST_SYSTEM_PROMPT = """You are a SharePoint expert designing one list of a PnP provisioning template. The user message holds the site description, a compact summary of the site (site columns and lists) and the list to design. Return ONLY a valid JSON object (no explanation text):
+
+{
+  "list": {"title": "the given title", "template_type": 100, "url": "the given url", "description": "purpose", "enable_versioning": true, "on_quick_launch": true, "fields": [],
+           "views": [{"name": "View Name", "display_name": "Display Name", "type": "HTML", "default": false, "fields": ["Field1", "Field2"], "query": "<OrderBy><FieldRef Name='Title' /></OrderBy>", "row_limit": 30, "paged": true}]},
+  "site_fields": [new columns this list needs that are not in the summary, same shape as the summary's site_fields plus "displayName", "group", "required"]
+}
+
+Rules:
+1. Keep the given title, template_type and url; leave "fields" empty.
+2. Views: a default "All Items" view with key fields, filtered views for subsets (e.g. "Active Projects"), CALENDAR views for date-based lists, sorted views for priority/status. Other views use type HTML. 6-8 fields per view.
+3. Views and CAML queries use exact internal names from the summary's site_fields or your new site_fields, with matching value types and valid CAML for Where/OrderBy/GroupBy.
+4. Only add site_fields that are missing from the summary; otherwise return "site_fields": [].
+"""
+
+LIST_USER_TEMPLATE = 'Description: "{description}"\n\nSite:\n{summary}\n\nList to design: {list_def}'
+
+def plan_messages(description: str) -> List[Dict[str, str]]:
+    """Chat messages for the fan-out skeleton request"""
+    return [
+        {"role": "system", "content": PLAN_SYSTEM_PROMPT},
+        {"role": "user", "content": STRUCTURE_USER_TEMPLATE.format(description=description)}
+    ]
+
+def list_messages(description: str, skeleton: Dict[str, Any], list_def: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Chat messages for the fan-out request that designs list_def's views"""
+    return [
+        {"role": "system", "content": LIST_SYSTEM_PROMPT},
+        {"role": "user", "content": LIST_USER_TEMPLATE.format(
+            description=description, summary=summarize_structure(skeleton),
+            list_def=json.dumps(list_def, separators=(",", ":"), ensure_ascii=False))}
+    ]
+
+def fan_out_list_result(result) -> Dict[str, Any]:
     """
-    Use OpenAI ChatGPT to generate a proper JSON structure for SharePoint site requirements.
-    Falls back to basic parsing if OpenAI is not available.
+    Check the shape of a per-list response: {"list": {...}, "site_fields": [...]}. Fields without
+    a name are dropped; raises ValueError when the response is not usable at all.
     """
-    if not OPENAI_AVAILABLE:
+    if not isinstance(result, dict) or not isinstance(result.get("list", {}), dict):
+        raise ValueError("list response is not a {\"list\": {...}} object")
+    views = result.get("list", {}).get("views", [])
+    if not isinstance(views, list) or not all(isinstance(v, dict) for v in views):
+        raise ValueError("list views are not a list of objects")
+    fields = result.get("site_fields") or []
+    if not isinstance(fields, list):
+        raise ValueError("site_fields is not a list")
+    return {
+        "list": result.get("list", {}),
+        "site_fields": [f for f in fields if isinstance(f, dict) and isinstance(f.get("name"), str) and f["name"]]
+    }
+
+def merge_fan_out(skeleton: Dict[str, Any], list_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge per-list results into the skeleton in inventory order, whatever order they finished in.
+    A missing result (None) keeps the inventory entry, which gets the generated default views.
+    New site fields are appended in list order, skipping names that already exist.
+    """
+    structure = json.loads(json.dumps(skeleton))
+    site_fields = structure.setdefault("site_fields", [])
+    lists = []
+    for entry, result in zip(skeleton.get("lists", []), list_results):
+        list_def = dict(entry)
+        if result is not None:
+            list_def.update(result.get("list") or {})
+            # The skeleton decides identity; the list call only adds views
+            for key in ("title", "template_type", "url"):
+                if key in entry:
+                    list_def[key] = entry[key]
+            for field in result.get("site_fields") or []:
+                if not any(_same_field_name(f["name"], field["name"]) for f in site_fields):
+                    site_fields.append(field)
+        list_def["fields"] = []
+        lists.append(list_def)
+    structure["lists"] = lists
+    add_field_ids(structure)
+    return structure
+
+def llm_generate_fan_out(description: str, concurrency: int = 4, structured_output: bool = False,
+                         attempts: list = None) -> tuple:
+    """
+    Generate a structure in two phases: the skeleton and list inventory, then the lists in
+    parallel (at most concurrency requests in flight), merged with merge_fan_out.
+    A failed list call keeps that list with default views; a failed skeleton call falls back
+    to basic parsing like llm_generate_structure. Returns (structure, its JSON).
+    """
+    if attempts is None:
+        attempts = []
+    
+    if not OPENAI_AVAILABLE and not llm_replay_only():
         print("⚠️  OpenAI not available, using basic parsing...")
         return fallback_generate_structure(description)
-    
-    # Load environment variables from .env file
     if DOTENV_AVAILABLE:
         load_dotenv()
-    
-    # Get API key from .env file or environment variable
     api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
+    if not api_key and not llm_replay_only():
         print("⚠️  OPENAI_API_KEY not found in .env file or environment variables, using basic parsing...")
-        print("💡 Create a .env file with: OPENAI_API_KEY=your-api-key-here")
         return fallback_generate_structure(description)
     
+    client = create_llm_client(api_key, max_connections=concurrency)
     try:
-        # Initialize OpenAI client
-        client = openai.OpenAI(api_key=api_key)
-        
-        # Create the enhanced prompt for GPT-4
-        prompt = f"""
-You are a SharePoint expert with deep knowledge of PnP Provisioning Templates. Based on the following description, generate a comprehensive JSON structure for a SharePoint PnP provisioning template.
-
-Description: "{description}"
-
-Analyze the description carefully and extract:
-1. Site type and purpose
-2. Exact names from quotes or "called" phrases
-3. Document libraries and their purposes
-4. Lists and their types
-5. Relevant site columns/fields
-6. Content types that group related fields
-7. Navigation structure
-8. Theme/branding requirements (colors, corporate identity)
-
-Return ONLY a valid JSON object with this exact structure:
-
-{{
-    "site_type": "TeamSite" or "CommunicationSite",
-    "base_template": "GROUP#0" for modern TeamSite or "SITEPAGEPUBLISHING#0" for CommunicationSite,
-    "site_title": "Meaningful title extracted from description - be specific",
-    "description": "Brief description of the site purpose",
-    "theme": {{
-        "name": "CustomTheme",
-        "primary_color": "#0078d4", // main brand color (blue for corporate, green for environmental, red for emergency, etc.)
-        "is_inverted": false, // true for dark themes
-        "generate_palette": true // if true, auto-generate full color palette from primary_color
-    }},
-    "site_fields": [
-        {{
-            "name": "FieldName",
-            "displayName": "Display Name",
-            "type": "Text|Choice|DateTime|User|Number|Boolean|Lookup",
-            "group": "Custom Columns",
-            "choices": ["Option1", "Option2"] // only for Choice fields,
-            "required": false
-        }}
-    ],
-    "lists": [
-        {{
-            "title": "Exact List/Library Title",
-            "template_type": 100, // 100=Custom List, 101=Document Library, 104=Announcements, 105=Contacts, 106=Events, 107=Tasks
-            "url": "Lists/ListName or LibraryName",
-            "description": "Purpose of this list/library",
-            "enable_versioning": true, // only for document libraries (101)
-            "on_quick_launch": true,
-            "fields": [], // leave empty - all site fields will be auto-added to lists
-            "views": [
-                {{
-                    "name": "View Name",
-                    "display_name": "Display Name for View",
-                    "type": "HTML", // HTML, GANTT, CALENDAR, etc.
-                    "default": false, // true for default view
-                    "fields": ["Field1", "Field2", "Field3"], // field internal names to display
-                    "query": "<OrderBy><FieldRef Name='Title' /></OrderBy>", // optional CAML query for sorting/filtering
-                    "row_limit": 30, // optional row limit
-                    "paged": true // optional paging
-                }}
-            ]
-        }}
-    ],
-    "navigation": [
-        {{
-            "title": "Navigation Item",
-            "url": "{{site}}/path or external URL",
-            "description": "Purpose of this navigation item"
-        }}
-    ],
-    "features": [
-        {{
-            "id": "feature-guid",
-            "name": "Feature Name",
-            "scope": "Site" // or "Web"
-        }}
-    ]
-}}
-
-SharePoint Best Practice Rules:
-1. Design site_fields that are automatically added to all lists
-2. Create field definitions with appropriate types (Text, Choice, DateTime, Boolean, Number, Currency, User, Note)
-3. Fields are automatically distributed to all lists - no need for content types
-4. Extract EXACT names from quotes or "called" phrases - don't modify them
-5. Be specific with site titles - avoid generic names like "Team Site"
-6. For document libraries, always use template_type 101
-7. Choose appropriate template types: 106=Events, 107=Tasks, 105=Contacts, 104=Announcements
-8. Include relevant site columns based on the context
-9. Add meaningful navigation items
-10. Return ONLY the JSON, no explanation text
-11. Use proper SharePoint naming conventions
-12. Make URLs SharePoint-friendly (no spaces, proper casing)
-13. Create useful views for each list/library:
-    - Default "All Items" view with key fields
-    - Filtered views for specific data subsets (e.g., "Active Projects", "Completed Tasks")
-    - Calendar views for date-based lists
-    - Sorted views for priority/status fields
-    - Use CAML queries for complex filtering and sorting
-14. View field selection guidelines:
-    - Include Title and key identifier fields
-    - Add relevant date fields (Created, Modified, Due Date)
-    - Include status/priority fields for quick scanning
-    - Limit to 6-8 fields for optimal display
-    - **IMPORTANT: Use exact field names from site_fields array (e.g., if site field is "DueDate", use "DueDate" in view fields)**
-15. Use appropriate view types: HTML for most lists, CALENDAR for date-based content
-16. CAML Query Guidelines:
-    - Use exact field internal names from site_fields in queries
-    - Match field types correctly (Choice, DateTime, Text, etc.)
-    - Use proper CAML syntax for filtering and sorting
-17. Theme Guidelines:
-    - Choose primary_color based on context: corporate (blue #0078d4), healthcare (teal #008a8a), finance (green #498205), emergency/safety (red #d13438), education (purple #5c2d91)
-    - Use generate_palette: true to auto-create full theme from primary color
-    - Set is_inverted: false for light themes (most common), true for dark themes
-    - Theme name should be descriptive (e.g., "CorporateBlue", "HealthcareGreen", "EmergencyRed")
-
-Content Type Design Guidelines:
-- For documents: inherit from "Document" (0x0101)
-- For list items: inherit from "Item" (0x01)
-- Group related fields together logically
-- Name content types descriptively (e.g., "Policy Document", "Employee Record", "Training Material")
-- Reference existing site fields in the "fields" array
-
-Examples of good parsing:
-- "document library called 'Project Files'" -> title: "Project Files", url: "ProjectFiles"
-- "HR policies site" -> site_title: "HR Policies Portal"
-- "team site for marketing" -> site_title: "Marketing Team Site"
-"""
-
-        # Call GPT-4 (or fallback to GPT-3.5-turbo if GPT-4 is not available)
-        models_to_try = ["gpt-4-turbo-preview", "gpt-4", "gpt-3.5-turbo"]
-        
-        for model in models_to_try:
-            try:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": "You are a SharePoint expert who returns only valid JSON structures for PnP Provisioning Templates. Follow the exact schema provided and extract precise information from the user's description."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=3000
-                )
-                
-                print(f"✅ Using {model} for structure generation")
-                break
-                
-            except Exception as model_error:
-                print(f"⚠️  {model} not available: {model_error}")
-                if model == models_to_try[-1]:  # Last model in list
-                    raise model_error
-                continue
-        
-        # Extract and parse the JSON response
-        response_text = response.choices[0].message.content.strip()
-        
-        # Remove any markdown code blocks if present
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        # Clean JSON: Remove JavaScript-style comments that break JSON parsing
-        response_text = clean_json_comments(response_text)
-        
-        # Display the cleaned JSON response from LLM
-        print("📋 LLM JSON Response:")
-        print("=" * 50)
-        print(response_text)
-        print("=" * 50)
-        
-        # Note: LLM output will be saved in comprehensive report
-        
-        # Parse JSON
-        structure = json.loads(response_text)
-        
-        # Add UUIDs for fields that don't have them
-        add_field_ids(structure)
-        
-        print(f"🤖 Generated structure using ChatGPT")
-        return structure, response_text  # Return both structure and original JSON
-        
-    except json.JSONDecodeError as e:
-        print(f"⚠️  Failed to parse ChatGPT response as JSON: {e}")
-        print("Falling back to basic parsing...")
-        return fallback_generate_structure(description)
+        content, model, params = request_with_fallback(
+            client, plan_messages(description),
+            lambda model: fragment_request_params(model, PLAN_REQUEST_PARAMS, structured_output), attempts,
+            purpose="site skeleton")
+        skeleton = json.loads(structure_response_text(content, params))
+        skeleton["lists"] = [l for l in skeleton.get("lists", []) if isinstance(l, dict) and l.get("title")]
+        skeleton["site_fields"] = [f for f in skeleton.get("site_fields", []) if isinstance(f, dict) and f.get("name")]
     except Exception as e:
-        print(f"⚠️  ChatGPT API error: {e}")
+        print(f"⚠️  ChatGPT skeleton error: {e}")
         print("Falling back to basic parsing...")
         return fallback_generate_structure(description)
+    
+    print(f"🗺️  Planned '{skeleton.get('site_title', '')}' with {len(skeleton['lists'])} list(s); "
+          f"designing them {max(1, concurrency)} at a time")
+    
+    def design_list(list_def):
+        try:
+            content, model, params = request_with_fallback(
+                client, list_messages(description, skeleton, list_def),
+                lambda model: fragment_request_params(model, LIST_REQUEST_PARAMS, structured_output), attempts,
+                purpose=f"list '{list_def['title']}'")
+            return fan_out_list_result(json.loads(structure_response_text(content, params)))
+        except Exception as e:
+            print(f"⚠️  List '{list_def['title']}' failed ({e}); using default views")
+            return None
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list_results = list(executor.map(design_list, skeleton["lists"]))
+    
+    structure = merge_fan_out(skeleton, list_results)
+    print(f"🤖 Generated structure using ChatGPT ({len(list_results) + 1} requests)")
+    return structure, json.dumps(structure, indent=2, ensure_ascii=False)
+
+# Field IDs are derived from the field's name and type rather than random, so the same structure
+# always serializes to the same XML (the validation verdict cache is keyed on it) and streamed
+# partial builds agree with the final build.
+FIELD_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "urn:sharepoint-pnp-generator:field")
+
+def field_id(name: str, field_type: str = "") -> str:
+    """Deterministic SharePoint field GUID ({UPPERCASE}) for a field name and type"""
+    return f"{{{str(uuid.uuid5(FIELD_ID_NAMESPACE, f'{name.lower()}:{field_type}')).upper()}}}"
 
 def add_field_ids(structure: Dict[str, Any]) -> None:
     """Add UUIDs to fields and ensure proper field synchronization."""
@@ -422,7 +2643,7 @@ def add_field_ids(structure: Dict[str, Any]) -> None:
                 field["displayName"] = f"Custom {field['displayName']}"
             
             if "id" not in field:
-                field["id"] = f"{{{str(uuid.uuid4()).upper()}}}"
+                field["id"] = field_id(field["name"], field.get("type", ""))
             
             field_registry[field["name"]] = field
             all_fields.append(field)
@@ -430,6 +2651,8 @@ def add_field_ids(structure: Dict[str, Any]) -> None:
     # Add list fields to registry and update list references
     for list_def in structure.get("lists", []):
         for field in list_def.get("fields", []):
+            if not isinstance(field, dict):
+                continue  # A plain name references a site field (basic parsing output)
             field_key = field["name"].lower()
             sanitized_name = field["name"]
             
@@ -447,7 +2670,7 @@ def add_field_ids(structure: Dict[str, Any]) -> None:
                 # Create new field in registry
                 field["name"] = sanitized_name
                 if "id" not in field:
-                    field["id"] = f"{{{str(uuid.uuid4()).upper()}}}"
+                    field["id"] = field_id(sanitized_name, field.get("type", ""))
                 
                 # Create corresponding site field
                 site_field = {
@@ -511,7 +2734,7 @@ def fallback_generate_structure(description: str) -> Dict[str, Any]:
         "description": description[:100] + "..." if len(description) > 100 else description,
         "site_fields": [
             {
-                "id": f"{{{str(uuid.uuid4()).upper()}}}",
+                "id": field_id("DocumentStatus", "Choice"),
                 "name": "DocumentStatus",
                 "displayName": "Document Status",
                 "type": "Choice",
@@ -993,36 +3216,309 @@ def create_field_xml(field: Dict[str, Any]) -> str:
                    ShowInEditForm="TRUE" 
                    ShowInNewForm="TRUE" />'''
 
-def structure_to_pnp_xml(structure: Dict[str, Any]) -> str:
+def build_list_instance(list_def: Dict[str, Any], site_fields: List[Dict[str, Any]],
+                        namespace: str = PNP_NAMESPACE, schema_index: Dict[str, Any] = None,
+                        use_lxml: bool = None):
     """
-    Convert structure dictionary to PnP Provisioning XML with proper namespace handling.
+    Build a detached pnp:ListInstance element (fields and views) for one list definition.
+    site_fields is the consolidated field list from add_field_ids; the result depends only on
+    these inputs, so a list can be built before the rest of the structure is known.
+    use_lxml defaults to LXML_AVAILABLE; False builds an ElementTree element.
+    """
+    if use_lxml is None:
+        use_lxml = LXML_AVAILABLE
+    X = etree if use_lxml else ET
+    
+    def pnp(tag: str) -> str:
+        return f"{{{namespace}}}{tag}"
+    
+    check_attribute = attribute_checker(schema_index) if schema_index else None
+    
+    def set_attr(element, name: str, value: str) -> None:
+        if check_attribute:
+            check_attribute(element, name, value)
+        element.set(name, value)
+    
+    if use_lxml:
+        list_instance = X.Element(pnp("ListInstance"), nsmap={"pnp": namespace})
+    else:
+        list_instance = X.Element(pnp("ListInstance"))
+    set_attr(list_instance, "Title", list_def["title"])
+    set_attr(list_instance, "Description", list_def.get("description", f"List for managing {list_def['title'].lower()}"))
+    set_attr(list_instance, "TemplateType", str(list_def["template_type"]))
+    set_attr(list_instance, "Url", list_def["url"])
+    
+    # Add comprehensive Microsoft-style attributes
+    if list_def["template_type"] == 101:  # Document Library
+        set_attr(list_instance, "EnableVersioning", "true")
+        set_attr(list_instance, "EnableMinorVersions", "true")
+        set_attr(list_instance, "EnableModeration", "false")
+        set_attr(list_instance, "MinorVersionLimit", "10")
+        set_attr(list_instance, "MaxVersionLimit", "50")
+        set_attr(list_instance, "DraftVersionVisibility", "1")  # Author
+        set_attr(list_instance, "EnableAttachments", "false")
+        set_attr(list_instance, "EnableFolderCreation", "true")
+    elif list_def["template_type"] == 106:  # Events/Calendar
+        set_attr(list_instance, "EnableAttachments", "false")
+        set_attr(list_instance, "EnableFolderCreation", "false")
+    elif list_def["template_type"] == 100:  # Custom List
+        set_attr(list_instance, "EnableAttachments", "true")
+        set_attr(list_instance, "EnableFolderCreation", "false")
+    elif list_def["template_type"] == 105:  # Contacts
+        set_attr(list_instance, "EnableAttachments", "true")
+        set_attr(list_instance, "EnableFolderCreation", "false")
+    elif list_def["template_type"] == 109:  # Picture Library
+        set_attr(list_instance, "EnableFolderCreation", "true")
+        set_attr(list_instance, "EnableAttachments", "false")
+    
+    # Common attributes for all lists
+    set_attr(list_instance, "ContentTypesEnabled", "false")  # Set to false to use list fields directly
+    set_attr(list_instance, "OnQuickLaunch", "true")
+    set_attr(list_instance, "Hidden", "false")
+    set_attr(list_instance, "NoCrawl", "false")
+    set_attr(list_instance, "RemoveExistingContentTypes", "false")
+    
+    # Add list-specific fields using Microsoft pattern (inside the list, not as site fields)
+    # If list has no fields specified or empty array, only add relevant fields based on context
+    fields_to_add = list_def.get("fields", [])
+    if not fields_to_add and site_fields:
+        # Intelligently assign fields based on list type and field relevance
+        fields_to_add = get_relevant_fields_for_list(list_def, site_fields)
+    
+    # Also add fields referenced in custom views for this list
+    if list_def.get("views"):
+        for view in list_def["views"]:
+            for field_name in view.get("fields", []):
+                # Try to map field names correctly
+                validated_field = validate_field_reference(field_name, list_def, site_fields)
+                if validated_field and validated_field not in fields_to_add:
+                    # Check if this is a custom field that should be added
+                    for site_field in site_fields:
+                        if site_field["name"] == validated_field:
+                            fields_to_add.append(validated_field)
+                            break
+    
+    if fields_to_add:
+        fields_elem = X.SubElement(list_instance, pnp("Fields"))
+        for field_name in fields_to_add:
+            # Find the field definition in site_fields
+            field_def = next((f for f in site_fields if f["name"] == field_name), None)
+            if field_def:
+                # Create Field element (no namespace - Microsoft pattern)
+                field_elem = X.SubElement(fields_elem, "Field")
+    
+                # Use Microsoft field pattern attributes
+                set_attr(field_elem, "Type", field_def["type"])
+                set_attr(field_elem, "DisplayName", field_def["displayName"])
+                set_attr(field_elem, "Required", "TRUE" if field_def.get("required", False) else "FALSE")
+                set_attr(field_elem, "EnforceUniqueValues", "FALSE")
+                set_attr(field_elem, "Indexed", "FALSE")
+    
+                # Ensure field ID has braces format
+                field_id = field_def["id"]
+                if not field_id.startswith("{"):
+                    field_id = "{" + field_id + "}"
+                set_attr(field_elem, "ID", field_id)
+                set_attr(field_elem, "StaticName", field_def["name"])
+                set_attr(field_elem, "Name", field_def["name"])
+    
+                # Add type-specific attributes following Microsoft pattern
+                if field_def["type"] == "Text":
+                    max_length = field_def.get("maxLength", 50)
+                    set_attr(field_elem, "MaxLength", str(max_length))
+                    if field_def.get("default"):
+                        default_elem = X.SubElement(field_elem, "Default")
+                        default_elem.text = field_def["default"]
+    
+                elif field_def["type"] == "Choice" and field_def.get("choices"):
+                    set_attr(field_elem, "Format", "Dropdown")
+                    set_attr(field_elem, "FillInChoice", "FALSE")
+    
+                    # Add default value first (Microsoft pattern)
+                    default_value = field_def.get("default", field_def["choices"][0] if field_def["choices"] else "Option1")
+                    default_elem = X.SubElement(field_elem, "Default")
+                    default_elem.text = default_value
+    
+                    # Create CHOICES element (no namespace)
+                    choices_elem = X.SubElement(field_elem, "CHOICES")
+                    for choice in field_def["choices"]:
+                        choice_elem = X.SubElement(choices_elem, "CHOICE")
+                        choice_elem.text = choice
+    
+    # Add Views following Microsoft pattern
+    views_elem = X.SubElement(list_instance, pnp("Views"))
+    set_attr(views_elem, "RemoveExistingViews", "false")
+    
+    # Use views from JSON if provided, otherwise generate intelligent views
+    if list_def.get("views"):
+        # Create field name mapping to handle "Custom" prefixed fields
+        builtin_fields = {
+            'location', 'title', 'description', 'author', 'editor', 'created', 'modified',
+            'id', 'version', 'name', 'url', 'path', 'type', 'size', 'status', 'category',
+            'comments', 'tags', 'keywords', 'subject', 'company', 'manager', 'department',
+            'priority', 'assignedto', 'duedate', 'startdate', 'percentcomplete', 'outcome',
+            'contenttype', 'attachments', 'linkfilename', 'docicon', 'edit', 'folder',
+            'order', 'guid', 'fileleafref', 'fileref', 'filepath', 'filesizebytes',
+            'checkedoutto', 'owner', 'workflow', 'importance', 'sensitivity'
+        }
+    
+        def map_field_name(field_name):
+            """Map JSON field names to actual generated field names"""
+            # Don't map standard SharePoint fields like Title, Modified, Created, etc.
+            standard_fields = {'title', 'modified', 'created', 'author', 'editor', 'id', 'linktitle', 'docicon', 'linkfilename'}
+            if field_name.lower() in standard_fields:
+                return field_name
+            if field_name.lower() in builtin_fields:
+                return f"Custom{field_name}"
+            return field_name
+    
+        # Use views specified in the JSON structure
+        views_to_create = []
+        for view_json in list_def["views"]:
+            # Map field names in view fields
+            mapped_fields = [map_field_name(f) for f in view_json.get("fields", ["LinkTitle", "Modified"])]
+    
+            # Map field names in CAML query
+            query = view_json.get("query", "")
+            for site_field in site_fields:
+                original_name = site_field["name"]
+                if original_name.startswith("Custom"):
+                    # Find the original name without Custom prefix
+                    base_name = original_name[6:]  # Remove "Custom" prefix
+                    if base_name.lower() in builtin_fields:
+                        query = query.replace(f"Name='{base_name}'", f"Name='{original_name}'")
+                        query = query.replace(f"Name=\"{base_name}\"", f"Name=\"{original_name}\"")
+    
+            view_dict = {
+                "name": view_json.get("name", "View"),
+                "display_name": view_json.get("display_name", view_json.get("name", "View")),
+                "url": f"{view_json.get('name', 'View').replace(' ', '')}.aspx",
+                "default": "TRUE" if view_json.get("default", False) else "FALSE",
+                "fields": mapped_fields,
+                "query": query,
+                "row_limit": view_json.get("row_limit", 30),
+                "type": view_json.get("type", "HTML"),
+                "paged": view_json.get("paged", True)
+            }
+            views_to_create.append(view_dict)
+    else:
+        # Generate appropriate views based on list type and fields
+        views_to_create = generate_list_views(list_def, site_fields)
+    
+    for view_def in views_to_create:
+        view_elem = X.SubElement(views_elem, "View")
+        set_attr(view_elem, "Name", view_def["name"])
+        set_attr(view_elem, "DefaultView", view_def.get("default", "FALSE"))
+        set_attr(view_elem, "MobileView", "FALSE")
+        set_attr(view_elem, "MobileDefaultView", "FALSE")
+        set_attr(view_elem, "Type", view_def.get("type", "HTML"))
+        set_attr(view_elem, "DisplayName", view_def["display_name"])
+        set_attr(view_elem, "Url", view_def.get("url", f"{view_def['name'].replace(' ', '')}.aspx"))
+        set_attr(view_elem, "Level", "1")
+        set_attr(view_elem, "BaseViewID", "1")
+        set_attr(view_elem, "ContentTypeID", "0x")
+        if list_def["template_type"] == 101:  # Document Library
+            set_attr(view_elem, "ImageUrl", "/_layouts/15/images/dlicon.png")
+    
+        # Add Query if filter/sort is specified
+        if view_def.get("query"):
+            query_elem = X.SubElement(view_elem, "Query")
+            # Parse the CAML query XML and append as child elements
+            try:
+                # Wrap the query in a temporary root element for parsing
+                temp_query = f"<TempRoot>{view_def['query']}</TempRoot>"
+                temp_root = X.fromstring(temp_query)
+                # Drop indentation whitespace so the serializer can re-indent the query
+                for node in temp_root.iter():
+                    if node.text is not None and not node.text.strip():
+                        node.text = None
+                    if node.tail is not None and not node.tail.strip():
+                        node.tail = None
+                # Add all child elements of the temp root to the actual Query element
+                for child in list(temp_root):
+                    query_elem.append(child)
+            except SyntaxError:  # ET.ParseError and lxml's XMLSyntaxError
+                # Fallback: if parsing fails, treat as text (should not happen with proper CAML)
+                query_elem.text = view_def["query"]
+    
+        # Add ViewFields with validation
+        viewfields_elem = X.SubElement(view_elem, "ViewFields")
+        for field_name in view_def["fields"]:
+            # Validate field references for calendar lists
+            validated_field_name = validate_field_reference(field_name, list_def, site_fields)
+            if validated_field_name:  # Only add valid field references
+                fieldref_elem = X.SubElement(viewfields_elem, "FieldRef")
+                set_attr(fieldref_elem, "Name", validated_field_name)
+    
+        # Add RowLimit
+        rowlimit_elem = X.SubElement(view_elem, "RowLimit")
+        paged_setting = "TRUE" if view_def.get("paged", True) else "FALSE"
+        set_attr(rowlimit_elem, "Paged", paged_setting)
+        rowlimit_elem.text = str(view_def.get("row_limit", 30))
+    
+        # Add standard elements
+        jslink_elem = X.SubElement(view_elem, "JSLink")
+        jslink_elem.text = "clienttemplates.js"
+    
+        xsllink_elem = X.SubElement(view_elem, "XslLink")
+        set_attr(xsllink_elem, "Default", "TRUE")
+        xsllink_elem.text = "main.xsl"
+    
+        toolbar_elem = X.SubElement(view_elem, "Toolbar")
+        set_attr(toolbar_elem, "Type", "Standard")
+    
+    return list_instance
+
+def build_pnp_tree(structure: Dict[str, Any], validate_lists_xsd: str = None, fail_fast: bool = False,
+                   schema_index: Dict[str, Any] = None, namespace: str = PNP_NAMESPACE,
+                   prebuilt_lists: List = None, use_lxml: bool = None):
+    """
+    Build the PnP Provisioning XML tree for a structure dictionary.
+    Returns an lxml element when lxml is available (so it can be validated without
+    reparsing) and an ElementTree element otherwise, or when use_lxml is False.
+    When validate_lists_xsd is given, each pnp:ListInstance is validated against that schema
+    as soon as it is built; with fail_fast the first invalid list raises ListValidationError.
+    prebuilt_lists (see StreamingListBuilder.prebuilt_lists) supplies (element, errors) pairs,
+    or None, per list for lists already built while the response was streaming.
     Based on official SharePoint PnP template patterns.
     """
-    # Use the correct PnP namespace from official templates (updated to 2022-09)
-    namespace = "http://schemas.dev.office.com/PnP/2022/09/ProvisioningSchema"
+    # Build with lxml when available so the tree can be validated directly
+    if use_lxml is None:
+        use_lxml = LXML_AVAILABLE
+    X = etree if use_lxml else ET
+    
+    def pnp(tag: str) -> str:
+        return f"{{{namespace}}}{tag}"
     
-    # Register namespace with pnp prefix
-    ET.register_namespace('pnp', namespace)
+    check_attribute = attribute_checker(schema_index) if schema_index else None
+    
+    def set_attr(element, name: str, value: str) -> None:
+        if check_attribute:
+            check_attribute(element, name, value)
+        element.set(name, value)
     
     # Create root elements with Microsoft-style structure
-    root = ET.Element("pnp:Provisioning")
-    root.set("xmlns:pnp", namespace)
-    root.set("Author", "PnP Template Generator")
-    root.set("Generator", "SharePoint PnP CLI Tool")
-    root.set("Version", "1.0")
-    root.set("Description", structure.get("description", "SharePoint provisioning template"))
-    root.set("DisplayName", structure.get("site_title", "SharePoint Site Template"))
+    if use_lxml:
+        root = X.Element(pnp("Provisioning"), nsmap={"pnp": namespace})
+    else:
+        ET.register_namespace('pnp', namespace)
+        root = X.Element(pnp("Provisioning"))
+    set_attr(root, "Author", "PnP Template Generator")
+    set_attr(root, "Generator", "SharePoint PnP CLI Tool")
+    set_attr(root, "Version", "1.0")
+    set_attr(root, "Description", structure.get("description", "SharePoint provisioning template"))
+    set_attr(root, "DisplayName", structure.get("site_title", "SharePoint Site Template"))
     
     # Add tenant-level themes if theme is specified
     theme_config = structure.get("theme")
     if theme_config:
-        tenant = ET.SubElement(root, "pnp:Tenant")
-        themes_element = ET.SubElement(tenant, "pnp:Themes")
+        tenant = X.SubElement(root, pnp("Tenant"))
+        themes_element = X.SubElement(tenant, pnp("Themes"))
         
-        theme = ET.SubElement(themes_element, "pnp:Theme")
-        theme.set("Name", theme_config.get("name", "CustomTheme"))
-        theme.set("IsInverted", str(theme_config.get("is_inverted", False)).lower())
-        theme.set("Overwrite", "true")
+        theme = X.SubElement(themes_element, pnp("Theme"))
+        set_attr(theme, "Name", theme_config.get("name", "CustomTheme"))
+        set_attr(theme, "IsInverted", str(theme_config.get("is_inverted", False)).lower())
+        set_attr(theme, "Overwrite", "true")
         
         # Generate theme palette
         if theme_config.get("generate_palette", True) and theme_config.get("primary_color"):
@@ -1034,13 +3530,13 @@ def structure_to_pnp_xml(structure: Dict[str, Any]) -> str:
         theme.text = json.dumps(palette, indent=8)
     
     # Add Templates container with meaningful ID
-    templates = ET.SubElement(root, "pnp:Templates")
-    templates.set("ID", "MAIN-TEMPLATES")
+    templates = X.SubElement(root, pnp("Templates"))
+    set_attr(templates, "ID", "MAIN-TEMPLATES")
     
     # Create ProvisioningTemplate with Microsoft patterns
-    template = ET.SubElement(templates, "pnp:ProvisioningTemplate")
-    template.set("ID", "SITE-TEMPLATE")
-    template.set("Version", "1")
+    template = X.SubElement(templates, pnp("ProvisioningTemplate"))
+    set_attr(template, "ID", "SITE-TEMPLATE")
+    set_attr(template, "Version", "1")
     # Use appropriate base template based on site type
     site_type = structure.get("site_type", "team")
     base_templates = {
@@ -1049,284 +3545,84 @@ def structure_to_pnp_xml(structure: Dict[str, Any]) -> str:
         "classic": "STS#3",
         "document": "STS#0"
     }
-    template.set("BaseSiteTemplate", base_templates.get(site_type, "GROUP#0"))
-    template.set("Scope", "RootSite")
-    template.set("DisplayName", structure.get("site_title", "SharePoint Site Template"))
-    template.set("Description", structure.get("description", "Microsoft-style SharePoint provisioning template"))
+    set_attr(template, "BaseSiteTemplate", base_templates.get(site_type, "GROUP#0"))
+    set_attr(template, "Scope", "RootSite")
+    set_attr(template, "DisplayName", structure.get("site_title", "SharePoint Site Template"))
+    set_attr(template, "Description", structure.get("description", "Microsoft-style SharePoint provisioning template"))
     
     # Note: Theme is defined at tenant level and applied during site collection creation
     
     # Add WebSettings with comprehensive Microsoft-style configuration
-    web_settings = ET.SubElement(template, "pnp:WebSettings")
-    web_settings.set("RequestAccessEmail", "")
-    web_settings.set("NoCrawl", "false")
-    web_settings.set("WelcomePage", "SitePages/Home.aspx")
-    web_settings.set("Title", structure.get("site_title", "SharePoint Site"))
-    web_settings.set("Description", structure.get("description", ""))
-    web_settings.set("AlternateCSS", "")
-    web_settings.set("CommentsOnSitePagesDisabled", "false")
-    web_settings.set("QuickLaunchEnabled", "true")
-    web_settings.set("MembersCanShare", "true")
-    web_settings.set("ExcludeFromOfflineClient", "false")
-    web_settings.set("DisableFlows", "false")
-    web_settings.set("DisableAppViews", "false")
+    web_settings = X.SubElement(template, pnp("WebSettings"))
+    set_attr(web_settings, "RequestAccessEmail", "")
+    set_attr(web_settings, "NoCrawl", "false")
+    set_attr(web_settings, "WelcomePage", "SitePages/Home.aspx")
+    set_attr(web_settings, "Title", structure.get("site_title", "SharePoint Site"))
+    set_attr(web_settings, "Description", structure.get("description", ""))
+    set_attr(web_settings, "AlternateCSS", "")
+    set_attr(web_settings, "CommentsOnSitePagesDisabled", "false")
+    set_attr(web_settings, "QuickLaunchEnabled", "true")
+    set_attr(web_settings, "MembersCanShare", "true")
+    set_attr(web_settings, "ExcludeFromOfflineClient", "false")
+    set_attr(web_settings, "DisableFlows", "false")
+    set_attr(web_settings, "DisableAppViews", "false")
     
     # Add Features if any
     if structure.get("features"):
-        features = ET.SubElement(template, "pnp:Features")
-        site_features = ET.SubElement(features, "pnp:SiteFeatures")
+        features = X.SubElement(template, pnp("Features"))
+        site_features = X.SubElement(features, pnp("SiteFeatures"))
         for feature_id in structure["features"]:
-            feature = ET.SubElement(site_features, "pnp:Feature")
-            feature.set("ID", feature_id)
+            feature = X.SubElement(site_features, pnp("Feature"))
+            set_attr(feature, "ID", feature_id)
     
     # Skip ContentTypes - using Microsoft pattern with list-specific fields instead
     # Microsoft's working templates show fields defined within lists without content types
     
     # Add Lists (following Microsoft SharePoint best practices - using list-specific fields)
     if structure.get("lists"):
-        lists = ET.SubElement(template, "pnp:Lists")
-        for list_def in structure["lists"]:
-            list_instance = ET.SubElement(lists, "pnp:ListInstance")
-            list_instance.set("Title", list_def["title"])
-            list_instance.set("Description", list_def.get("description", f"List for managing {list_def['title'].lower()}"))
-            list_instance.set("TemplateType", str(list_def["template_type"]))
-            list_instance.set("Url", list_def["url"])
-            
-            # Add comprehensive Microsoft-style attributes
-            if list_def["template_type"] == 101:  # Document Library
-                list_instance.set("EnableVersioning", "true")
-                list_instance.set("EnableMinorVersions", "true")
-                list_instance.set("EnableModeration", "false")
-                list_instance.set("MinorVersionLimit", "10")
-                list_instance.set("MaxVersionLimit", "50")
-                list_instance.set("DraftVersionVisibility", "1")  # Author
-                list_instance.set("EnableAttachments", "false")
-                list_instance.set("EnableFolderCreation", "true")
-            elif list_def["template_type"] == 106:  # Events/Calendar
-                list_instance.set("EnableAttachments", "false")
-                list_instance.set("EnableFolderCreation", "false")
-            elif list_def["template_type"] == 100:  # Custom List
-                list_instance.set("EnableAttachments", "true")
-                list_instance.set("EnableFolderCreation", "false")
-            elif list_def["template_type"] == 105:  # Contacts
-                list_instance.set("EnableAttachments", "true")
-                list_instance.set("EnableFolderCreation", "false")
-            elif list_def["template_type"] == 109:  # Picture Library
-                list_instance.set("EnableFolderCreation", "true")
-                list_instance.set("EnableAttachments", "false")
-            
-            # Common attributes for all lists
-            list_instance.set("ContentTypesEnabled", "false")  # Set to false to use list fields directly
-            list_instance.set("OnQuickLaunch", "true")
-            list_instance.set("Hidden", "false")
-            list_instance.set("NoCrawl", "false")
-            list_instance.set("RemoveExistingContentTypes", "false")
-            
-            # Add list-specific fields using Microsoft pattern (inside the list, not as site fields)
-            # If list has no fields specified or empty array, only add relevant fields based on context
-            fields_to_add = list_def.get("fields", [])
-            if not fields_to_add and structure.get("site_fields"):
-                # Intelligently assign fields based on list type and field relevance
-                fields_to_add = get_relevant_fields_for_list(list_def, structure.get("site_fields", []))
-            
-            # Also add fields referenced in custom views for this list
-            if list_def.get("views"):
-                for view in list_def["views"]:
-                    for field_name in view.get("fields", []):
-                        # Try to map field names correctly
-                        validated_field = validate_field_reference(field_name, list_def, structure.get("site_fields", []))
-                        if validated_field and validated_field not in fields_to_add:
-                            # Check if this is a custom field that should be added
-                            for site_field in structure.get("site_fields", []):
-                                if site_field["name"] == validated_field:
-                                    fields_to_add.append(validated_field)
-                                    break
-            
-            if fields_to_add:
-                fields_elem = ET.SubElement(list_instance, "pnp:Fields")
-                for field_name in fields_to_add:
-                    # Find the field definition in site_fields
-                    field_def = next((f for f in structure.get("site_fields", []) if f["name"] == field_name), None)
-                    if field_def:
-                        # Create Field element (no namespace - Microsoft pattern)
-                        field_elem = ET.SubElement(fields_elem, "Field")
-                        
-                        # Use Microsoft field pattern attributes
-                        field_elem.set("Type", field_def["type"])
-                        field_elem.set("DisplayName", field_def["displayName"])
-                        field_elem.set("Required", "TRUE" if field_def.get("required", False) else "FALSE")
-                        field_elem.set("EnforceUniqueValues", "FALSE")
-                        field_elem.set("Indexed", "FALSE")
-                        
-                        # Ensure field ID has braces format
-                        field_id = field_def["id"]
-                        if not field_id.startswith("{"):
-                            field_id = "{" + field_id + "}"
-                        field_elem.set("ID", field_id)
-                        field_elem.set("StaticName", field_def["name"])
-                        field_elem.set("Name", field_def["name"])
-                        
-                        # Add type-specific attributes following Microsoft pattern
-                        if field_def["type"] == "Text":
-                            max_length = field_def.get("maxLength", 50)
-                            field_elem.set("MaxLength", str(max_length))
-                            if field_def.get("default"):
-                                default_elem = ET.SubElement(field_elem, "Default")
-                                default_elem.text = field_def["default"]
-                                
-                        elif field_def["type"] == "Choice" and field_def.get("choices"):
-                            field_elem.set("Format", "Dropdown")
-                            field_elem.set("FillInChoice", "FALSE")
-                            
-                            # Add default value first (Microsoft pattern)
-                            default_value = field_def.get("default", field_def["choices"][0] if field_def["choices"] else "Option1")
-                            default_elem = ET.SubElement(field_elem, "Default")
-                            default_elem.text = default_value
-                            
-                            # Create CHOICES element (no namespace)
-                            choices_elem = ET.SubElement(field_elem, "CHOICES")
-                            for choice in field_def["choices"]:
-                                choice_elem = ET.SubElement(choices_elem, "CHOICE")
-                                choice_elem.text = choice
-            
-            # Add Views following Microsoft pattern
-            views_elem = ET.SubElement(list_instance, "pnp:Views")
-            views_elem.set("RemoveExistingViews", "false")
-            
-            # Use views from JSON if provided, otherwise generate intelligent views
-            if list_def.get("views"):
-                # Create field name mapping to handle "Custom" prefixed fields
-                builtin_fields = {
-                    'location', 'title', 'description', 'author', 'editor', 'created', 'modified',
-                    'id', 'version', 'name', 'url', 'path', 'type', 'size', 'status', 'category',
-                    'comments', 'tags', 'keywords', 'subject', 'company', 'manager', 'department',
-                    'priority', 'assignedto', 'duedate', 'startdate', 'percentcomplete', 'outcome',
-                    'contenttype', 'attachments', 'linkfilename', 'docicon', 'edit', 'folder',
-                    'order', 'guid', 'fileleafref', 'fileref', 'filepath', 'filesizebytes',
-                    'checkedoutto', 'owner', 'workflow', 'importance', 'sensitivity'
-                }
-                
-                def map_field_name(field_name):
-                    """Map JSON field names to actual generated field names"""
-                    # Don't map standard SharePoint fields like Title, Modified, Created, etc.
-                    standard_fields = {'title', 'modified', 'created', 'author', 'editor', 'id', 'linktitle', 'docicon', 'linkfilename'}
-                    if field_name.lower() in standard_fields:
-                        return field_name
-                    if field_name.lower() in builtin_fields:
-                        return f"Custom{field_name}"
-                    return field_name
-                
-                # Use views specified in the JSON structure
-                views_to_create = []
-                for view_json in list_def["views"]:
-                    # Map field names in view fields
-                    mapped_fields = [map_field_name(f) for f in view_json.get("fields", ["LinkTitle", "Modified"])]
-                    
-                    # Map field names in CAML query
-                    query = view_json.get("query", "")
-                    for site_field in structure.get("site_fields", []):
-                        original_name = site_field["name"]
-                        if original_name.startswith("Custom"):
-                            # Find the original name without Custom prefix
-                            base_name = original_name[6:]  # Remove "Custom" prefix
-                            if base_name.lower() in builtin_fields:
-                                query = query.replace(f"Name='{base_name}'", f"Name='{original_name}'")
-                                query = query.replace(f"Name=\"{base_name}\"", f"Name=\"{original_name}\"")
-                    
-                    view_dict = {
-                        "name": view_json.get("name", "View"),
-                        "display_name": view_json.get("display_name", view_json.get("name", "View")),
-                        "url": f"{view_json.get('name', 'View').replace(' ', '')}.aspx",
-                        "default": "TRUE" if view_json.get("default", False) else "FALSE",
-                        "fields": mapped_fields,
-                        "query": query,
-                        "row_limit": view_json.get("row_limit", 30),
-                        "type": view_json.get("type", "HTML"),
-                        "paged": view_json.get("paged", True)
-                    }
-                    views_to_create.append(view_dict)
+        lists = X.SubElement(template, pnp("Lists"))
+        for index, list_def in enumerate(structure["lists"]):
+            prebuilt = prebuilt_lists[index] if prebuilt_lists and index < len(prebuilt_lists) else None
+            if prebuilt:
+                list_instance, list_errors = prebuilt
             else:
-                # Generate appropriate views based on list type and fields
-                views_to_create = generate_list_views(list_def, structure.get("site_fields", []))
+                list_instance = build_list_instance(list_def, structure.get("site_fields", []), namespace, schema_index,
+                                                    use_lxml)
+                list_errors = None
+            lists.append(list_instance)
             
-            for view_def in views_to_create:
-                view_elem = ET.SubElement(views_elem, "View")
-                view_elem.set("Name", view_def["name"])
-                view_elem.set("DefaultView", view_def.get("default", "FALSE"))
-                view_elem.set("MobileView", "FALSE")
-                view_elem.set("MobileDefaultView", "FALSE")
-                view_elem.set("Type", view_def.get("type", "HTML"))
-                view_elem.set("DisplayName", view_def["display_name"])
-                view_elem.set("Url", view_def.get("url", f"{view_def['name'].replace(' ', '')}.aspx"))
-                view_elem.set("Level", "1")
-                view_elem.set("BaseViewID", "1")
-                view_elem.set("ContentTypeID", "0x")
-                if list_def["template_type"] == 101:  # Document Library
-                    view_elem.set("ImageUrl", "/_layouts/15/images/dlicon.png")
-                
-                # Add Query if filter/sort is specified
-                if view_def.get("query"):
-                    query_elem = ET.SubElement(view_elem, "Query")
-                    # Parse the CAML query XML and append as child elements
-                    try:
-                        # Wrap the query in a temporary root element for parsing
-                        temp_query = f"<TempRoot>{view_def['query']}</TempRoot>"
-                        temp_root = ET.fromstring(temp_query)
-                        # Add all child elements of the temp root to the actual Query element
-                        for child in temp_root:
-                            query_elem.append(child)
-                    except ET.ParseError:
-                        # Fallback: if parsing fails, treat as text (should not happen with proper CAML)
-                        query_elem.text = view_def["query"]
-                
-                # Add ViewFields with validation
-                viewfields_elem = ET.SubElement(view_elem, "ViewFields")
-                for field_name in view_def["fields"]:
-                    # Validate field references for calendar lists
-                    validated_field_name = validate_field_reference(field_name, list_def, structure.get("site_fields", []))
-                    if validated_field_name:  # Only add valid field references
-                        fieldref_elem = ET.SubElement(viewfields_elem, "FieldRef")
-                        fieldref_elem.set("Name", validated_field_name)
-                
-                # Add RowLimit
-                rowlimit_elem = ET.SubElement(view_elem, "RowLimit")
-                paged_setting = "TRUE" if view_def.get("paged", True) else "FALSE"
-                rowlimit_elem.set("Paged", paged_setting)
-                rowlimit_elem.text = str(view_def.get("row_limit", 30))
-                
-                # Add standard elements
-                jslink_elem = ET.SubElement(view_elem, "JSLink")
-                jslink_elem.text = "clienttemplates.js"
-                
-                xsllink_elem = ET.SubElement(view_elem, "XslLink")
-                xsllink_elem.set("Default", "TRUE")
-                xsllink_elem.text = "main.xsl"
-                
-                toolbar_elem = ET.SubElement(view_elem, "Toolbar")
-                toolbar_elem.set("Type", "Standard")
+            # Check the finished list on its own so errors point at the list and view
+            if validate_lists_xsd and use_lxml:
+                if list_errors is None:
+                    list_errors = validate_list_instance(list_instance, validate_lists_xsd)
+                if list_errors:
+                    if fail_fast:
+                        raise ListValidationError(list_def["title"], list_errors)
+                    for error in list_errors:
+                        print(f"⚠️  {error}")
     
     # Add Navigation (following official template pattern)
     if structure.get("navigation"):
-        navigation = ET.SubElement(template, "pnp:Navigation")
-        navigation.set("AddNewPagesToNavigation", "true")
-        navigation.set("CreateFriendlyUrlsForNewPages", "true")
+        navigation = X.SubElement(template, pnp("Navigation"))
+        set_attr(navigation, "AddNewPagesToNavigation", "true")
+        set_attr(navigation, "CreateFriendlyUrlsForNewPages", "true")
         
         # Global Navigation
-        global_nav = ET.SubElement(navigation, "pnp:GlobalNavigation")
-        global_nav.set("NavigationType", "Structural")
-        global_struct_nav = ET.SubElement(global_nav, "pnp:StructuralNavigation")
-        global_struct_nav.set("RemoveExistingNodes", "true")
+        global_nav = X.SubElement(navigation, pnp("GlobalNavigation"))
+        set_attr(global_nav, "NavigationType", "Structural")
+        global_struct_nav = X.SubElement(global_nav, pnp("StructuralNavigation"))
+        set_attr(global_struct_nav, "RemoveExistingNodes", "true")
         
         # Current Navigation
-        current_nav = ET.SubElement(navigation, "pnp:CurrentNavigation")
-        current_nav.set("NavigationType", "StructuralLocal")
-        current_struct_nav = ET.SubElement(current_nav, "pnp:StructuralNavigation")
-        current_struct_nav.set("RemoveExistingNodes", "true")
+        current_nav = X.SubElement(navigation, pnp("CurrentNavigation"))
+        set_attr(current_nav, "NavigationType", "StructuralLocal")
+        current_struct_nav = X.SubElement(current_nav, pnp("StructuralNavigation"))
+        set_attr(current_struct_nav, "RemoveExistingNodes", "true")
         
         # Add navigation nodes
         for nav_item in structure["navigation"]:
-            nav_node = ET.SubElement(current_struct_nav, "pnp:NavigationNode")
-            nav_node.set("Title", nav_item["title"])
+            nav_node = X.SubElement(current_struct_nav, pnp("NavigationNode"))
+            set_attr(nav_node, "Title", nav_item["title"])
             
             # Sanitize URL - replace problematic values and escape XML characters
             url = nav_item["url"]
@@ -1336,40 +3632,227 @@ def structure_to_pnp_xml(structure: Dict[str, Any]) -> str:
             
             # Escape XML special characters in URL
             url = url.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&apos;")
-            nav_node.set("Url", url)
+            set_attr(nav_node, "Url", url)
     
     # Add sequence section if theme is specified (shows how to apply theme during deployment)
     if theme_config:
-        sequence = ET.SubElement(root, "pnp:Sequence")
-        sequence.set("ID", "SITE-SEQUENCE")
+        sequence = X.SubElement(root, pnp("Sequence"))
+        set_attr(sequence, "ID", "SITE-SEQUENCE")
         
-        site_collections = ET.SubElement(sequence, "pnp:SiteCollections")
+        site_collections = X.SubElement(sequence, pnp("SiteCollections"))
         
         # Example site collection with theme applied
-        site_collection = ET.SubElement(site_collections, "pnp:SiteCollection")
-        site_collection.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
+        if use_lxml:
+            site_collection = X.SubElement(site_collections, pnp("SiteCollection"), nsmap={"xsi": XSI_NAMESPACE})
+        else:
+            site_collection = X.SubElement(site_collections, pnp("SiteCollection"))
         
         # Set the appropriate site collection type based on site_type
         if site_type.lower() == "communication":
-            site_collection.set("xsi:type", "pnp:CommunicationSite")
-            site_collection.set("Url", "https://[tenant].sharepoint.com/sites/[sitename]")
-            site_collection.set("Owner", "[owner@tenant.onmicrosoft.com]")
+            set_attr(site_collection, f"{{{XSI_NAMESPACE}}}type", "pnp:CommunicationSite")
+            set_attr(site_collection, "Url", "https://[tenant].sharepoint.com/sites/[sitename]")
+            set_attr(site_collection, "Owner", "[owner@tenant.onmicrosoft.com]")
         else:
-            site_collection.set("xsi:type", "pnp:TeamSite")
-            site_collection.set("Alias", "[sitealias]")
-            site_collection.set("DisplayName", structure.get("site_title", "SharePoint Site"))
-            site_collection.set("IsPublic", "false")
+            set_attr(site_collection, f"{{{XSI_NAMESPACE}}}type", "pnp:TeamSite")
+            set_attr(site_collection, "Alias", "[sitealias]")
+            set_attr(site_collection, "DisplayName", structure.get("site_title", "SharePoint Site"))
+            set_attr(site_collection, "IsPublic", "false")
         
-        site_collection.set("ProvisioningId", "MAIN-SITE")
-        site_collection.set("Title", structure.get("site_title", "SharePoint Site"))
-        site_collection.set("Description", structure.get("description", ""))
-        site_collection.set("Theme", theme_config.get("name", "CustomTheme"))
-        site_collection.set("Language", "1033")
+        set_attr(site_collection, "ProvisioningId", "MAIN-SITE")
+        set_attr(site_collection, "Title", structure.get("site_title", "SharePoint Site"))
+        set_attr(site_collection, "Description", structure.get("description", ""))
+        set_attr(site_collection, "Theme", theme_config.get("name", "CustomTheme"))
+        set_attr(site_collection, "Language", "1033")
         
         # Reference the template
-        templates_ref = ET.SubElement(site_collection, "pnp:Templates")
-        template_ref = ET.SubElement(templates_ref, "pnp:ProvisioningTemplateReference")
-        template_ref.set("ID", "SITE-TEMPLATE")
+        templates_ref = X.SubElement(site_collection, pnp("Templates"))
+        template_ref = X.SubElement(templates_ref, pnp("ProvisioningTemplateReference"))
+        set_attr(template_ref, "ID", "SITE-TEMPLATE")
+    
+    return root
+
+class StreamingStructureParser:
+    """
+    Incremental parser for a streamed structure response. feed() takes text chunks as they
+    arrive and returns (key, item) for every element of the tracked top-level arrays that
+    is complete, as soon as its closing brace is seen. Markdown fences before the JSON and
+    // or /* */ comments are tolerated, as in clean_llm_response.
+    """
+    
+    def __init__(self, keys=("site_fields", "lists")):
+        self.keys = set(keys)
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None  # last string literal seen directly in the top-level object
+        self.current_key = None
+        self.array_key = None    # tracked array currently open
+        self.item_start = None
+        self.closed = set()      # tracked arrays that are complete
+    
+    def feed(self, text: str) -> List[tuple]:
+        self.buffer += text
+        buf = self.buffer
+        items = []
+        while self.pos < len(buf) and not self.finished:
+            ch = buf[self.pos]
+            if not self.started:
+                # Skip markdown fences or prose before the JSON object
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                self.pos += 1
+                continue
+            
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = buf[self.string_start:self.pos + 1]
+                self.pos += 1
+                continue
+            
+            if ch == "/":
+                # Comments: wait for the rest of the chunk stream if the end is not here yet
+                if self.pos + 1 >= len(buf):
+                    break
+                if buf[self.pos + 1] == "/":
+                    end = buf.find("\n", self.pos)
+                    if end == -1:
+                        break
+                    self.pos = end
+                    continue
+                if buf[self.pos + 1] == "*":
+                    end = buf.find("*/", self.pos + 2)
+                    if end == -1:
+                        break
+                    self.pos = end + 2
+                    continue
+            
+            if ch == '"':
+                self.in_string = True
+                self.string_start = self.pos
+            elif ch == ":" and self.depth == 1 and self.last_string:
+                self.current_key = json.loads(self.last_string)
+            elif ch in "{[":
+                if self.depth == 1 and ch == "[" and self.current_key in self.keys:
+                    self.array_key = self.current_key
+                elif self.depth == 2 and self.array_key and self.item_start is None:
+                    self.item_start = self.pos
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 2 and self.item_start is not None:
+                    try:
+                        items.append((self.array_key, json.loads(clean_json_comments(buf[self.item_start:self.pos + 1]))))
+                    except json.JSONDecodeError:
+                        pass  # The full response is parsed again at the end
+                    self.item_start = None
+                elif self.depth == 1 and self.array_key:
+                    self.closed.add(self.array_key)
+                    self.array_key = None
+                elif self.depth == 0:
+                    self.finished = True
+            self.pos += 1
+        return items
+
+class StreamingListBuilder:
+    """
+    Builds (and validates) pnp:ListInstance elements from a streamed structure response while
+    the model is still generating. Lists are built once 'site_fields' is complete, which the
+    prompt asks for before 'lists'. prebuilt_lists() only reuses an element when its list
+    definition and the consolidated site fields match the final structure, so the template
+    is the same as a non-streamed build.
+    """
+    
+    def __init__(self, namespace: str = PNP_NAMESPACE, schema_index: Dict[str, Any] = None,
+                 validate_lists_xsd: str = None):
+        self.namespace = namespace
+        self.schema_index = schema_index
+        self.validate_lists_xsd = validate_lists_xsd
+        self.reset()
+    
+    def reset(self) -> None:
+        """Forget a partial response, e.g. before retrying with the next model"""
+        self.parser = StreamingStructureParser()
+        self.site_fields = []
+        self.lists = []
+        self.built = {}  # list index -> (input key, element, errors)
+        self.started = time.perf_counter()
+        self.first_list_seconds = None
+    
+    def feed(self, text: str) -> None:
+        for key, item in self.parser.feed(text):
+            (self.site_fields if key == "site_fields" else self.lists).append(item)
+        if "site_fields" in self.parser.closed or self.parser.finished:
+            for index in range(len(self.built), len(self.lists)):
+                self._build(index)
+    
+    @staticmethod
+    def _input_key(list_def: Dict[str, Any], site_fields: List[Dict[str, Any]]) -> str:
+        return json.dumps([list_def, site_fields], sort_keys=True)
+    
+    def _build(self, index: int) -> None:
+        partial = json.loads(json.dumps({"site_fields": self.site_fields, "lists": self.lists[:index + 1]}))
+        try:
+            add_field_ids(partial)
+            list_def = partial["lists"][index]
+            key = self._input_key(list_def, partial["site_fields"])
+            list_instance = build_list_instance(list_def, partial["site_fields"], self.namespace, self.schema_index)
+        except Exception:
+            # Leave it to the regular build, which reports errors properly
+            self.built[index] = (None, None, None)
+            return
+        
+        errors = None
+        if self.validate_lists_xsd and LXML_AVAILABLE:
+            errors = validate_list_instance(list_instance, self.validate_lists_xsd)
+        self.built[index] = (key, list_instance, errors)
+        
+        elapsed = time.perf_counter() - self.started
+        if self.first_list_seconds is None:
+            self.first_list_seconds = elapsed
+        status = "built" if errors is None else ("validated" if not errors else f"built with {len(errors)} error(s)")
+        print(f"🧱 List '{list_def.get('title', index + 1)}' {status} while streaming (+{elapsed:.2f}s)")
+    
+    def prebuilt_lists(self, structure: Dict[str, Any]) -> List:
+        """
+        Match lists built during streaming against the final structure (after add_field_ids).
+        Returns a list aligned with structure['lists'] of (element, errors) pairs or None.
+        """
+        site_fields = structure.get("site_fields", [])
+        prebuilt = []
+        for index, list_def in enumerate(structure.get("lists", [])):
+            key, list_instance, errors = self.built.get(index, (None, None, None))
+            if key is not None and key == self._input_key(list_def, site_fields):
+                prebuilt.append((list_instance, errors))
+            else:
+                prebuilt.append(None)
+        
+        reused = sum(1 for entry in prebuilt if entry)
+        if self.built:
+            total = time.perf_counter() - self.started
+            print(f"⚡ {reused}/{len(prebuilt)} list(s) built during streaming"
+                  + (f"; first list ready at +{self.first_list_seconds:.2f}s of {total:.2f}s"
+                     if self.first_list_seconds is not None else ""))
+        return prebuilt
+
+def pnp_tree_to_xml(root) -> str:
+    """
+    Serialize a tree from build_pnp_tree to a pretty-printed XML string with declaration.
+    """
+    if LXML_AVAILABLE and isinstance(root, etree._Element):
+        xml_body = etree.tostring(root, encoding='unicode', pretty_print=True)
+        return '<?xml version="1.0" encoding="utf-8"?>\n' + xml_body.rstrip('\n')
     
     # Convert to string with proper formatting
     rough_string = ET.tostring(root, encoding='unicode')
@@ -1392,52 +3875,40 @@ def structure_to_pnp_xml(structure: Dict[str, Any]) -> str:
     
     return xml_str
 
-def validate_xml(xml_content: str) -> bool:
+def structure_to_pnp_xml(structure: Dict[str, Any], namespace: str = PNP_NAMESPACE) -> str:
+    """
+    Convert structure dictionary to PnP Provisioning XML with proper namespace handling.
+    Based on official SharePoint PnP template patterns.
+    """
+    return pnp_tree_to_xml(build_pnp_tree(structure, namespace=namespace))
+
+def validate_xml(xml_content: str, tier: str = "xsd", xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> bool:
     """
-    Validate XML against PnP schema if available.
+    Validate XML with validate_template and print the outcome.
     Returns True if valid or no schema available.
     """
-    xsd_path = Path("pnp-provisioning.xsd")
-    if not xsd_path.exists():
-        print("Warning: PnP Provisioning XSD not found. Skipping validation.")
+    if tier != "wellformed" and not Path(xsd_path).exists():
+        print(f"Warning: PnP Provisioning XSD not found ({xsd_path}). Skipping validation.")
         return True
     
-    try:
-        from lxml import etree
-        
-        # Parse XSD
-        with open(xsd_path, 'r', encoding='utf-8') as xsd_file:
-            schema_doc = etree.parse(xsd_file)
-            schema = etree.XMLSchema(schema_doc)
-        
-        # Parse XML
-        xml_doc = etree.fromstring(xml_content.encode('utf-8'))
-        
-        # Validate
-        if schema.validate(xml_doc):
-            print("✓ XML validation passed")
-            return True
-        else:
-            print("✗ XML validation failed:")
-            for error in schema.error_log:
-                print(f"  Line {error.line}: {error.message}")
-            return False
-            
-    except ImportError:
-        print("Warning: lxml not available. Skipping XML validation.")
-        return True
-    except Exception as e:
-        print(f"Warning: XML validation failed: {e}")
+    is_valid, errors = validate_template(xml_content, tier, xsd_path)
+    if is_valid:
+        print("✓ XML validation passed")
         return True
+    
+    print("✗ XML validation failed:")
+    for error in errors:
+        print(f"  {error}")
+    return False
 
-def save_xml(xml_content: str) -> Path:
+def save_xml(xml_content: str, timestamp: str = None) -> Path:
     """
     Save XML to generated-templates directory with timestamp.
     """
     output_dir = Path("generated-templates")
     output_dir.mkdir(exist_ok=True)
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"enhanced_mock_{timestamp}.xml"
     filepath = output_dir / filename
     
@@ -1446,10 +3917,363 @@ def save_xml(xml_content: str) -> Path:
     
     return filepath
 
+def handle_validation_request(line: str, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> Dict[str, Any]:
+    """
+    Validate one newline-delimited JSON request of the form {"id": ..., "xml": "..."}, optionally
+    with "tier" (see VALIDATION_TIERS) and "max_errors" (a positive integer). Every request is
+    validated against the server's own xsd_path.
+    Returns {"id": ..., "is_valid": bool, "errors": [...]} using validate_xml_against_xsd's error format.
+    """
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"id": None, "is_valid": False, "errors": [f"Invalid request JSON: {e}"]}
+    
+    if not isinstance(request, dict) or not isinstance(request.get("xml"), str):
+        request_id = request.get("id") if isinstance(request, dict) else None
+        return {"id": request_id, "is_valid": False, "errors": ["Request must be a JSON object with an 'xml' string"]}
+    
+    tier = request.get("tier", "xsd")
+    if tier not in VALIDATION_TIERS:
+        return {"id": request.get("id"), "is_valid": False,
+                "errors": [f"Unknown tier '{tier}', expected one of {', '.join(VALIDATION_TIERS)}"]}
+    
+    max_errors = request.get("max_errors")
+    if max_errors is not None and (not isinstance(max_errors, int) or isinstance(max_errors, bool) or max_errors < 1):
+        return {"id": request.get("id"), "is_valid": False,
+                "errors": [f"'max_errors' must be a positive integer, got {max_errors!r}"]}
+    
+    is_valid, errors = validate_template(request["xml"], tier, xsd_path, max_errors)
+    return {"id": request.get("id"), "is_valid": is_valid, "errors": errors}
+
+def serve_validate_stream(infile, outfile, xsd_path: str = "ProvisioningSchema-2022-09.xsd",
+                          lock: threading.Lock = None) -> int:
+    """
+    Answer validation requests read line by line from infile, writing one JSON response per line.
+    With a lock, each validation runs while holding it. Returns the number of requests handled.
+    """
+    handled = 0
+    for line in infile:
+        if not line.strip():
+            continue
+        if lock is not None:
+            with lock:
+                response = handle_validation_request(line, xsd_path)
+        else:
+            response = handle_validation_request(line, xsd_path)
+        outfile.write(json.dumps(response, ensure_ascii=False) + "\n")
+        outfile.flush()
+        handled += 1
+    return handled
+
+def serve_validate_socket(socket_path: str, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> int:
+    """
+    Serve validation requests on a Unix domain socket until interrupted.
+    Each connection may send any number of newline-delimited JSON requests.
+    A stale socket at socket_path is replaced; any other file there is left alone and 1 is returned.
+    """
+    import socketserver
+    import stat
+    
+    # Connections are served on their own threads; requests are validated one at a time so the
+    # shared compiled schema is never used concurrently, and an idle open connection blocks no one
+    validation_lock = threading.Lock()
+    
+    class ValidationHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            reader = io.TextIOWrapper(self.rfile, encoding='utf-8')
+            writer = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+            serve_validate_stream(reader, writer, xsd_path, validation_lock)
+            writer.detach()
+            reader.detach()
+    
+    if os.path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            print(f"❌ {socket_path} exists and is not a socket; not replacing it", file=sys.stderr)
+            return 1
+        os.unlink(socket_path)
+    
+    class ValidationServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+    
+    with ValidationServer(socket_path, ValidationHandler) as server:
+        print(f"🔌 Validation server listening on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+    return 0
+
+def serve_validate(socket_path: str = None, xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> int:
+    """
+    Run the long-lived validation service with a warm schema.
+    Reads requests from stdin unless a Unix socket path is given.
+    """
+    if not LXML_AVAILABLE:
+        print("❌ lxml package not available for XSD validation", file=sys.stderr)
+        return 1
+    
+    # Compile the schema up front so the first request is as fast as the rest
+    try:
+        get_xsd_schema(xsd_path)
+    except Exception as e:
+        print(f"❌ Could not load XSD schema {xsd_path}: {e}", file=sys.stderr)
+        return 1
+    print(f"✅ Schema compiled: {xsd_path}", file=sys.stderr)
+    
+    if socket_path:
+        return serve_validate_socket(socket_path, xsd_path)
+    else:
+        serve_validate_stream(sys.stdin, sys.stdout, xsd_path)
+    return 0
+
+def run_build_pruned_xsd(xsd_path: str, output_path: str) -> int:
+    """Build the pruned schema; script/benchmarks.py pruned-xsd checks it against the full one"""
+    if not LXML_AVAILABLE:
+        print("❌ lxml package not available; cannot build pruned XSD")
+        return 1
+    
+    stats = build_pruned_xsd(xsd_path, output_path)
+    print(f"✂️  Pruned schema written: {output_path}")
+    print(f"   Size: {stats['full_bytes']:,} -> {stats['pruned_bytes']:,} bytes")
+    print(f"   Types: {stats['full_types']} -> {stats['pruned_types']}")
+    print(f"💡 Check its verdicts: python script/benchmarks.py pruned-xsd {output_path}")
+    return 0
+
+def read_batch_descriptions(path: str) -> List[str]:
+    """
+    Read site descriptions for a batch run: a CSV file with a 'description' column
+    (or the first column otherwise), or a text file with one description per line.
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if not path.lower().endswith(".csv"):
+            return [line.strip() for line in f if line.strip()]
+        
+        rows = list(csv.reader(f))
+    
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    if "description" in header:
+        column = header.index("description")
+        rows = rows[1:]
+    else:
+        column = 0
+    return [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+
+def save_batch_result(structure: Dict[str, Any], json_content: str, name: str, args: argparse.Namespace,
+                      llm_attempts: list = None) -> tuple:
+    """Build, validate and save one batch template. Returns (xml path, is_valid, errors)."""
+    schema_entry = get_schema_entry(args.schema_version)
+    xml_tree = build_pnp_tree(structure, namespace=schema_entry["namespace"])
+    xml_content = pnp_tree_to_xml(xml_tree)
+    lxml_tree = xml_tree if LXML_AVAILABLE else None
+    
+    if args.validation_tier != "xsd" or args.no_validation_cache:
+        is_valid, errors = validate_template(lxml_tree if lxml_tree is not None else xml_content,
+                                             args.validation_tier, args.xsd, args.max_errors)
+        cached = False
+    else:
+        is_valid, errors, cached = validate_xml_with_cache(xml_content, args.xsd, xml_tree=lxml_tree)
+    
+    filepath = save_xml(xml_content, name)
+    save_comprehensive_report(json_content, filepath.name, is_valid, errors, name, cached,
+                              args.validation_tier, args.xsd, llm_attempts)
+    return filepath, is_valid, errors
+
+async def generate_batch(descriptions: List[str], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Generate templates for many descriptions concurrently. At most args.concurrency LLM
+    requests are in flight, and each template is built, validated and saved as soon as its
+    structure arrives. Returns one summary dict per description, in completion order.
+    """
+    client = None
+    if llm_replay_only() or (OPENAI_AVAILABLE and os.getenv('OPENAI_API_KEY')):
+        client = create_llm_client(os.getenv('OPENAI_API_KEY'), is_async=True, max_connections=args.concurrency)
+    else:
+        print("⚠️  OpenAI not available, using basic parsing for the whole batch...")
+    
+    semaphore = asyncio.Semaphore(args.concurrency)
+    batch_stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    async def generate(index: int, description: str):
+        attempts = []
+        result = await async_llm_generate_structure(client, description, semaphore,
+                                                    use_cache=not args.no_cache,
+                                                    refresh_cache=args.refresh_cache,
+                                                    structured_output=args.structured_output,
+                                                    attempts=attempts,
+                                                    similarity_threshold=args.similarity_threshold)
+        append_llm_ledger(attempts, description, args.ledger)
+        return index, description, result, attempts
+    
+    tasks = [asyncio.ensure_future(generate(i, d)) for i, d in enumerate(descriptions, 1)]
+    results = []
+    try:
+        for completed in asyncio.as_completed(tasks):
+            index, description, (structure, json_content, source), attempts = await completed
+            name = f"{batch_stamp}_{index:04d}"
+            try:
+                filepath, is_valid, errors = save_batch_result(structure, json_content, name, args, attempts)
+            except Exception as e:
+                print(f"❌ [{len(results) + 1}/{len(descriptions)}] #{index} failed: {e}")
+                results.append({"index": index, "description": description, "source": source, "error": str(e)})
+                continue
+            status = "✅" if is_valid else "⚠️ "
+            print(f"{status} [{len(results) + 1}/{len(descriptions)}] #{index} {structure.get('site_title', '')} "
+                  f"({source}) -> {filepath}")
+            results.append({"index": index, "description": description, "source": source,
+                            "xml": str(filepath), "is_valid": is_valid, "errors": len(errors)})
+    finally:
+        if client is not None:
+            await client.close()
+    
+    return results
+
+def run_batch(path: str, args: argparse.Namespace) -> int:
+    """Run a concurrent batch from a CSV/text file of descriptions and print a summary"""
+    if DOTENV_AVAILABLE:
+        load_dotenv()
+    
+    descriptions = read_batch_descriptions(path)
+    if not descriptions:
+        print(f"No descriptions found in {path}")
+        return 1
+    
+    print(f"📦 Batch: {len(descriptions)} description(s), up to {args.concurrency} request(s) in flight")
+    start = time.perf_counter()
+    results = asyncio.run(generate_batch(descriptions, args))
+    elapsed = time.perf_counter() - start
+    
+    valid = sum(1 for r in results if r.get("is_valid"))
+    failed = sum(1 for r in results if "error" in r)
+    print(f"\n📊 Batch finished in {elapsed:.1f}s: {valid} valid, "
+          f"{len(results) - valid - failed} invalid, {failed} failed")
+    xsd_stats = get_xsd_cache_stats()
+    print(f"🗂️  XSD schema cache: {xsd_stats['hits']} hit(s), {xsd_stats['misses']} miss(es), "
+          f"{xsd_stats['compiled']} compiled")
+    return 0 if failed == 0 else 1
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Generate SharePoint PnP Provisioning XML templates from a natural language description."
+    )
+    parser.add_argument("description", nargs="*",
+                        help="Site description (prompted for interactively when omitted)")
+    parser.add_argument("--serve-validate", action="store_true",
+                        help="Keep the XSD compiled and validate newline-delimited JSON requests "
+                             '({"id": ..., "xml": "..."}) from stdin or --socket')
+    parser.add_argument("--socket", metavar="PATH",
+                        help="Unix domain socket path for --serve-validate (default: stdin/stdout)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Generate a template per description in a CSV ('description' column) or text file")
+    parser.add_argument("--concurrency", type=int, default=4, metavar="N",
+                        help="Maximum LLM requests in flight during --batch (default: 4)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Never import the OpenAI SDK: use basic parsing, or --replay-llm cassettes")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the ChatGPT response and build lists while it is still generating")
+    parser.add_argument("--fan-out", action="store_true",
+                        help="Plan the site skeleton first, then design each list in a parallel request "
+                             "(for large sites that would not fit in one completion; uses --concurrency)")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Ask for a JSON Schema (or JSON mode) response format and parse it without cleanup")
+    parser.add_argument("--stats", action="store_true",
+                        help="Summarize LLM latency, tokens and cost from the usage ledger and exit")
+    parser.add_argument("--ledger", default=LLM_LEDGER_PATH, metavar="FILE",
+                        help=f"NDJSON ledger of LLM calls, appended per template and read by --stats (default: {LLM_LEDGER_PATH})")
+    parser.add_argument("--prompt-stats", action="store_true",
+                        help="Print the size of the structure prompt for the description and exit")
+    parser.add_argument("--rpm", type=int, default=None, metavar="N",
+                        help="Client-side limit on requests per minute (default: $OPENAI_RPM_LIMIT or no limit)")
+    parser.add_argument("--tpm", type=int, default=None, metavar="N",
+                        help="Client-side limit on tokens per minute (default: $OPENAI_TPM_LIMIT or no limit)")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record-llm", metavar="DIR",
+                          help="Call the API and record every LLM response into cassette files in DIR")
+    cassette.add_argument("--replay-llm", metavar="DIR",
+                          help="Answer LLM calls from cassette files in DIR without network access")
+    parser.add_argument("--replay-latency", action="store_true",
+                        help="With --replay-llm, wait as long as the recorded calls took")
+    parser.add_argument("--similarity-threshold", type=float, default=SIMILARITY_THRESHOLD, metavar="T",
+                        help="Reuse the cached structure of an earlier description at least this similar "
+                             "(TF-IDF cosine) that quotes or names the same sites and lists (default: 0, off; "
+                             "close matches are only suggested)")
+    parser.add_argument("--base-structure", metavar="FILE",
+                        help="Existing structure JSON (e.g. llm-outputs/<file>.json) to update with --delta")
+    parser.add_argument("--delta", metavar="CHANGE",
+                        help="With --base-structure, the change to apply; only a summary of the base and "
+                             "the change are sent to the model")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Do not read or write the LLM response cache ({LLM_CACHE_PATH})")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="Call the API even if a cached response exists, then update the cache")
+    parser.add_argument("--schema-version", choices=list(SCHEMA_REGISTRY), default=DEFAULT_SCHEMA_VERSION,
+                        help="PnP Provisioning Schema version to emit and validate against")
+    parser.add_argument("--xsd", metavar="PATH",
+                        help="Override the XSD used for validation (default: the --schema-version XSD)")
+    parser.add_argument("--build-pruned-xsd", metavar="OUTPUT",
+                        help="Write a reduced copy of --xsd covering only the elements this generator emits "
+                             "(check it with script/benchmarks.py pruned-xsd)")
+    parser.add_argument("--validation-tier", choices=VALIDATION_TIERS, default="xsd",
+                        help="wellformed: parse only; structural: fast attribute/child pre-check derived from "
+                             "the XSD; xsd: full schema validation (default)")
+    parser.add_argument("--max-errors", type=int, metavar="N",
+                        help="Report at most N validation errors (the structural tier also stops checking "
+                             "there; the xsd tier always validates the whole document)")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="Stop building at the first list that fails validation against its ListInstance type")
+    parser.add_argument("--no-validation-cache", action="store_true",
+                        help=f"Always run XSD validation instead of reusing verdicts from {VALIDATION_CACHE_PATH}")
+    args = parser.parse_args(argv)
+    if bool(args.base_structure) != bool(args.delta):
+        parser.error("--base-structure and --delta must be used together")
+    # The rate limits may come from .env, so load it before reading their defaults
+    if DOTENV_AVAILABLE:
+        load_dotenv()
+    if args.rpm is None:
+        args.rpm = env_rate_limit("OPENAI_RPM_LIMIT")
+    if args.tpm is None:
+        args.tpm = env_rate_limit("OPENAI_TPM_LIMIT")
+    return args
+
 def main():
     """
     Main CLI entry point.
     """
+    args = parse_args()
+    warn_missing_dependencies(args.offline)
+    if args.offline:
+        configure_offline()
+    schema_entry = get_schema_entry(args.schema_version)
+    args.xsd = args.xsd or schema_entry["xsd"]
+    
+    if args.serve_validate:
+        sys.exit(serve_validate(args.socket, args.xsd))
+    
+    configure_rate_limiter(args.rpm, args.tpm)
+    if args.record_llm or args.replay_llm:
+        configure_llm_cassette(args.record_llm or args.replay_llm, "record" if args.record_llm else "replay",
+                               args.replay_latency)
+        # Recording always calls the API; replaying exercises the recorded calls, not the response cache
+        args.refresh_cache = args.refresh_cache or bool(args.record_llm)
+        args.no_cache = args.no_cache or bool(args.replay_llm)
+    
+    if args.batch:
+        sys.exit(run_batch(args.batch, args))
+    
+    if args.prompt_stats:
+        sys.exit(run_prompt_stats(" ".join(args.description)))
+    
+    if args.stats:
+        sys.exit(run_stats(args.ledger))
+    
+    if args.build_pruned_xsd:
+        sys.exit(run_build_pruned_xsd(args.xsd, args.build_pruned_xsd))
+    
     print("SharePoint PnP Provisioning XML Generator")
     print("=" * 45)
     
@@ -1459,7 +4283,11 @@ def main():
     
     # Check for OpenAI API key
     api_key_available = OPENAI_AVAILABLE and os.getenv('OPENAI_API_KEY')
-    if api_key_available:
+    if llm_replay_only():
+        print(f"🤖 ChatGPT integration: ▶️  Replaying recorded responses from {args.replay_llm}")
+    elif args.offline:
+        print("🤖 ChatGPT integration: ⏸️  Offline (using basic parsing)")
+    elif api_key_available:
         print("🤖 ChatGPT integration: ✅ Available (using .env or environment)")
     else:
         print("🤖 ChatGPT integration: ❌ Not available (using basic parsing)")
@@ -1473,8 +4301,10 @@ def main():
                 print("   Create .env file with: OPENAI_API_KEY=your-api-key-here")
     
     # Get description from command line or interactively
-    if len(sys.argv) > 1:
-        description = " ".join(sys.argv[1:])
+    if args.delta:
+        description = args.delta
+    elif args.description:
+        description = " ".join(args.description)
     else:
         print("\nExamples:")
         print("  'Create a communication site for HR policies with document library'")
@@ -1488,10 +4318,45 @@ def main():
     
     print(f"\n📝 Processing: {description}")
     
+    # Attribute tables derived from the XSD catch bad attributes while the tree is built
+    schema_available = os.path.exists(args.xsd)
+    schema_index = None
+    if schema_available and (LXML_AVAILABLE or Path(SCHEMA_INDEX_CACHE_DIR).exists()):
+        schema_index = get_schema_index(args.xsd)
+    # Per-list fragment validation compiles a wrapper around the full XSD, so the cheaper tiers
+    # only pay for it when --fail-fast needs it
+    validate_lists_xsd = args.xsd if schema_available and (args.fail_fast or args.validation_tier == "xsd") else None
+    list_builder = StreamingListBuilder(schema_entry["namespace"], schema_index, validate_lists_xsd) if args.stream else None
+    
     # Generate structure using ChatGPT or fallback parser
     json_content = ""
+    llm_attempts = []
+    prompt_version = STRUCTURE_PROMPT_VERSION
     try:
-        result = llm_generate_structure(description)
+        if args.base_structure:
+            prompt_version = f"delta-{DELTA_PROMPT_VERSION}"
+            print(f"🧩 Updating {args.base_structure}")
+            try:
+                result = llm_generate_delta(load_base_structure(args.base_structure), description,
+                                            structured_output=args.structured_output, attempts=llm_attempts)
+            finally:
+                append_llm_ledger(llm_attempts, description, args.ledger, prompt_version)
+            # The merged structure (with field IDs) can be the base of the next delta
+            print(f"💾 Updated structure: {save_llm_output(result[1], datetime.now().strftime('%Y%m%d_%H%M%S'))}")
+        elif args.fan_out:
+            prompt_version = f"fan-out-{FAN_OUT_PROMPT_VERSION}"
+            result = llm_generate_fan_out(description, args.concurrency, structured_output=args.structured_output,
+                                          attempts=llm_attempts)
+            append_llm_ledger(llm_attempts, description, args.ledger, prompt_version)
+        else:
+            result = llm_generate_structure(description, use_cache=not args.no_cache, refresh_cache=args.refresh_cache,
+                                            list_builder=list_builder, structured_output=args.structured_output,
+                                            attempts=llm_attempts, similarity_threshold=args.similarity_threshold)
+            append_llm_ledger(llm_attempts, description, args.ledger)
+        if (isinstance(result, tuple) and not args.base_structure
+                and summarize_llm_attempts(llm_attempts)["source"] != "fallback"):
+            # Keep the model's structure with its field IDs so it can later be a --base-structure
+            print(f"💾 Structure saved: {save_llm_output(json.dumps(result[0], ensure_ascii=False), datetime.now().strftime('%Y%m%d_%H%M%S'))}")
         if isinstance(result, tuple):
             structure, json_content = result
         else:
@@ -1513,52 +4378,112 @@ def main():
         sys.exit(1)
     
     # Convert to XML
+    build_errors = []
     try:
         print("\n🔨 Converting to PnP XML...")
-        xml_content = structure_to_pnp_xml(structure)
+        prebuilt_lists = list_builder.prebuilt_lists(structure) if list_builder else None
+        try:
+            xml_tree = build_pnp_tree(structure, validate_lists_xsd=validate_lists_xsd,
+                                      fail_fast=args.fail_fast,
+                                      schema_index=schema_index, namespace=schema_entry["namespace"],
+                                      prebuilt_lists=prebuilt_lists)
+        except TemplateAttributeError as e:
+            print(f"❌ Invalid template attribute: {e}")
+            if args.fail_fast:
+                sys.exit(1)
+            # Still write the template and report, marked invalid, so there is an artifact to inspect
+            print("   Saving the template without attribute checks; it is reported as invalid")
+            build_errors.append(f"Invalid template attribute: {e}")
+            xml_tree = build_pnp_tree(structure, validate_lists_xsd=validate_lists_xsd,
+                                      namespace=schema_entry["namespace"])
+        # Serialized once for the file and the cache key; validation uses the tree itself
+        xml_content = pnp_tree_to_xml(xml_tree)
+    except ListValidationError as e:
+        print(f"❌ Stopped at first invalid list ({len(e.errors)} error(s)):")
+        for error in e.errors:
+            print(f"   - {error}")
+        sys.exit(1)
     except Exception as e:
         print(f"❌ Error converting to XML: {e}")
         sys.exit(1)
     
-    # XSD Validation using official PnP schema
+    # XSD Validation using official PnP schema, on a worker thread while the file is written
     print("🔍 Validating XML against official PnP Schema...")
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    is_valid, validation_errors = validate_xml_against_xsd(xml_content)
+    lxml_tree = xml_tree if LXML_AVAILABLE else None
     
+    def run_validation():
+        if args.validation_tier != "xsd" or args.no_validation_cache:
+            # Only full XSD verdicts are cached
+            is_valid, errors = validate_template(lxml_tree if lxml_tree is not None else xml_content,
+                                                 args.validation_tier, args.xsd, args.max_errors)
+            return is_valid, errors, False
+        is_valid, errors, cached = validate_xml_with_cache(xml_content, args.xsd, xml_tree=lxml_tree)
+        if args.max_errors is not None:
+            errors = errors[:args.max_errors]
+        return is_valid, errors, cached
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        validation_future = executor.submit(run_validation)
+        
+        # Save XML file and prepare the report while validation runs
+        try:
+            filepath = save_xml(xml_content)
+            print(f"💾 Saved: {filepath.absolute()}")
+            print(f"📏 File size: {filepath.stat().st_size:,} bytes")
+            report_parts = prepare_comprehensive_report(json_content, str(filepath.name), timestamp, args.xsd,
+                                                        llm_attempts, prompt_version)
+        except Exception as e:
+            print(f"❌ Error saving file: {e}")
+            sys.exit(1)
+        
+        is_valid, validation_errors, validation_cached = validation_future.result()
+    
+    if build_errors:
+        is_valid = False
+        validation_errors = build_errors + validation_errors
+    
+    if validation_cached:
+        print("⚡ Validation: cached (identical XML and schema validated before)")
     if is_valid:
-        print("✅ XML is valid according to PnP Provisioning Schema 2022-09!")
+        if args.validation_tier == "xsd":
+            print(f"✅ XML is valid according to PnP Provisioning Schema {args.schema_version}!")
+        elif args.validation_tier == "structural":
+            print("✅ XML passed the structural pre-check (not a full schema validation; use --validation-tier xsd)")
+        else:
+            print("✅ XML is well-formed (schema not checked; use --validation-tier xsd)")
     else:
         print(f"❌ XML validation failed with {len(validation_errors)} error(s):")
         for i, error in enumerate(validation_errors[:5], 1):  # Show first 5 errors
             print(f"   {i}. {error}")
         if len(validation_errors) > 5:
             print(f"   ... and {len(validation_errors) - 5} more errors")
-        print("\n⚠️  Template will still be saved, but may not deploy properly to SharePoint.")
+        print("\n⚠️  Template was saved, but may not deploy properly to SharePoint.")
     
-    # Save XML file
     try:
-        filepath = save_xml(xml_content)
-        print(f"💾 Saved: {filepath.absolute()}")
-        print(f"📏 File size: {filepath.stat().st_size:,} bytes")
-        
-        # Save comprehensive report (JSON + XSD validation)
-        report_file = save_comprehensive_report(json_content, str(filepath.name), is_valid, validation_errors, timestamp)
+        # Save comprehensive report (JSON + XSD validation) once the verdict is in
+        validation_section = render_validation_results(is_valid, validation_errors, validation_cached,
+                                                       args.validation_tier)
+        report_file = write_comprehensive_report(report_parts, validation_section)
         print(f"📋 Comprehensive report saved: {report_file}")
-        
-        # Show success message with next steps
-        print("\n🎉 Success! Next steps:")
-        print("   1. Review the generated XML file")
-        print("   2. Upload to SharePoint using PnP PowerShell or CLI")
-        print("   3. Test the provisioning template")
-        
-        # Show ChatGPT setup hint if not available
-        if not api_key_available:
-            print("\n💡 Tip: For better parsing, create a .env file:")
-            print("   OPENAI_API_KEY=your-api-key-here")
-        
     except Exception as e:
         print(f"❌ Error saving file: {e}")
         sys.exit(1)
+    
+    if build_errors:
+        # The artifacts are written, but a rejected attribute still fails the run
+        sys.exit(1)
+    
+    # Show success message with next steps
+    print("\n🎉 Success! Next steps:")
+    print("   1. Review the generated XML file")
+    print("   2. Upload to SharePoint using PnP PowerShell or CLI")
+    print("   3. Test the provisioning template")
+    
+    # Show ChatGPT setup hint if not available
+    if not api_key_available:
+        print("\n💡 Tip: For better parsing, create a .env file:")
+        print("   OPENAI_API_KEY=your-api-key-here")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
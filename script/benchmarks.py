@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Benchmarks and self-checks for generate_template.py
+
+These measure and check the generator rather than generate templates, so they live outside
+the production script. Run them from the directory holding the XSD files.
+
+Usage:
+    python script/benchmarks.py build 50                        # string vs in-memory build + validate
+    python script/benchmarks.py startup 5                       # module import time and lazy imports
+    python script/benchmarks.py connections 20 --concurrency 4  # pooled keep-alive LLM connections
+    python script/benchmarks.py pruned-xsd ProvisioningSchema-2022-09.pruned.xsd
+"""
+
+import sys
+import io
+import argparse
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Any
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from generate_template import (
+    DEFAULT_SCHEMA_VERSION, LXML_AVAILABLE, OPENAI_AVAILABLE, SCHEMA_REGISTRY,
+    add_field_ids, build_pnp_tree, close_llm_clients, fallback_generate_structure, get_xsd_schema,
+    llm_generate_structure, pnp_tree_to_xml, structure_to_pnp_xml, validate_xml_against_xsd,
+    validate_xml_tree
+)
+
+def pruned_xsd_sample_documents() -> List[tuple]:
+    """
+    Build (label, xml) pairs covering the templates the generator produces: fallback
+    structures, themed team and communication sites, any saved llm-outputs/*.json and
+    a few deliberately broken variants that both schemas must reject.
+    """
+    descriptions = [
+        "Create a communication site for HR policies with document library",
+        "Team site for project management with a document library called \"Project Files\"",
+        "Educational hub with class materials and events calendar",
+    ]
+    structures = []
+    for description in descriptions:
+        structure, _ = fallback_generate_structure(description)
+        structures.append((f"fallback: {description}", structure))
+    
+    for site_type in ("team", "communication"):
+        structure, _ = fallback_generate_structure(f"{site_type} site with a library called 'Records'")
+        structure["site_type"] = site_type
+        structure["theme"] = {"name": "SampleTheme", "primary_color": "#d13438", "is_inverted": False}
+        structure["features"] = ["87294c72-f260-42f3-a41b-981a2ffce37a"]
+        structure["lists"].append({
+            "title": "Tasks", "template_type": 107, "url": "Lists/Tasks",
+            "views": [{"name": "Open", "display_name": "Open Tasks", "fields": ["LinkTitle", "DocumentStatus"],
+                       "query": "<Where><Eq><FieldRef Name='DocumentStatus'/><Value Type='Choice'>Draft</Value></Eq></Where>"}]
+        })
+        structures.append((f"themed {site_type} site", structure))
+    
+    for json_file in sorted(Path("llm-outputs").glob("*.json")):
+        try:
+            structure = json.loads(json_file.read_text(encoding="utf-8"))
+            add_field_ids(structure)
+            structures.append((str(json_file), structure))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            continue
+    
+    documents = []
+    for label, structure in structures:
+        try:
+            documents.append((label, structure_to_pnp_xml(structure)))
+        except Exception:
+            continue
+    
+    # Broken variants: bad enumeration value, unknown attribute, element the generator never emits
+    if documents:
+        label, xml_content = documents[0]
+        documents.append((f"{label} [bad TemplateType]", re.sub(r'TemplateType="\d+"', 'TemplateType="abc"', xml_content, count=1)))
+        documents.append((f"{label} [unknown attribute]", xml_content.replace("<pnp:WebSettings ", '<pnp:WebSettings Bogus="1" ', 1)))
+        documents.append((f"{label} [unexpected element]", xml_content.replace("<pnp:Lists>", "<pnp:Lists><pnp:Unknown/>", 1)))
+    
+    return documents
+
+def compare_schema_verdicts(documents: List[tuple], full_xsd_path: str, pruned_xsd_path: str) -> List[str]:
+    """
+    Validate each (label, xml) document against both schemas.
+    Returns a description of every document on which the verdicts differ.
+    """
+    mismatches = []
+    for label, xml_content in documents:
+        full_valid, full_errors = validate_xml_against_xsd(xml_content, full_xsd_path)
+        pruned_valid, pruned_errors = validate_xml_against_xsd(xml_content, pruned_xsd_path)
+        if full_valid != pruned_valid:
+            detail = (full_errors or pruned_errors)[:1]
+            mismatches.append(f"{label}: full={full_valid} pruned={pruned_valid} {detail}")
+    return mismatches
+
+
+def run_check_pruned_xsd(pruned_xsd_path: str, xsd_path: str) -> int:
+    """Check a pruned schema (see --build-pruned-xsd) gives the same verdicts as the full one"""
+    if not LXML_AVAILABLE:
+        print("❌ lxml package not available; cannot compare schemas")
+        return 1
+    
+    documents = pruned_xsd_sample_documents()
+    mismatches = compare_schema_verdicts(documents, xsd_path, pruned_xsd_path)
+    if mismatches:
+        print(f"❌ Verdicts differ on {len(mismatches)} of {len(documents)} sample template(s):")
+        for mismatch in mismatches:
+            print(f"   - {mismatch}")
+        return 1
+    
+    print(f"✅ Same verdicts as the full schema on {len(documents)} sample template(s)")
+    return 0
+
+def benchmark_xml_pipeline(structure: Dict[str, Any], iterations: int = 50,
+                           xsd_path: str = "ProvisioningSchema-2022-09.xsd") -> Dict[str, Dict[str, float]]:
+    """
+    Compare the original pipeline (ElementTree build, minidom pretty-print, string reparsed by lxml
+    for validation) against the in-memory lxml tree (validated directly, serialized once for writing).
+    Returns mean wall time (ms) and peak tracemalloc memory (KB, Python heap only) per template for each path.
+    """
+    import tracemalloc
+    
+    def string_path():
+        xml_content = pnp_tree_to_xml(build_pnp_tree(structure, use_lxml=False))
+        validate_xml_against_xsd(xml_content, xsd_path)
+    
+    def tree_path():
+        xml_tree = build_pnp_tree(structure)
+        validate_xml_tree(xml_tree, xsd_path)
+        pnp_tree_to_xml(xml_tree)
+    
+    # Warm the schema cache so both paths measure per-template cost only
+    get_xsd_schema(xsd_path)
+    
+    results = {}
+    for name, run in (("serialize_reparse", string_path), ("in_memory_tree", tree_path)):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            run()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / iterations
+        
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {"wall_ms": elapsed_ms, "peak_kb": peak / 1024}
+    
+    return results
+
+def run_benchmark_build(iterations: int, xsd_path: str) -> int:
+    """Print benchmark_xml_pipeline results for a ten-library sample template"""
+    if not LXML_AVAILABLE:
+        print("❌ lxml package not available; nothing to benchmark")
+        return 1
+    
+    structure, _ = fallback_generate_structure("team site with a library called 'Records'")
+    structure["theme"] = {"name": "BenchmarkTheme", "primary_color": "#0078d4"}
+    structure["lists"] = [dict(structure["lists"][0], title=f"Library {i}", url=f"Library{i}")
+                          for i in range(10)]
+    
+    results = benchmark_xml_pipeline(structure, iterations, xsd_path)
+    print(f"⏱️  Build + validate, {iterations} iteration(s), 10 lists per template:")
+    for name, result in results.items():
+        print(f"   {name:<18} {result['wall_ms']:8.2f} ms   peak {result['peak_kb']:8.1f} KB")
+    return 0
+
+STARTUP_IMPORT_BUDGET_MS = 150
+# The OpenAI SDK's HTTP stack is httpx or, in newer releases, httpx2; both must stay unloaded
+STARTUP_FORBIDDEN_MODULES = ("openai", "httpx", "httpx2", "pydantic", "lxml", "dotenv", "asyncio",
+                             "xml.dom.minidom")
+
+def measure_startup_imports(runs: int = 5) -> Dict[str, Any]:
+    """
+    Import this module in fresh interpreters under python -X importtime.
+    Returns the median import time (ms), the slowest direct imports of the last run and
+    any STARTUP_FORBIDDEN_MODULES that were imported eagerly.
+    """
+    code = f"import sys; sys.path.insert(0, {REPO_DIR!r}); import generate_template"
+    totals = []
+    for _ in range(max(1, runs)):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                capture_output=True, text=True, check=True)
+        imports = []
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            name = parts[2].rstrip()
+            imports.append((name.strip(), len(name) - len(name.lstrip()), int(parts[1]) / 1000))
+        totals.append(next(ms for name, depth, ms in imports if name == "generate_template"))
+    
+    # Direct imports of the module are listed one level deeper than it
+    direct = sorted(((ms, name) for name, depth, ms in imports if depth == 3), reverse=True)
+    loaded = {name for name, depth, ms in imports}
+    return {
+        "median_ms": sorted(totals)[len(totals) // 2],
+        "slowest": direct[:5],
+        "forbidden": [m for m in STARTUP_FORBIDDEN_MODULES if m in loaded]
+    }
+
+def run_benchmark_startup(runs: int, budget_ms: float = STARTUP_IMPORT_BUDGET_MS) -> int:
+    """Print measure_startup_imports results; non-zero exit when over budget or heavy modules load eagerly"""
+    result = measure_startup_imports(runs)
+    print(f"⏱️  Module import, median of {runs} run(s): {result['median_ms']:.1f} ms (budget {budget_ms:.0f} ms)")
+    for ms, name in result["slowest"]:
+        print(f"   {name:<24} {ms:8.1f} ms")
+    
+    failed = False
+    if result["forbidden"]:
+        print(f"❌ Imported at start-up: {', '.join(result['forbidden'])}")
+        failed = True
+    if result["median_ms"] > budget_ms:
+        print(f"❌ Import time over budget by {result['median_ms'] - budget_ms:.1f} ms")
+        failed = True
+    if not failed:
+        print("✅ Start-up within budget; heavy dependencies are loaded on first use")
+    return 1 if failed else 0
+
+def measure_llm_connections(requests: int = 20, concurrency: int = 4) -> Dict[str, int]:
+    """
+    Send structure requests through create_llm_client to a local stub of the chat completions
+    endpoint and count the TCP connections it accepts: requests one at a time, then the same
+    number from concurrency threads. Needs the openai package but no network or API key.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from contextlib import redirect_stdout
+    
+    structure, _ = fallback_generate_structure("team site with a document library")
+    content = json.dumps(structure)
+    counts = {"connections": 0, "requests": 0}
+    lock = threading.Lock()
+    
+    class StubCompletions(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        
+        def setup(self):
+            super().setup()
+            with lock:
+                counts["connections"] += 1
+        
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with lock:
+                counts["requests"] += 1
+            body = json.dumps({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": request.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletions)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    saved_env = {name: os.environ.get(name) for name in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-local-stub"
+    
+    def generate(i):
+        llm_generate_structure(f"connection check {i}", use_cache=False, similarity_threshold=0)
+    
+    try:
+        with redirect_stdout(io.StringIO()):
+            for i in range(requests):
+                generate(i)
+            sequential = counts["connections"]
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                list(executor.map(generate, range(requests, 2 * requests)))
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        close_llm_clients()
+        server.shutdown()
+        server.server_close()
+    
+    return {"requests": counts["requests"], "sequential_connections": sequential,
+            "concurrent_connections": counts["connections"] - sequential}
+
+def run_benchmark_connections(requests: int, concurrency: int) -> int:
+    """Print measure_llm_connections results; non-zero exit when connections are not reused"""
+    if not OPENAI_AVAILABLE:
+        print("❌ openai package not available; nothing to check")
+        return 1
+    result = measure_llm_connections(requests, concurrency)
+    print(f"🔌 {result['requests']} structure request(s) against a local stub endpoint:")
+    print(f"   {requests} sequential: {result['sequential_connections']} connection(s)")
+    print(f"   {requests} from {concurrency} threads: {result['concurrent_connections']} new connection(s)")
+    if result["requests"] != 2 * requests:
+        print("❌ Not every request reached the stub endpoint")
+        return 1
+    if result["sequential_connections"] > 1 or result["concurrent_connections"] > concurrency:
+        print("❌ Connections are not reused")
+        return 1
+    print("✅ Connection count stays flat; requests reuse pooled keep-alive connections")
+    return 0
+
+def main():
+    """
+    Benchmarks CLI entry point.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks and self-checks for generate_template.py")
+    parser.add_argument("--xsd", default=SCHEMA_REGISTRY[DEFAULT_SCHEMA_VERSION]["xsd"], metavar="PATH",
+                        help="Full PnP schema to validate against")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    build = commands.add_parser("build", help="Time N builds of a sample template through the string "
+                                              "and in-memory validation paths")
+    build.add_argument("iterations", type=int, metavar="N")
+    
+    startup = commands.add_parser("startup", help=f"Measure module import time over N fresh interpreters "
+                                                  f"(python -X importtime) and fail above "
+                                                  f"{STARTUP_IMPORT_BUDGET_MS} ms or if heavy dependencies "
+                                                  f"load eagerly")
+    startup.add_argument("runs", type=int, metavar="N")
+    
+    connections = commands.add_parser("connections", help="Send N sequential and N concurrent structure "
+                                                          "requests to a local stub endpoint and check the "
+                                                          "TCP connection count stays flat")
+    connections.add_argument("requests", type=int, metavar="N")
+    connections.add_argument("--concurrency", type=int, default=4, metavar="N",
+                             help="Threads sending the concurrent requests (default: 4)")
+    
+    pruned = commands.add_parser("pruned-xsd", help="Check a pruned schema gives the same verdicts as --xsd "
+                                                    "on sample templates")
+    pruned.add_argument("pruned_xsd", metavar="PATH")
+    
+    args = parser.parse_args()
+    if args.command == "build":
+        sys.exit(run_benchmark_build(args.iterations, args.xsd))
+    if args.command == "startup":
+        sys.exit(run_benchmark_startup(args.runs))
+    if args.command == "connections":
+        sys.exit(run_benchmark_connections(args.requests, args.concurrency))
+    sys.exit(run_check_pruned_xsd(args.pruned_xsd, args.xsd))
+
+if __name__ == "__main__":
+    main()